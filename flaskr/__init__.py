@@ -1,8 +1,9 @@
-from flaskr import pages
+from flaskr import backend, pages
 
 from flask import Flask
 
 import logging
+import os
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -18,6 +19,64 @@ def create_app(test_config=None):
     # By default the dev environment uses the key 'dev'
     app.config.from_mapping(SECRET_KEY='dev',)
 
+    # Set SHARDED_USERS to True once "flask migrate-users" has copied the
+    # user records out of info.json into one blob per user.
+    app.config.from_mapping(SHARDED_USERS=False)
+
+    # STORAGE_BACKEND selects where the buckets are stored: "gcs", "local"
+    # for directories under LOCAL_STORAGE_ROOT, or "memory" for benchmarks
+    # (see flaskr/storage.py).
+    app.config.from_mapping(STORAGE_BACKEND="gcs",
+                            LOCAL_STORAGE_ROOT=os.path.join(
+                                app.instance_path, "storage"),
+                            LOCAL_STORAGE_MMAP=False,
+                            MEMORY_STORAGE_LATENCY=0,
+                            MEMORY_STORAGE_JITTER=0,
+                            MEMORY_STORAGE_ERROR_RATE=0)
+
+    # STORAGE_METRICS records every storage call for the /metrics endpoint and
+    # SERVER_TIMING adds a Server-Timing header to every response.
+    app.config.from_mapping(STORAGE_METRICS=True, SERVER_TIMING=False)
+
+    # EMBED_PAGE_NAMES renders every page name into a datalist on every page.
+    # The search bar loads its suggestions from /api/suggest, so it is off:
+    # on, the responses grow with the number of pages and every upload or
+    # delete invalidates every cached render of the wiki pages.
+    app.config.from_mapping(EMBED_PAGE_NAMES=False)
+
+    # PAGE_CACHE_MAX_AGE is the number of seconds browsers and CDNs may show a
+    # wiki page to logged out users before checking if it changed.
+    app.config.from_mapping(PAGE_CACHE_MAX_AGE=0)
+
+    # PAGE_CACHE_BYTES is how much page content is kept in memory, 0 to
+    # download every page on every read.
+    app.config.from_mapping(PAGE_CACHE_BYTES=backend.PAGE_CACHE_BYTES)
+
+    # RENDER_CACHE_BYTES is how much rendered HTML of logged out views of the
+    # wiki pages is kept in memory, 0 to render them on every request.
+    app.config.from_mapping(RENDER_CACHE_BYTES=32 * 1024 * 1024)
+
+    # Wiki pages of STREAM_PAGE_BYTES or more are streamed to the browser in
+    # chunks instead of being read whole into memory. None never streams.
+    app.config.from_mapping(STREAM_PAGE_BYTES=1024 * 1024)
+
+    # MAX_CONTENT_LENGTH is the largest request body accepted, so too large
+    # uploads are rejected from their Content-Length before being read.
+    app.config.from_mapping(MAX_CONTENT_LENGTH=32 * 1024 * 1024)
+
+    # DEDUP_PAGES stores the content of uploaded pages once per distinct
+    # content. Pages uploaded either way can always be read.
+    app.config.from_mapping(DEDUP_PAGES=True)
+
+    # COMPRESS_PAGES stores uploaded pages gzip compressed, and they are
+    # decompressed as they are read.
+    app.config.from_mapping(COMPRESS_PAGES=True)
+
+    # DISK_CACHE_DIR is a directory where the worker processes share cached
+    # pages and page names, so they survive restarts. None turns it off.
+    app.config.from_mapping(DISK_CACHE_DIR=None,
+                            DISK_CACHE_BYTES=512 * 1024 * 1024)
+
     if test_config is None:
         # Load the instance config, if it exists, when not testing.
         # This file is not committed. Place it in production deployments.
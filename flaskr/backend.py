@@ -1,6 +1,84 @@
-from google.cloud import storage
+from flask import g, has_app_context
+from flaskr import cache, search, storage
+from google.api_core import exceptions
+import bisect
+from concurrent import futures
+import gzip
+import hashlib
 import json
+import logging
 import random
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+
+# Number of seconds a listing of the content bucket is considered fresh.
+PAGE_NAMES_TTL = 30
+# Number of seconds the parsed JSON files are trusted without checking their generation on GCS.
+JSON_TTL = 0
+# Most bytes of JSON files kept parsed in memory, counted by their serialized size.
+JSON_CACHE_BYTES = 16 * 1024 * 1024
+# Prefix of the blobs holding one user's record each when the user records are sharded.
+USERS_PREFIX = "users/"
+# Number of attempts at a read-modify-write of a JSON file before giving up because of concurrent writers.
+JSON_WRITE_RETRIES = 10
+# Seconds of the first random backoff after a concurrent write, doubled on every attempt.
+JSON_RETRY_DELAY = 0.01
+# Seconds a commit to a shared JSON file waits for more changes to join its group.
+WRITE_BATCH_WINDOW = 0.005
+# Name of the segment file holding the full-text index of the pages in the content bucket.
+SEARCH_INDEX_BLOB = "search-index.seg"
+# Number of seconds the cached full-text index is searched without checking if another process changed it.
+SEARCH_INDEX_TTL = 5
+# Prefix of the delta segment files, each holding one page uploaded or deleted since the segment file was saved.
+SEARCH_DELTAS_PREFIX = "search-index/"
+# Number of delta segment files after which they are merged into the segment file on a background thread.
+SEARCH_MERGE_DELTAS = 16
+# Number of pages downloaded at the same time while the whole full-text index is built.
+SEARCH_BUILD_IN_FLIGHT = 32
+# Metadata key of the segment file listing the delta segment files merged into it that may not be deleted yet.
+MERGED_DELTAS_KEY = "merged"
+# Most bytes of page content kept in memory by get_wiki_page.
+PAGE_CACHE_BYTES = 64 * 1024 * 1024
+# Key of the listing of the page names in the disk cache.
+PAGE_NAMES_CACHE_KEY = "page-names"
+# Bytes of page content downloaded by each ranged read of stream_wiki_page.
+STREAM_CHUNK_BYTES = 256 * 1024
+# Bytes sent by each request of a resumable upload. GCS requires a multiple of 256 KiB.
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+# Prefix of the blobs holding the content of deduplicated pages, named after its SHA-256.
+OBJECTS_PREFIX = "objects/"
+# Prefix of the JSON records counting the pages that point to each content object, one record per object.
+REFS_PREFIX = "refs/"
+# Blob metadata keys of a page: the SHA-256 of the content object it points to, the size of its decoded content, and
+# the Content-Encoding and stored size of the content object.
+CONTENT_HASH_KEY = "sha256"
+CONTENT_SIZE_KEY = "size"
+CONTENT_ENCODING_KEY = "encoding"
+STORED_SIZE_KEY = "stored_size"
+# Bytes read at a time while hashing and compressing an uploaded file.
+HASH_CHUNK_BYTES = 1024 * 1024
+# Compression level of the stored pages. Pages are compressed once and read many times, so the best level is used.
+GZIP_LEVEL = 9
+
+
+def _user_metadata(user):
+    """Returns the blob metadata stored along with a sharded user record."""
+    return {"files_uploaded": str(len(user["files_uploaded"]))}
+
+
+def _gunzip(chunks):
+    """Decompresses gzip compressed chunks of bytes one chunk at a time."""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
 
 
 class Backend:
@@ -13,18 +91,257 @@ class Backend:
     Atrributes:
         password_b: the name of the bucket where the username is stored inside of a blob and the content is the hashed password.
         content_b: the name of the bucket where the uploaded files are stored.
-        storage_client: creates the connection with GCS.
+        storage_client: the Storage the buckets come from, GCS unless another one is given.
         content_bucket: connection to the content bucket on GCS.
         password_bucket: connection to the password bucket on GCS.
+        page_names_ttl: seconds before the cached page names are refreshed in the background.
+        json_ttl: seconds the cached JSON files are used before checking if they changed on GCS.
+        sharded_users: True to store each user's record in its own blob under users/ instead of in info.json.
+        json_write_retries: attempts at writing a JSON file before a conflict with other writers is raised.
+        write_batch_window: seconds a commit to info.json or website_info.json waits for more changes to group.
+        search_index_ttl: seconds the cached full-text index is searched before checking if it changed on GCS.
+        dedup_pages: True to store the content of uploaded pages once per distinct content, under objects/.
+        compress_pages: True to store the content of uploaded pages gzip compressed, with a gzip Content-Encoding.
+        page_cache: the LRUCache of the content of the most read pages, None if page_cache_bytes is 0.
+        disk_cache: the DiskCache of page content and page names shared with the other processes, None to not use one.
+        metrics: the StorageMetrics recording every call to the buckets, None to not record them.
     """
 
-    def __init__(self):
-        """Initializes the GCS and sets the password and content bucket."""
-        self.storage_client = storage.Client()
-        self.password_b = "usersandpasswords"
-        self.content_b = "awesomewikicontent"
+    def __init__(self,
+                 storage_client=None,
+                 password_b="usersandpasswords",
+                 content_b="awesomewikicontent",
+                 page_names_ttl=PAGE_NAMES_TTL,
+                 json_ttl=JSON_TTL,
+                 sharded_users=False,
+                 json_write_retries=JSON_WRITE_RETRIES,
+                 write_batch_window=WRITE_BATCH_WINDOW,
+                 search_index_ttl=SEARCH_INDEX_TTL,
+                 page_cache_bytes=PAGE_CACHE_BYTES,
+                 disk_cache=None,
+                 metrics=None,
+                 dedup_pages=True,
+                 compress_pages=True):
+        """Initializes the storage and sets the password and content bucket."""
+        self.storage_client = storage_client or storage.GCSStorage()
+        self.password_b = password_b
+        self.content_b = content_b
         self.password_bucket = self.storage_client.bucket(self.password_b)
         self.content_bucket = self.storage_client.bucket(self.content_b)
+        self.metrics = metrics
+        if metrics is not None:
+            self.password_bucket = metrics.instrument(self.password_bucket)
+            self.content_bucket = metrics.instrument(self.content_bucket)
+        self.page_names_ttl = page_names_ttl
+        self._page_names = None
+        self._page_names_listed_at = 0
+        self._page_names_generation = 0
+        self._page_names_refreshing = False
+        self._page_names_lock = threading.Lock()
+        self._name_index = search.NameIndex()
+        self.json_ttl = json_ttl
+        self._json_cache = cache.LRUCache(JSON_CACHE_BYTES)
+        self._contributors = None
+        self._contributors_listed_at = 0
+        self._contributors_generation = 0
+        self._contributors_lock = threading.Lock()
+        self.sharded_users = sharded_users
+        self.json_write_retries = json_write_retries
+        self.write_batch_window = write_batch_window
+        self._pending_changes = {}
+        self._pending_lock = threading.Lock()
+        self._commit_locks = {
+            "info.json": threading.Lock(),
+            "website_info.json": threading.Lock()
+        }
+        self.dedup_pages = dedup_pages
+        self.compress_pages = compress_pages
+        self.search_index_ttl = search_index_ttl
+        self._search_index = None
+        self._search_index_generation = None
+        self._search_index_checked_at = 0
+        self._search_deltas = set()
+        self._merged_search_deltas = set()
+        self._search_index_busy = False
+        self._search_index_lock = threading.Lock()
+        self.page_cache = None
+        if page_cache_bytes:
+            self.page_cache = cache.LRUCache(page_cache_bytes)
+        self.disk_cache = disk_cache
+
+    def _load_json(self, name):
+        """Downloads and parses one of the JSON files in the content bucket.
+
+        Args:
+            name: the name of the JSON file, either info.json or website_info.json.
+
+        Returns:
+            The blob of the JSON file and a dictionary with its parsed content.
+        """
+        json_blob = self.content_bucket.get_blob(name)
+        json_str = json_blob.download_as_bytes().decode()
+        return json_blob, json.loads(json_str)
+
+    def _read_json(self, name):
+        """Retrieves the parsed content of one of the JSON files for reading only.
+
+        While handling a request, the parsed content is kept in flask.g so every Backend method called during the
+        same request reads the JSON file from GCS at most once.
+
+        Args:
+            name: the name of the JSON file, either info.json or website_info.json.
+
+        Returns:
+            A dictionary with the parsed content of the JSON file. It must not be modified.
+        """
+        if not has_app_context():
+            return self._get_cached_json(name)
+        snapshots = g.setdefault("backend_json", {})
+        if name not in snapshots:
+            snapshots[name] = self._get_cached_json(name)
+        return snapshots[name]
+
+    def _get_cached_json(self, name):
+        """Retrieves the parsed content of one of the JSON files from the cache shared by all requests.
+
+        The cached copy is revalidated by fetching only the metadata of the blob and comparing its generation, so the
+        file is downloaded and parsed again only when it changed. Within json_ttl seconds of the last check it is used
+        without contacting GCS at all.
+
+        Args:
+            name: the name of the JSON file, either info.json or website_info.json.
+
+        Returns:
+            A dictionary with the parsed content of the JSON file. It must not be modified.
+        """
+        # The generation is part of the cached value, since it is only known once the blob is fetched.
+        cached = self._json_cache.get(name, None)
+        if cached is not None:
+            generation, json_dict, checked_at, size = cached
+            if time.monotonic() - checked_at < self.json_ttl:
+                return json_dict
+        json_blob = self.content_bucket.get_blob(name)
+        if cached is not None and json_blob.generation == generation:
+            self._remember_json(name, generation, json_dict, size)
+            return json_dict
+        json_bytes = json_blob.download_as_bytes()
+        json_dict = json.loads(json_bytes.decode())
+        self._remember_json(name, json_blob.generation, json_dict,
+                            len(json_bytes))
+        return json_dict
+
+    def _remember_json(self, name, generation, json_dict, size):
+        """Stores the parsed content of one of the JSON files in the cache shared by all requests.
+
+        Args:
+            name: the name of the JSON file, either info.json or website_info.json.
+            generation: the generation of the blob the content was read from or written to.
+            json_dict: the parsed content of the JSON file.
+            size: the size of the JSON file in bytes.
+        """
+        self._json_cache.put(name, None,
+                             (generation, json_dict, time.monotonic(), size),
+                             size)
+
+    def _save_json(self, name, json_blob, json_dict, if_generation_match=None):
+        """Uploads the modified content of one of the JSON files and updates the cached copies.
+
+        Args:
+            name: the name of the JSON file, either info.json or website_info.json.
+            json_blob: the blob of the JSON file.
+            json_dict: the modified content of the JSON file.
+            if_generation_match: only upload if the blob on GCS still has this generation, 0 if it must not exist yet.
+
+        Raises:
+            google.api_core.exceptions.PreconditionFailed: the blob was changed by someone else.
+        """
+        mod_json_data = json.dumps(json_dict)
+        json_blob.upload_from_string(mod_json_data,
+                                     content_type="application/json",
+                                     if_generation_match=if_generation_match)
+        self._remember_json(name, json_blob.generation, json_dict,
+                            len(mod_json_data))
+        if has_app_context():
+            g.setdefault("backend_json", {})[name] = json_dict
+
+    def _modify_json(self, name, mutate, metadata=None):
+        """Applies a change to one of the JSON files without losing the changes of concurrent writers.
+
+        Changes to info.json and website_info.json are committed in groups: while one change is being uploaded, the
+        changes requested by other threads wait in a queue, and the next one to commit applies all of them with a
+        single upload. Each caller waits until the group holding its change has been committed.
+
+        Args:
+            name: the name of the JSON file.
+            mutate: a function receiving the parsed content of the file that modifies it in place.
+                It can be called several times, so it must not have other side effects.
+            metadata: an optional function returning the blob metadata to store for the modified content.
+
+        Returns:
+            The value returned by mutate.
+
+        Raises:
+            google.api_core.exceptions.PreconditionFailed: the file kept changing for json_write_retries attempts.
+        """
+        change = (mutate, futures.Future())
+        if name not in self._commit_locks:
+            self._commit_json(name, [change], metadata)
+        else:
+            with self._pending_lock:
+                self._pending_changes.setdefault(name, []).append(change)
+            with self._commit_locks[name]:
+                if not change[1].done():
+                    time.sleep(self.write_batch_window)
+                    with self._pending_lock:
+                        changes = self._pending_changes.pop(name)
+                    self._commit_json(name, changes, metadata)
+        result, json_dict = change[1].result()
+        if has_app_context():
+            g.setdefault("backend_json", {})[name] = json_dict
+        return result
+
+    def _commit_json(self, name, changes, metadata=None):
+        """Applies a group of changes to one of the JSON files with a single upload.
+
+        The file is uploaded only if its generation is still the one that was read. When another writer got there
+        first, the file is read again and every change is applied to the new content, after a random backoff.
+
+        Args:
+            name: the name of the JSON file.
+            changes: a list of tuples of a mutate function and the Future receiving its result and the new content.
+                A mutate function that raises an exception must leave the content unchanged.
+            metadata: an optional function returning the blob metadata to store for the modified content.
+        """
+        try:
+            for attempt in range(self.json_write_retries):
+                json_blob, json_dict = self._load_json(name)
+                outcomes = []
+                for mutate, _ in changes:
+                    try:
+                        outcomes.append((mutate(json_dict), None))
+                    except Exception as error:
+                        outcomes.append((None, error))
+                if metadata is not None:
+                    json_blob.metadata = metadata(json_dict)
+                try:
+                    self._save_json(name,
+                                    json_blob,
+                                    json_dict,
+                                    if_generation_match=json_blob.generation)
+                    break
+                except exceptions.PreconditionFailed:
+                    if attempt + 1 == self.json_write_retries:
+                        raise
+                    time.sleep(random.uniform(0, JSON_RETRY_DELAY * 2**attempt))
+        except Exception as error:
+            for _, future in changes:
+                future.set_exception(error)
+            return
+        for (result, error), (_, future) in zip(outcomes, changes):
+            if error is None:
+                future.set_result((result, json_dict))
+            else:
+                future.set_exception(error)
 
     def get_wiki_page(self, name):
         """Using the name passed as argument, it will retrieve the data from GCS that corresponds to that file.
@@ -32,14 +349,430 @@ class Backend:
         Args:
             name: the name of the wiki page that is being looked up on the GCS content bucket.
 
+        Only the metadata of the blob is retrieved when the page_cache or the disk_cache holds the current generation
+        of the page. Deduplicated pages are cached under their content object, so pages with the same content share
+        one cached copy. Compressed pages are downloaded and kept in the disk cache compressed.
+
         Returns:
             A string with all the content of the wiki page requested.
+
+        Raises:
+            google.api_core.exceptions.NotFound: if the page does not exist.
+        """
+        blob = self.content_bucket.get_blob(name)
+        if blob is None:
+            raise exceptions.NotFound(f"No wiki page named {name}")
+        source, key, generation, encoding, _ = self._content_source(blob)
+        if self.page_cache is not None:
+            content = self.page_cache.get(key, generation)
+            if content is not None:
+                return content
+        data = None
+        if self.disk_cache is not None:
+            data = self.disk_cache.get(f"pages/{key}", generation)
+        if data is None:
+            data = source.download_as_bytes(raw_download=True)
+            if self.disk_cache is not None:
+                self.disk_cache.put(f"pages/{key}", generation, data)
+        if encoding == "gzip":
+            data = gzip.decompress(data)
+        content = data.decode()
+        if self.page_cache is not None:
+            self.page_cache.put(key, generation, content, len(data))
+        return content
+
+    def _content_source(self, blob):
+        """Finds where the content of a page blob is stored.
+
+        Args:
+            blob: the blob of the page, with its metadata.
+
+        Returns:
+            A tuple of the blob holding the content, the key caching it, the version of the cached content, the
+            Content-Encoding of the stored content and its stored size. For a page pointing to a content object, these
+            are the object, its name and its SHA-256, since objects never change, and the encoding and size recorded
+            in the page metadata. Other pages hold their own content.
+        """
+        metadata = blob.metadata or {}
+        digest = metadata.get(CONTENT_HASH_KEY)
+        if digest is None:
+            return blob, blob.name, blob.generation, blob.content_encoding, blob.size
+        object_name = f"{OBJECTS_PREFIX}{digest}"
+        return (self.content_bucket.blob(object_name), object_name, digest,
+                metadata.get(CONTENT_ENCODING_KEY),
+                int(metadata.get(STORED_SIZE_KEY, metadata[CONTENT_SIZE_KEY])))
+
+    def get_page_version(self, name):
+        """Retrieves the version of a wiki page from the blob metadata, without downloading its content.
+
+        Args:
+            name: the name of the wiki page.
+
+        Returns:
+            A tuple of the generation, the base64 encoded MD5, the datetime of the last upload and the size in bytes of
+            the page, or None if the page does not exist.
+        """
+        blob = self.content_bucket.get_blob(name)
+        if blob is None:
+            return None
+        size = blob.size
+        if CONTENT_SIZE_KEY in (blob.metadata or {}):
+            size = int(blob.metadata[CONTENT_SIZE_KEY])
+        return blob.generation, blob.md5_hash, blob.updated, size
+
+    def stream_wiki_page(self,
+                         name,
+                         generation,
+                         chunk_size=STREAM_CHUNK_BYTES,
+                         accept_gzip=False):
+        """Reads the content of one version of a wiki page in chunks, so the whole page is never held in memory.
+
+        Each chunk is a ranged read of that generation of the blob, or of the content object the page points to. The
+        caches are bypassed, since the pages worth streaming would evict many smaller ones. Compressed pages are
+        decompressed chunk by chunk, unless the caller accepts gzip, in which case the stored bytes are passed through.
+
+        Args:
+            name: the name of the wiki page.
+            generation: the generation of the page, from get_page_version.
+            chunk_size: the number of bytes read at a time.
+            accept_gzip: True if gzip compressed chunks can be returned. Only for a response body made of the page alone,
+                since many browsers decode only the first gzip member of a body.
+
+        Returns:
+            A tuple of the Content-Encoding of the chunks, None if they are not encoded, the total number of bytes of
+            the chunks, and an iterator over the chunks of bytes.
+
+        Raises:
+            google.api_core.exceptions.PreconditionFailed: if the page is not at that generation, right away, or if it
+                is uploaded again while it is streamed, from the iterator.
         """
         blob = self.content_bucket.get_blob(name)
-        return blob.download_as_bytes().decode()
+        if blob is None or blob.generation != generation:
+            raise exceptions.PreconditionFailed(
+                f"{name} is not at generation {generation}")
+        source, _, _, encoding, stored_size = self._content_source(blob)
+        # Content objects never change, only the page's own content needs the precondition.
+        if_generation_match = generation if source is blob else None
+
+        def read():
+            for start in range(0, stored_size, chunk_size):
+                yield source.download_as_bytes(
+                    start=start,
+                    end=min(start + chunk_size, stored_size) - 1,
+                    raw_download=True,
+                    if_generation_match=if_generation_match)
+
+        if encoding != "gzip":
+            return None, stored_size, read()
+        if accept_gzip:
+            return "gzip", stored_size, read()
+        return None, int(blob.metadata[CONTENT_SIZE_KEY]), _gunzip(read())
 
     def get_all_page_names(self):
-        """Retrieves all the uploaded pages from GCS.
+        """Retrieves all the uploaded pages, using the cached listing of the content bucket when possible.
+
+        Only the first call lists the bucket while the caller waits. Once the cached listing is older than
+        page_names_ttl, the stale names are returned right away and the listing is refreshed on a background thread.
+        With a disk_cache, the first call instead starts from the listing saved by any process and refreshes it.
+
+        Returns:
+            A list with all the page names that end with .html.
+        """
+        with self._page_names_lock:
+            if self._page_names is None and self.disk_cache is not None:
+                saved = self.disk_cache.get(PAGE_NAMES_CACHE_KEY, None)
+                if saved is not None:
+                    self._page_names = json.loads(saved)
+                    self._page_names_listed_at = time.monotonic(
+                    ) - self.page_names_ttl
+            page_names = self._page_names
+            if page_names is not None:
+                age = time.monotonic() - self._page_names_listed_at
+                if age >= self.page_names_ttl and not self._page_names_refreshing:
+                    self._page_names_refreshing = True
+                    threading.Thread(target=self._refresh_page_names,
+                                     daemon=True).start()
+                return list(page_names)
+        return list(self._refresh_page_names())
+
+    def search_page_names(self, term, limit=None):
+        """Finds the pages whose name contains the search term, ignoring case.
+
+        The cached page names are kept in a NameIndex, which is brought up to date whenever the cached names change.
+
+        Args:
+            term: the text to look for in the page names.
+            limit: the maximum number of names to return, None for all of them.
+
+        Returns:
+            A sorted list of the matching page names.
+        """
+        return self._updated_name_index().search(term, limit)
+
+    def suggest_page_names(self, term, limit=10):
+        """Suggests page names for a partially typed search term, see NameIndex.suggest.
+
+        Args:
+            term: the text typed so far.
+            limit: the maximum number of names to return.
+
+        Returns:
+            A list of page names, the best suggestion first.
+        """
+        return self._updated_name_index().suggest(term, limit)
+
+    def _updated_name_index(self):
+        """Returns the NameIndex, updated first if the cached page names changed since it was last used."""
+        page_names = self.get_all_page_names()
+        with self._page_names_lock:
+            if self._page_names is not None:
+                page_names = self._page_names
+        if self._name_index.source is not page_names:
+            self._name_index.update(page_names)
+        return self._name_index
+
+    def search_pages(self, query, limit=10):
+        """Finds the pages whose text best matches the query, using the full-text index.
+
+        Until the segment file is built, only the pages changed since are found.
+
+        Args:
+            query: the words to search for.
+            limit: the maximum number of pages to return.
+
+        Returns:
+            A list of page names, the best match first.
+        """
+        with self._search_index_lock:
+            age = time.monotonic() - self._search_index_checked_at
+            if self._search_index is None or age >= self.search_index_ttl:
+                self._read_search_index()
+            return self._search_index.search(query, limit)
+
+    def _read_search_index(self):
+        """Brings the cached full-text index up to date with the segment file and the delta segment files.
+
+        The segment file is only downloaded when it changed, and only the delta segment files that were not merged
+        yet are. The delta segment files are applied in the order of their names, which is the order they were written
+        in: finding one older than a delta segment file already applied, like one written by another process just
+        before our own last change, replays them all in order from the segment file.
+
+        As long as there is no segment file, every read starts indexing the pages on a background thread, unless that
+        is already running, so a failed build is retried. The caller must hold the search index lock.
+        """
+        while True:
+            blob = self.content_bucket.get_blob(SEARCH_INDEX_BLOB)
+            generation = None if blob is None else blob.generation
+            if blob is None:
+                self._start_search_index_task(self.build_search_index)
+            if self._search_index is None or generation != self._search_index_generation:
+                self._search_deltas = set()
+                self._merged_search_deltas = set()
+                if blob is None:
+                    self._search_index = search.ContentIndex()
+                else:
+                    try:
+                        data = blob.download_as_bytes(
+                            if_generation_match=generation)
+                    except (exceptions.NotFound, exceptions.PreconditionFailed):
+                        # Replaced by a merge since, read the new one.
+                        continue
+                    self._search_index = search.ContentIndex.loads(data)
+                    merged = (blob.metadata or {}).get(MERGED_DELTAS_KEY)
+                    if merged:
+                        self._merged_search_deltas = set(merged.split(","))
+                self._search_index_generation = generation
+            delta_blobs = sorted(
+                self.content_bucket.list_blobs(prefix=SEARCH_DELTAS_PREFIX),
+                key=lambda delta_blob: delta_blob.name)
+            unseen = [
+                delta_blob for delta_blob in delta_blobs
+                if delta_blob.name not in self._search_deltas |
+                self._merged_search_deltas
+            ]
+            if unseen and self._search_deltas and unseen[0].name < max(
+                    self._search_deltas):
+                self._search_index = None
+                continue
+            break
+        for delta_blob in unseen:
+            try:
+                delta = search.ContentIndex.loads(
+                    delta_blob.download_as_bytes())
+            except exceptions.NotFound:
+                # Merged and deleted since, the next read finds it in the segment file.
+                continue
+            self._search_index.merge(delta)
+            self._search_deltas.add(delta_blob.name)
+        self._merged_search_deltas &= {
+            delta_blob.name for delta_blob in delta_blobs
+        }
+        self._search_index_checked_at = time.monotonic()
+        if self._search_index_generation is not None and len(
+                self._search_deltas) >= SEARCH_MERGE_DELTAS:
+            self._start_search_index_task(self._merge_search_deltas)
+
+    def _start_search_index_task(self, target):
+        """Runs a build or a merge of the segment file on a background thread, unless one is already running.
+
+        The caller must hold the search index lock.
+        """
+        if self._search_index_busy:
+            return
+        self._search_index_busy = True
+
+        def run():
+            try:
+                target()
+            except Exception:
+                logging.exception("Could not save the full-text index.")
+            finally:
+                with self._search_index_lock:
+                    self._search_index_busy = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def build_search_index(self):
+        """Indexes the content of every page and saves it as the segment file, replacing the previous one.
+
+        This downloads every page, so it runs on a background thread when there is no segment file, or from the
+        "flask build-search-index" command. SEARCH_BUILD_IN_FLIGHT threads download the pages, skipping the pages
+        deleted since they were listed.
+
+        Returns:
+            The number of pages indexed, None if another process saved the segment file while they were indexed.
+        """
+        blob = self.content_bucket.get_blob(SEARCH_INDEX_BLOB)
+        generation = 0 if blob is None else blob.generation
+        # The pages of the delta segment files written so far are already uploaded, so they are indexed below.
+        merged = {
+            delta_blob.name for delta_blob in self.content_bucket.list_blobs(
+                prefix=SEARCH_DELTAS_PREFIX)
+        }
+        index = search.ContentIndex()
+        names = self._list_page_names()
+
+        def read_page(name):
+            try:
+                return self.get_wiki_page(name)
+            except exceptions.NotFound:
+                return None
+
+        with futures.ThreadPoolExecutor(
+                max_workers=SEARCH_BUILD_IN_FLIGHT) as executor:
+            for name, html in zip(names, executor.map(read_page, names)):
+                if html is not None:
+                    index.add(name, html)
+        try:
+            self._save_search_index(index.dumps(), generation, merged)
+        except exceptions.PreconditionFailed:
+            logging.info("The full-text index was saved by another process.")
+            return None
+        with self._search_index_lock:
+            self._search_index_checked_at = 0
+        return len(index)
+
+    def _merge_search_deltas(self):
+        """Merges the delta segment files into the segment file, then deletes them."""
+        with self._search_index_lock:
+            self._read_search_index()
+            generation = self._search_index_generation
+            if generation is None:
+                return
+            merged = self._search_deltas | self._merged_search_deltas
+            data = self._search_index.dumps()
+        try:
+            blob = self._save_search_index(data, generation, merged)
+        except exceptions.PreconditionFailed:
+            # Another process merged them first.
+            return
+        with self._search_index_lock:
+            if self._search_index_generation == generation:
+                self._search_index_generation = blob.generation
+                self._search_deltas -= merged
+                self._merged_search_deltas = merged
+
+    def _save_search_index(self, data, generation, merged):
+        """Writes the segment file unless it changed, then deletes the delta segment files merged into it.
+
+        Args:
+            data: the segment file, dumped from the ContentIndex.
+            generation: the generation of the segment file the index was read from, 0 if there was none.
+            merged: the names of the delta segment files included in the index.
+
+        Returns:
+            The blob of the segment file.
+
+        Raises:
+            PreconditionFailed: if the segment file changed since it was read.
+        """
+        blob = self.content_bucket.blob(SEARCH_INDEX_BLOB)
+        blob.metadata = {MERGED_DELTAS_KEY: ",".join(sorted(merged))}
+        blob.upload_from_string(data,
+                                content_type="application/octet-stream",
+                                if_generation_match=generation)
+        # Readers skip the merged delta segment files listed in the metadata until they are gone.
+        for name in merged:
+            try:
+                self.content_bucket.blob(name).delete()
+            except exceptions.NotFound:
+                pass
+        return blob
+
+    def _update_search_index(self, name, words=None):
+        """Saves an uploaded or deleted page as a delta segment file, merging the delta segment files once enough.
+
+        Only the changed page is written, so the request does not depend on the size of the index. The page itself was
+        already uploaded or deleted, so a failure is logged instead of failing the request.
+
+        Args:
+            name: the name of the page.
+            words: the WordCounter of the content of the uploaded page, None if it was deleted.
+        """
+        delta = search.ContentIndex()
+        if words is None:
+            delta.remove(name)
+        else:
+            delta.add_words(name, words)
+        # Named after the time, so the delta segment files sort in the order of the changes, as long as the clocks of
+        # the processes roughly agree.
+        delta_name = f"{SEARCH_DELTAS_PREFIX}{time.time_ns():020d}-{uuid.uuid4().hex}.seg"
+        try:
+            self.content_bucket.blob(delta_name).upload_from_string(
+                delta.dumps(),
+                content_type="application/octet-stream",
+                if_generation_match=0)
+        except Exception:
+            logging.exception("Could not update the full-text index.")
+            return
+        with self._search_index_lock:
+            if self._search_index is not None:
+                self._search_index.merge(delta)
+                self._search_deltas.add(delta_name)
+            if len(self._search_deltas) >= SEARCH_MERGE_DELTAS:
+                self._start_search_index_task(self._merge_search_deltas)
+
+    def page_names_version(self):
+        """Returns a number that changes whenever the cached page names change."""
+        with self._page_names_lock:
+            return self._page_names_generation
+
+    def invalidate_page_names(self):
+        """Drops the cached page names so the next call to get_all_page_names lists the bucket again."""
+        with self._page_names_lock:
+            self._page_names = None
+            self._page_names_generation += 1
+            if self.disk_cache is not None:
+                self.disk_cache.discard(PAGE_NAMES_CACHE_KEY)
+
+    def _save_page_names(self):
+        """Saves the cached page names to the disk cache, if there is one. The caller must hold the page names lock."""
+        if self.disk_cache is not None:
+            self.disk_cache.put(PAGE_NAMES_CACHE_KEY, None,
+                                json.dumps(self._page_names).encode())
+
+    def _list_page_names(self):
+        """Lists the content bucket on GCS.
 
         Returns:
             A list with all the page names that end with .html.
@@ -51,6 +784,434 @@ class Backend:
                 page_names.append(blob.name)
         return page_names
 
+    def _refresh_page_names(self):
+        """Lists the content bucket and stores the result as the cached page names.
+
+        The listing is thrown away if an upload or delete changed the cache while it was running, since it might not
+        include that change. The next call to get_all_page_names will then list again.
+
+        Returns:
+            The page names that were listed.
+        """
+        with self._page_names_lock:
+            generation = self._page_names_generation
+        try:
+            page_names = self._list_page_names()
+        except Exception:
+            logging.exception("Could not refresh the cached page names.")
+            with self._page_names_lock:
+                self._page_names_refreshing = False
+            raise
+        with self._page_names_lock:
+            self._page_names_refreshing = False
+            if generation == self._page_names_generation:
+                self._page_names = page_names
+                self._page_names_listed_at = time.monotonic()
+                self._page_names_generation += 1
+                self._save_page_names()
+        return page_names
+
+    def _update_cached_page_names(self, added=None, removed=None):
+        """Applies one of our own uploads or deletes to the cached page names without listing the bucket.
+
+        Args:
+            added: the name of a page that was uploaded.
+            removed: the name of a page that was deleted.
+        """
+        with self._page_names_lock:
+            self._page_names_generation += 1
+            if self._page_names is None:
+                if self.disk_cache is not None:
+                    self.disk_cache.discard(PAGE_NAMES_CACHE_KEY)
+                return
+            page_names = list(self._page_names)
+            if added and added.endswith(".html") and added not in page_names:
+                bisect.insort(page_names, added)
+            if removed in page_names:
+                page_names.remove(removed)
+            self._page_names = page_names
+            self._save_page_names()
+
+    def _user_blob_name(self, username):
+        """Returns the name of the blob holding the record of the user when the user records are sharded."""
+        return f"{USERS_PREFIX}{username}.json"
+
+    def _read_user(self, username):
+        """Retrieves the record of a user for reading only.
+
+        Args:
+            username: the name of the user.
+
+        Returns:
+            A dictionary with the profile_pic and files_uploaded of the user. It must not be modified.
+        """
+        if self.sharded_users:
+            return self._read_json(self._user_blob_name(username))
+        return self._read_json("info.json")[username]
+
+    def _save_user(self, username, user_blob, user, if_generation_match=None):
+        """Uploads the record of a user when the user records are sharded.
+
+        The number of uploaded files is also stored in the blob metadata so get_contributors can find the contributors
+        from a listing of the bucket without downloading every record.
+
+        Args:
+            username: the name of the user.
+            user_blob: the blob holding the record of the user.
+            user: the record of the user.
+            if_generation_match: only upload if the blob on GCS still has this generation, 0 if it must not exist yet.
+        """
+        user_blob.metadata = _user_metadata(user)
+        self._save_json(self._user_blob_name(username),
+                        user_blob,
+                        user,
+                        if_generation_match=if_generation_match)
+
+    def _modify_user(self, username, mutate):
+        """Applies a change to the record of a user and uploads it.
+
+        With sharded user records only the blob of that user is rewritten, otherwise the whole info.json is.
+
+        Args:
+            username: the name of the user.
+            mutate: a function receiving the record of the user that modifies it in place. It can be called several
+                times, so it must not have other side effects.
+
+        Returns:
+            The value returned by mutate.
+        """
+        if self.sharded_users:
+            files_uploaded = []
+
+            def modify_user(user):
+                result = mutate(user)
+                files_uploaded[:] = [len(user["files_uploaded"])]
+                return result
+
+            result = self._modify_json(self._user_blob_name(username),
+                                       modify_user,
+                                       metadata=_user_metadata)
+            self._update_cached_contributors(username, files_uploaded[0] > 0)
+            return result
+        return self._modify_json("info.json",
+                                 lambda json_dict: mutate(json_dict[username]))
+
+    def _add_user(self, username, user):
+        """Stores the record of a new user.
+
+        Args:
+            username: the name of the new user.
+            user: the record of the new user.
+        """
+        if self.sharded_users:
+            user_blob = self.content_bucket.blob(self._user_blob_name(username))
+            self._save_user(username, user_blob, user, if_generation_match=0)
+            return
+
+        def add_user(json_dict):
+            json_dict[username] = user
+
+        self._modify_json("info.json", add_user)
+
+    def _rename_user(self, current_username, new_username):
+        """Moves the record of a user to a new username.
+
+        Args:
+            current_username: current username of the user.
+            new_username: the username the record is moved to.
+        """
+        if self.sharded_users:
+            user_blob, user = self._load_json(
+                self._user_blob_name(current_username))
+            self._add_user(new_username, user)
+            user_blob.delete(if_generation_match=user_blob.generation)
+            self._update_cached_contributors(current_username, False)
+            self._update_cached_contributors(new_username,
+                                             len(user["files_uploaded"]) > 0)
+            return
+
+        def rename_user(json_dict):
+            user_info = json_dict.pop(current_username)
+            json_dict[new_username] = user_info
+
+        self._modify_json("info.json", rename_user)
+
+    def migrate_user_records(self):
+        """Copies every user record from info.json into its own blob under users/.
+
+        The migration can be run again safely: user records that already have their own blob are left alone, since
+        they may have changed since info.json. info.json is left untouched so it can be used as a backup. Once it has
+        finished the Backend can be created with sharded_users=True.
+
+        Returns:
+            A dictionary with the number of user records copied, and of user records skipped because they already had
+            their own blob.
+        """
+        json_dict = self._load_json("info.json")[1]
+        migrated = 0
+        for username, user in json_dict.items():
+            user_blob = self.content_bucket.blob(self._user_blob_name(username))
+            try:
+                self._save_user(username,
+                                user_blob,
+                                user,
+                                if_generation_match=0)
+                migrated += 1
+            except exceptions.PreconditionFailed:
+                pass
+        return {"migrated": migrated, "skipped": len(json_dict) - migrated}
+
+    def _upload_file(self, blob, file, **kwargs):
+        """Uploads a file to a blob as a resumable upload of UPLOAD_CHUNK_BYTES chunks, and logs the throughput.
+
+        Each chunk is its own request with its own timeout, so large files are neither read into memory at once nor
+        cut off by a timeout, and a failed chunk is retried without sending the previous ones again.
+
+        Args:
+            blob: the blob to upload to.
+            file: the file to upload, read from its current position to its end.
+            **kwargs: passed on to upload_from_file, like if_generation_match.
+        """
+        blob.chunk_size = UPLOAD_CHUNK_BYTES
+        position = file.tell()
+        started = time.perf_counter()
+        blob.upload_from_file(file, **kwargs)
+        elapsed = time.perf_counter() - started
+        size = file.tell() - position
+        logging.info("Uploaded %s: %d bytes in %.3f s (%.2f MiB/s).", blob.name,
+                     size, elapsed, size / (1024 * 1024) / max(elapsed, 1e-6))
+
+    def _read_page(self, file, words):
+        """Reads an uploaded page in chunks, hashing it, counting its words and, if compress_pages is on, compressing it.
+
+        The compressed copy is spooled to a temporary file once it outgrows UPLOAD_CHUNK_BYTES.
+
+        Args:
+            file: the file with the content of the page, read from its current position.
+            words: the WordCounter fed the content of the page, for the full-text index.
+
+        Returns:
+            A tuple of the SHA-256 of the content, its size, the file to store positioned at its start, the
+            Content-Encoding of that file, None if it is not compressed, and its size.
+        """
+        position = file.tell()
+        digest = hashlib.sha256()
+        size = 0
+        stored = None
+        compressor = None
+        if self.compress_pages:
+            stored = tempfile.SpooledTemporaryFile(max_size=UPLOAD_CHUNK_BYTES)
+            compressor = gzip.GzipFile(fileobj=stored,
+                                       mode="wb",
+                                       compresslevel=GZIP_LEVEL,
+                                       mtime=0)
+        for chunk in iter(lambda: file.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+            size += len(chunk)
+            words.feed_bytes(chunk)
+            if compressor is not None:
+                compressor.write(chunk)
+        words.close()
+        if compressor is None:
+            file.seek(position)
+            return digest.hexdigest(), size, file, None, size
+        compressor.close()
+        stored_size = stored.tell()
+        stored.seek(0)
+        return digest.hexdigest(), size, stored, "gzip", stored_size
+
+    def _upload_page(self, blob, file, words):
+        """Uploads an HTML page, compressed if compress_pages is on, and as a pointer to a content object shared by
+        every page with the same content if dedup_pages is on.
+
+        Args:
+            blob: the blob of the page, which must not exist yet.
+            file: the file with the content of the page.
+            words: the WordCounter fed the content of the page while it is read.
+
+        Raises:
+            google.api_core.exceptions.PreconditionFailed: if the page was created by someone else in the meantime.
+        """
+        digest, size, stored, encoding, stored_size = self._read_page(
+            file, words)
+        if not self.dedup_pages:
+            blob.content_encoding = encoding
+            blob.metadata = {CONTENT_SIZE_KEY: str(size)}
+            self._upload_file(blob,
+                              stored,
+                              content_type="text/html",
+                              if_generation_match=0)
+            return
+        entry = self._retain_object(digest, stored, encoding, stored_size)
+        blob.metadata = {
+            CONTENT_HASH_KEY: digest,
+            CONTENT_SIZE_KEY: str(size),
+            STORED_SIZE_KEY: str(entry.get("stored_size", size))
+        }
+        if entry.get("encoding"):
+            blob.metadata[CONTENT_ENCODING_KEY] = entry["encoding"]
+        try:
+            blob.upload_from_string(b"",
+                                    content_type="text/html",
+                                    if_generation_match=0)
+        except Exception:
+            self._release_object(digest)
+            raise
+
+    def _retain_object(self, digest, file, encoding, stored_size):
+        """Counts one more page pointing to a content object, and returns once the object is fully uploaded.
+
+        A page is only published once its object exists. When the record already has the generation of the object,
+        the object is there. Otherwise it is either the first page with this content, or another upload of the object
+        is still running or has failed, and this page uploads the object itself, so a failed upload never leaves
+        pages pointing to nothing.
+
+        Args:
+            digest: the SHA-256 of the content.
+            file: the file to store as the object, read only if the object is uploaded.
+            encoding: the Content-Encoding of the file, None if it is not encoded.
+            stored_size: the size of the file.
+
+        Returns:
+            A dictionary with the encoding and stored_size of the object as it is stored, which is not the given file
+            if another page uploaded the object first.
+        """
+
+        def retain(record):
+            if not record:
+                record.update(count=0,
+                              generation=None,
+                              encoding=encoding,
+                              stored_size=stored_size)
+            record["count"] += 1
+            return record["count"] == 1, dict(record)
+
+        created, record = self._modify_object_ref(digest, retain)
+        if record["generation"] is not None:
+            return record
+        try:
+            return self._store_object(digest, file, encoding, stored_size,
+                                      created)
+        except Exception:
+            self._release_object(digest)
+            raise
+
+    def _store_object(self, digest, file, encoding, stored_size, replace):
+        """Uploads a content object unless it already exists, and records its generation.
+
+        Args:
+            digest: the SHA-256 of the content.
+            file: the file to store as the object.
+            encoding: the Content-Encoding of the file, None if it is not encoded.
+            stored_size: the size of the file.
+            replace: True to upload even if the object exists. The first page of a new record does, since the object
+                of a previous record may be about to be deleted, and a new generation makes that delete fail.
+
+        Returns:
+            A dictionary with the encoding and stored_size of the object as it is stored.
+        """
+        name = f"{OBJECTS_PREFIX}{digest}"
+        position = file.tell()
+        object_blob = self.content_bucket.blob(name)
+        object_blob.content_encoding = encoding
+        try:
+            self._upload_file(object_blob,
+                              file,
+                              content_type="text/html",
+                              if_generation_match=None if replace else 0)
+            stored = object_blob
+        except exceptions.PreconditionFailed:
+            stored = self.content_bucket.get_blob(name)
+            if stored is None:
+                # Deleted since, by the last release of a previous record.
+                file.seek(position)
+                return self._store_object(digest, file, encoding, stored_size,
+                                          True)
+        uploaded = stored is object_blob
+        stored_record = {
+            "generation": stored.generation,
+            "encoding": encoding if uploaded else stored.content_encoding,
+            "stored_size": stored_size if uploaded else stored.size
+        }
+
+        def record_generation(record):
+            # The latest upload wins, so a delete conditioned on an older generation cannot remove it.
+            if record and (uploaded or record["generation"] is None):
+                record.update(stored_record)
+
+        self._modify_object_ref(digest, record_generation)
+        return stored_record
+
+    def _modify_object_ref(self, digest, mutate):
+        """Applies a change to the reference record of one content object, retrying if another writer changed it first.
+
+        Every content object has its own small record under refs/, so uploads and deletes of pages with different
+        content never contend, and each change costs the same however many pages the wiki holds. A record whose count
+        drops to 0 is deleted.
+
+        Args:
+            digest: the SHA-256 of the content object.
+            mutate: a function modifying in place the record, a dictionary with the count of pages pointing to the
+                object, the generation it was uploaded as, its encoding and its stored size, or an empty dictionary if
+                there is no record. It is called again on every retry, so it must not have other side effects.
+
+        Returns:
+            The value returned by mutate.
+
+        Raises:
+            google.api_core.exceptions.PreconditionFailed: the record kept changing for json_write_retries attempts.
+        """
+        name = f"{REFS_PREFIX}{digest}.json"
+        for attempt in range(self.json_write_retries):
+            record_blob = self.content_bucket.get_blob(name)
+            record = {}
+            if record_blob is not None:
+                record = json.loads(record_blob.download_as_bytes())
+            result = mutate(record)
+            try:
+                if record.get("count", 0) > 0:
+                    self.content_bucket.blob(name).upload_from_string(
+                        json.dumps(record),
+                        content_type="application/json",
+                        if_generation_match=record_blob.generation
+                        if record_blob is not None else 0)
+                elif record_blob is not None:
+                    record_blob.delete(
+                        if_generation_match=record_blob.generation)
+                return result
+            except (exceptions.PreconditionFailed, exceptions.NotFound):
+                if attempt + 1 == self.json_write_retries:
+                    raise
+                time.sleep(random.uniform(0, JSON_RETRY_DELAY * 2**attempt))
+
+    def _release_object(self, digest):
+        """Counts one less page pointing to a content object, deleting the object once no page points to it.
+
+        The object is deleted only if it still is the generation recorded when it was uploaded. A page with the same
+        content uploaded in the meantime uploads the object again, so it is not deleted from under that page.
+
+        Args:
+            digest: the SHA-256 of the content.
+        """
+
+        def release(record):
+            if not record:
+                return None
+            record["count"] -= 1
+            if record["count"] > 0:
+                return None
+            return dict(record)
+
+        released = self._modify_object_ref(digest, release)
+        # Without a generation, no upload of the object finished, and one that is running must not be deleted.
+        if released is None or released["generation"] is None:
+            return
+        try:
+            self.content_bucket.blob(f"{OBJECTS_PREFIX}{digest}").delete(
+                if_generation_match=released["generation"])
+        except (exceptions.NotFound, exceptions.PreconditionFailed):
+            pass
+
     def upload(self, username, name, file):
         """Using the file and name given, it will try to create a blob using the file name and store the file inside of the blob
 
@@ -67,14 +1228,25 @@ class Backend:
         if blob.exists():
             return False
         else:
-            json_blob = self.content_bucket.get_blob("info.json")
-            json_str = json_blob.download_as_bytes().decode()
-            json_dict = json.loads(json_str)
-            json_dict[username]["files_uploaded"].append(f"{name}.{file_type}")
-            blob.upload_from_file(file)
-            mod_json_data = json.dumps(json_dict)
-            json_blob.upload_from_string(mod_json_data,
-                                         content_type="application/json")
+            # The words of a page are counted while it is read for the upload, so it is read only once.
+            words = search.WordCounter()
+            try:
+                if file_type == "html":
+                    self._upload_page(blob, file, words)
+                else:
+                    self._upload_file(blob, file, if_generation_match=0)
+            except exceptions.PreconditionFailed:
+                return False
+            self._modify_user(
+                username, lambda user: user["files_uploaded"].append(
+                    f"{name}.{file_type}"))
+            self._update_cached_page_names(added=f"{name}.{file_type}")
+            if self.page_cache is not None:
+                self.page_cache.discard(f"{name}.{file_type}")
+            if self.disk_cache is not None:
+                self.disk_cache.discard(f"pages/{name}.{file_type}")
+            if file_type == "html":
+                self._update_search_index(f"{name}.{file_type}", words)
             return True
 
     def sign_up(self, username, password):
@@ -92,18 +1264,19 @@ class Backend:
         if blob.exists():
             return False
         else:
-            blob.upload_from_string(password,
-                                    content_type="application/octet-stream")
-            json_blob = self.content_bucket.get_blob("info.json")
-            json_str = json_blob.download_as_bytes().decode()
-            json_dict = json.loads(json_str)
+            try:
+                blob.upload_from_string(password,
+                                        content_type="application/octet-stream",
+                                        if_generation_match=0)
+            except exceptions.PreconditionFailed:
+                return False
             profile = "default-profile-pic.gif"
             if random.randint(1, 20) == 2:
                 profile = "default-profile-pic2.gif"
-            json_dict[username] = {"profile_pic": profile, "files_uploaded": []}
-            json_data = json.dumps(json_dict)
-            json_blob.upload_from_string(json_data,
-                                         content_type="application/json")
+            self._add_user(username, {
+                "profile_pic": profile,
+                "files_uploaded": []
+            })
             return True
 
     def sign_in(self, username, password):
@@ -147,15 +1320,12 @@ class Backend:
         Returns:
             A string the has part of the path to the GCS location of the profile picture without the base url.
         """
-        json_blob = self.content_bucket.get_blob("info.json")
-        json_str = json_blob.download_as_bytes().decode()
-        json_dict = json.loads(json_str)
-        return json_dict[username]["profile_pic"]
+        return self._read_user(username)["profile_pic"]
 
     def change_profile_picture(self, username, new_pfp, remove):
         """Changes the user's profile picture.
 
-        Retrieves the user's current profile picture from the JSON file. If remove is True, then the profile picture will be updated to the default. If remove is False, the new profile picture will replace the old one.
+        Retrieves the user's current profile picture from the user's record. If remove is True, then the profile picture will be updated to the default. If remove is False, the new profile picture will replace the old one.
 
         Args:
             username: the name of the user.
@@ -166,15 +1336,12 @@ class Backend:
             True if profile picture was successfully updated.
             False if image was not accepted file type.
         """
-        json_blob = self.content_bucket.get_blob("info.json")
-        json_str = json_blob.download_as_bytes().decode()
-        json_dict = json.loads(json_str)
-        old_pfp = json_dict[username]["profile_pic"]
+        old_pfp = self._read_user(username)["profile_pic"]
         old_blob = self.content_bucket.get_blob(old_pfp)
 
         if remove:
             old_blob.delete()
-            json_dict[username]["profile_pic"] = "default-profile-pic.gif"
+            file_name = "default-profile-pic.gif"
 
         else:
             file_type = new_pfp.filename.split(".")[-1]
@@ -189,12 +1356,12 @@ class Backend:
 
             file_name = f"{username}-profile-picture-superduperteamawesome.{file_type}"
             blob = self.content_bucket.blob(file_name)
-            blob.upload_from_file(new_pfp)
-            json_dict[username]["profile_pic"] = file_name
+            self._upload_file(blob, new_pfp)
 
-        mod_json_data = json.dumps(json_dict)
-        json_blob.upload_from_string(mod_json_data,
-                                     content_type="application/json")
+        def set_profile_pic(user):
+            user["profile_pic"] = file_name
+
+        self._modify_user(username, set_profile_pic)
         return True
 
     def change_password(self, username, current_password, new_password):
@@ -234,18 +1401,15 @@ class Backend:
         new_blob = self.password_bucket.blob(new_username)
         if new_blob.exists():
             return False
-        json_blob = self.content_bucket.get_blob("info.json")
-        json_str = json_blob.download_as_bytes().decode()
-        json_dict = json.loads(json_str)
-        user_info = json_dict.pop(current_username)
-        json_dict[new_username] = user_info
-        mod_json_data = json.dumps(json_dict)
-        json_blob.upload_from_string(mod_json_data,
-                                     content_type="application/json")
         old_blob = self.password_bucket.get_blob(current_username)
-        self.password_bucket.copy_blob(old_blob,
-                                       self.password_bucket,
-                                       new_name=new_username)
+        try:
+            self.password_bucket.copy_blob(old_blob,
+                                           self.password_bucket,
+                                           new_name=new_username,
+                                           if_generation_match=0)
+        except exceptions.PreconditionFailed:
+            return False
+        self._rename_user(current_username, new_username)
         old_blob.delete()
         return True
 
@@ -258,10 +1422,7 @@ class Backend:
         Returns:
             A list of the uploaded files from the specified user.
         """
-        json_blob = self.content_bucket.get_blob("info.json")
-        json_str = json_blob.download_as_bytes().decode()
-        json_dict = json.loads(json_str)
-        return json_dict[username]["files_uploaded"]
+        return self._read_user(username)["files_uploaded"]
 
     def delete_uploaded_file(self, username, file_name):
         """Deletes the uploaded file from the user and deletes it in GCS and the user info.json file.
@@ -274,15 +1435,23 @@ class Backend:
             True once the uploaded file from the user has been deleted.
         """
         blob = self.content_bucket.get_blob(file_name)
+        digest = (blob.metadata or {}).get(CONTENT_HASH_KEY)
         blob.delete()
-        json_blob = self.content_bucket.get_blob("info.json")
-        json_str = json_blob.download_as_bytes().decode()
-        json_dict = json.loads(json_str)
-        json_dict[username]["files_uploaded"].remove(file_name)
-        mod_json_data = json.dumps(json_dict)
-        json_blob.upload_from_string(mod_json_data,
-                                     content_type="application/json")
-        return json_dict[username]["files_uploaded"]
+        if digest is not None:
+            self._release_object(digest)
+        self._update_cached_page_names(removed=file_name)
+        if self.page_cache is not None:
+            self.page_cache.discard(file_name)
+        if self.disk_cache is not None:
+            self.disk_cache.discard(f"pages/{file_name}")
+        if file_name.endswith(".html"):
+            self._update_search_index(file_name)
+
+        def remove_file(user):
+            user["files_uploaded"].remove(file_name)
+            return user["files_uploaded"]
+
+        return self._modify_user(username, remove_file)
 
     def get_contributors(self):
         """Retrieves all the contributors of the wiki from the info.json that is stored in GCS.
@@ -294,15 +1463,57 @@ class Backend:
         Returns:
             True once the uploaded file from the user has been deleted.
         """
-        json_blob = self.content_bucket.get_blob("info.json")
-        json_str = json_blob.download_as_bytes().decode()
-        json_dict = json.loads(json_str)
+        if self.sharded_users:
+            return self._get_sharded_contributors()
+        json_dict = self._read_json("info.json")
         contributors = []
         for contributor in json_dict.keys():
             if len(json_dict[contributor]["files_uploaded"]) > 0:
                 contributors.append(contributor)
         return contributors
 
+    def _get_sharded_contributors(self):
+        """Retrieves the contributors from the metadata of the user blobs, using a cached listing when possible.
+
+        Listing users/ reads every user blob's metadata, so the listing is kept for page_names_ttl seconds. Changes made
+        through this Backend are applied to it right away, the ones of other processes show up once it is listed again.
+
+        Returns:
+            A list of the usernames of the users who uploaded at least one file.
+        """
+        with self._contributors_lock:
+            age = time.monotonic() - self._contributors_listed_at
+            if self._contributors is not None and age < self.page_names_ttl:
+                return sorted(self._contributors, key=self._user_blob_name)
+            generation = self._contributors_generation
+        contributors = []
+        for blob in self.content_bucket.list_blobs(prefix=USERS_PREFIX):
+            metadata = blob.metadata or {}
+            if int(metadata.get("files_uploaded", 0)) > 0:
+                contributors.append(blob.name[len(USERS_PREFIX):-len(".json")])
+        with self._contributors_lock:
+            # A listing racing with one of our own changes might miss it, so it is only kept if there was none.
+            if generation == self._contributors_generation:
+                self._contributors = set(contributors)
+                self._contributors_listed_at = time.monotonic()
+        return contributors
+
+    def _update_cached_contributors(self, username, contributes):
+        """Applies a change to the files uploaded by a user to the cached contributors.
+
+        Args:
+            username: the name of the user.
+            contributes: True if the user has uploaded files now.
+        """
+        with self._contributors_lock:
+            self._contributors_generation += 1
+            if self._contributors is None:
+                return
+            if contributes:
+                self._contributors.add(username)
+            else:
+                self._contributors.discard(username)
+
     def submit_question(self, username, question):
         """Adds a new FAQ question to the JSON file.
 
@@ -310,14 +1521,10 @@ class Backend:
             username: the name of the user.
             question: string containing the question submitted by the user.
         """
-        json_blob = self.content_bucket.get_blob("website_info.json")
-        json_str = json_blob.download_as_bytes().decode()
-        json_dict = json.loads(json_str)
         new_question = {"text": question, "user": username, "replies": []}
-        json_dict["FAQ"].append(new_question)
-        mod_json_data = json.dumps(json_dict)
-        json_blob.upload_from_string(mod_json_data,
-                                     content_type="application/json")
+        self._modify_json(
+            "website_info.json",
+            lambda json_dict: json_dict["FAQ"].append(new_question))
 
     def submit_reply(self, username, reply, question_index):
         """Adds a new FAQ reply to corresponding question in the JSON file.
@@ -327,14 +1534,10 @@ class Backend:
             reply: string containing the reply submitted by the user.
             question_index = integer representing the question for which the reply is being submitted.
         """
-        json_blob = self.content_bucket.get_blob("website_info.json")
-        json_str = json_blob.download_as_bytes().decode()
-        json_dict = json.loads(json_str)
         new_reply = {"text": reply, "user": username}
-        json_dict["FAQ"][int(question_index) - 1]["replies"].append(new_reply)
-        mod_json_data = json.dumps(json_dict)
-        json_blob.upload_from_string(mod_json_data,
-                                     content_type="application/json")
+        self._modify_json(
+            "website_info.json", lambda json_dict: json_dict["FAQ"][int(
+                question_index) - 1]["replies"].append(new_reply))
 
     def get_faq(self):
         """Retrieves all FAQ questions and replies from GCS.
@@ -342,7 +1545,5 @@ class Backend:
         Returns:
             A list containing all the questions and replies.
         """
-        json_blob = self.content_bucket.get_blob("website_info.json")
-        json_str = json_blob.download_as_bytes().decode()
-        json_dict = json.loads(json_str)
-        return json_dict["FAQ"]
\ No newline at end of file
+        json_dict = self._read_json("website_info.json")
+        return json_dict["FAQ"]
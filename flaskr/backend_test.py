@@ -1,7 +1,15 @@
+from flaskr import backend, cache, storage
 from flaskr.backend import Backend
+from concurrent import futures
+from flask import Flask
+from google.api_core import exceptions
 from unittest.mock import patch, MagicMock
+import gzip
 import pytest
+import io
 import json
+import threading
+import time
 
 
 def test_get_wiki_page():
@@ -10,6 +18,7 @@ def test_get_wiki_page():
     be = Backend()
 
     blob1 = MagicMock()
+    blob1.metadata = None
     blob1.download_as_bytes().decode.return_value = content
     be.content_bucket = MagicMock()
     be.content_bucket.get_blob.return_value = blob1
@@ -33,9 +42,81 @@ def test_get_all_page_names():
     assert be.get_all_page_names() == [html_file]
 
 
+def test_get_all_page_names_cached():
+    """Verifies the bucket is only listed once while the cached page names are fresh."""
+    be = Backend()
+
+    blob1 = MagicMock()
+    blob1.name = "testing.html"
+    be.content_bucket = MagicMock()
+    be.content_bucket.list_blobs.return_value = [blob1]
+
+    assert be.get_all_page_names() == ["testing.html"]
+    assert be.get_all_page_names() == ["testing.html"]
+    be.content_bucket.list_blobs.assert_called_once()
+
+
+def test_get_all_page_names_stale_refreshes_in_background():
+    """Verifies stale page names are returned right away while the bucket is listed again in the background."""
+    be = Backend(page_names_ttl=0)
+
+    blob1 = MagicMock()
+    blob1.name = "old.html"
+    blob2 = MagicMock()
+    blob2.name = "new.html"
+    be.content_bucket = MagicMock()
+    be.content_bucket.list_blobs.return_value = [blob1]
+    assert be.get_all_page_names() == ["old.html"]
+
+    be.content_bucket.list_blobs.return_value = [blob2]
+    with patch('threading.Thread') as mock_thread:
+        assert be.get_all_page_names() == ["old.html"]
+        mock_thread.assert_called_once_with(target=be._refresh_page_names,
+                                            daemon=True)
+    be._refresh_page_names()
+    assert be.get_all_page_names() == ["new.html"]
+
+
+def test_page_names_cache_updated_on_upload_and_delete():
+    """Verifies uploads and deletes update the cached page names without listing the bucket."""
+    be = Backend(dedup_pages=False, compress_pages=False)
+
+    blob1 = MagicMock()
+    blob1.name = "b.html"
+    be.content_bucket = MagicMock()
+    be.content_bucket.list_blobs.return_value = [blob1]
+    be.content_bucket.blob.return_value.exists.return_value = False
+    be.content_bucket.get_blob.return_value.metadata = None
+    assert be.get_all_page_names() == ["b.html"]
+
+    file = io.BytesIO(b"<p>test</p>")
+    file.filename = "test.html"
+    json_test_data = {"user": {"profile_pic": "", "files_uploaded": []}}
+    with patch('json.loads', new_callable=MagicMock) as mock_load, patch(
+            'json.dumps', new_callable=MagicMock) as mock_dump:
+        mock_load.return_value = json_test_data
+        assert be.upload("user", "a", file) == True
+        assert be.get_all_page_names() == ["a.html", "b.html"]
+        be.delete_uploaded_file("user", "a.html")
+        assert be.get_all_page_names() == ["b.html"]
+    be.content_bucket.list_blobs.assert_called_once()
+
+
+def test_invalidate_page_names():
+    """Verifies the bucket is listed again after the cached page names are invalidated."""
+    be = Backend()
+
+    be.content_bucket = MagicMock()
+    be.content_bucket.list_blobs.return_value = []
+    be.get_all_page_names()
+    be.invalidate_page_names()
+    be.get_all_page_names()
+    assert be.content_bucket.list_blobs.call_count == 2
+
+
 def test_upload_success():
     """Tests if the upload was successful with no conflict."""
-    be = Backend()
+    be = Backend(dedup_pages=False, compress_pages=False)
 
     json_test_data = {
         "user": {
@@ -52,7 +133,7 @@ def test_upload_success():
         }
     }
 
-    file = MagicMock()
+    file = io.BytesIO(b"<p>test</p>")
     file.filename = "test.html"
 
     blob = MagicMock()
@@ -333,6 +414,7 @@ def test_delete_uploaded_file():
     json_blob = MagicMock()
     json_blob.download_as_bytes.decode.return_value = json_test_data_str
     json_blob.upload_from_string.return_value = MagicMock()
+    json_blob.metadata = None
     be.content_bucket.get_blob.return_value = json_blob
 
     with patch('json.loads', new_callable=MagicMock) as mock_load, patch(
@@ -595,4 +677,884 @@ def test_submit_reply():
     with patch('json.loads', new_callable=MagicMock) as mock_load:
         mock_load.return_value = json_test_data
         be.submit_reply("test_user_2", "test_reply", 0)
-        assert json_test_data == expected
\ No newline at end of file
+        assert json_test_data == expected
+
+
+def test_json_read_once_per_request():
+    """Tests that info.json is downloaded only once while handling a single request."""
+    be = Backend()
+    json_test_data = {
+        "testing": {
+            "profile_pic": "default-profile-pic.gif",
+            "files_uploaded": ["file.html"]
+        }
+    }
+
+    blob = MagicMock()
+    blob.download_as_bytes.return_value = json.dumps(json_test_data).encode()
+    be.content_bucket = MagicMock()
+    be.content_bucket.get_blob.return_value = blob
+
+    with Flask(__name__).test_request_context("/"):
+        assert be.get_contributors() == ["testing"]
+        assert be.get_profile_pic("testing") == "default-profile-pic.gif"
+        assert be.get_user_files("testing") == ["file.html"]
+    blob.download_as_bytes.assert_called_once()
+
+    blob.generation = 2
+    with Flask(__name__).test_request_context("/"):
+        be.get_contributors()
+    assert blob.download_as_bytes.call_count == 2
+
+
+def test_json_snapshot_updated_after_write():
+    """Tests that reads later in the same request see the changes written by the Backend."""
+    be = Backend()
+    json_test_data = {
+        "testing": {
+            "profile_pic": "default-profile-pic.gif",
+            "files_uploaded": ["file.html"]
+        }
+    }
+
+    blob = MagicMock()
+    blob.download_as_bytes.return_value = json.dumps(json_test_data).encode()
+    be.content_bucket = MagicMock()
+    blob.metadata = None
+    be.content_bucket.get_blob.return_value = blob
+
+    with Flask(__name__).test_request_context("/"):
+        assert be.get_user_files("testing") == ["file.html"]
+        be.delete_uploaded_file("testing", "file.html")
+        assert be.get_user_files("testing") == []
+        assert be.get_contributors() == []
+
+
+def test_json_cache_revalidated_by_generation():
+    """Tests that info.json is only downloaded again when its generation on GCS changes."""
+    be = Backend()
+
+    blob = MagicMock()
+    blob.generation = 1
+    blob.download_as_bytes.return_value = b'{"testing": {"profile_pic": "a.gif", "files_uploaded": []}}'
+    be.content_bucket = MagicMock()
+    be.content_bucket.get_blob.return_value = blob
+
+    assert be.get_profile_pic("testing") == "a.gif"
+    assert be.get_profile_pic("testing") == "a.gif"
+    blob.download_as_bytes.assert_called_once()
+    assert be.content_bucket.get_blob.call_count == 2
+
+    blob.generation = 2
+    blob.download_as_bytes.return_value = b'{"testing": {"profile_pic": "b.gif", "files_uploaded": []}}'
+    assert be.get_profile_pic("testing") == "b.gif"
+    assert blob.download_as_bytes.call_count == 2
+
+
+def test_json_cache_ttl_skips_generation_check():
+    """Tests that the cached info.json is used without contacting GCS within the TTL."""
+    be = Backend(json_ttl=60)
+
+    blob = MagicMock()
+    blob.download_as_bytes.return_value = b'{"testing": {"profile_pic": "a.gif", "files_uploaded": []}}'
+    be.content_bucket = MagicMock()
+    be.content_bucket.get_blob.return_value = blob
+
+    assert be.get_profile_pic("testing") == "a.gif"
+    assert be.get_profile_pic("testing") == "a.gif"
+    be.content_bucket.get_blob.assert_called_once()
+
+
+def test_json_cache_updated_by_write():
+    """Tests that the Backend's own writes replace the cached info.json without another download."""
+    be = Backend()
+
+    blob = MagicMock()
+    blob.generation = 1
+    blob.download_as_bytes.return_value = b'{"testing": {"profile_pic": "a.gif", "files_uploaded": []}}'
+    blob.upload_from_string.side_effect = lambda *args, **kwargs: setattr(
+        blob, "generation", 2)
+    be.content_bucket = MagicMock()
+    be.content_bucket.get_blob.return_value = blob
+
+    assert be.get_profile_pic("testing") == "a.gif"
+    be.change_profile_picture("testing", None, True)
+    assert blob.download_as_bytes.call_count == 2
+    assert be.get_profile_pic("testing") == "default-profile-pic.gif"
+    assert blob.download_as_bytes.call_count == 2
+
+
+def test_sharded_sign_up():
+    """Tests that signing up with sharded user records writes only the new user's blob."""
+    be = Backend(sharded_users=True)
+
+    blob = MagicMock()
+    blob.exists.return_value = False
+    be.password_bucket = MagicMock()
+    be.password_bucket.blob.return_value = blob
+    user_blob = MagicMock()
+    be.content_bucket = MagicMock()
+    be.content_bucket.blob.return_value = user_blob
+
+    with patch('random.randint', new_callable=MagicMock) as mock_randint:
+        mock_randint.return_value = 10
+        assert be.sign_up("user", "password") == True
+    be.content_bucket.blob.assert_called_once_with("users/user.json")
+    be.content_bucket.get_blob.assert_not_called()
+    user_blob.upload_from_string.assert_called_once_with(
+        '{"profile_pic": "default-profile-pic.gif", "files_uploaded": []}',
+        content_type="application/json",
+        if_generation_match=0)
+    assert user_blob.metadata == {"files_uploaded": "0"}
+
+
+def test_sharded_upload():
+    """Tests that uploading with sharded user records rewrites only the uploader's blob."""
+    be = Backend(sharded_users=True, dedup_pages=False, compress_pages=False)
+
+    file = io.BytesIO(b"<p>test</p>")
+    file.filename = "test.html"
+    blob = MagicMock()
+    blob.exists.return_value = False
+    user_blob = MagicMock()
+    user_blob.download_as_bytes.return_value = b'{"profile_pic": "default-profile-pic.gif", "files_uploaded": ["file.html"]}'
+    be.content_bucket = MagicMock()
+    be.content_bucket.blob.return_value = blob
+    be.content_bucket.get_blob.return_value = user_blob
+
+    with patch.object(Backend, "_update_search_index") as update_index:
+        assert be.upload("user", "testing", file) == True
+    be.content_bucket.get_blob.assert_called_once_with("users/user.json")
+    update_index.assert_called_once()
+    user_blob.upload_from_string.assert_called_once_with(
+        '{"profile_pic": "default-profile-pic.gif", "files_uploaded": ["file.html", "testing.html"]}',
+        content_type="application/json",
+        if_generation_match=user_blob.generation)
+    assert user_blob.metadata == {"files_uploaded": "2"}
+
+
+def test_sharded_get_contributors():
+    """Tests that contributors are found from the metadata of the user blobs without downloading them."""
+    be = Backend(sharded_users=True)
+
+    blob1 = MagicMock()
+    blob1.name = "users/testing.json"
+    blob1.metadata = {"files_uploaded": "2"}
+    blob2 = MagicMock()
+    blob2.name = "users/lurker.json"
+    blob2.metadata = {"files_uploaded": "0"}
+    be.content_bucket = MagicMock()
+    be.content_bucket.list_blobs.return_value = [blob1, blob2]
+
+    assert be.get_contributors() == ["testing"]
+    be.content_bucket.list_blobs.assert_called_once_with(prefix="users/")
+    blob1.download_as_bytes.assert_not_called()
+
+
+def test_sharded_contributors_cached():
+    """Tests that the listing of the user blobs is cached, and that our own uploads and deletes update it."""
+    memory = storage.MemoryStorage()
+    content = memory.bucket("awesomewikicontent")
+    content.blob("users/lurker.json").upload_from_string(
+        '{"profile_pic": "", "files_uploaded": []}')
+    testing = content.blob("users/testing.json")
+    testing.metadata = {"files_uploaded": "1"}
+    testing.upload_from_string(
+        '{"profile_pic": "", "files_uploaded": ["cpu.html"]}')
+    be = Backend(memory, sharded_users=True)
+
+    assert be.get_contributors() == ["testing"]
+    assert be.get_contributors() == ["testing"]
+    assert memory.calls["list"] == 1
+
+    file = io.BytesIO(b"<p>GPU</p>")
+    file.filename = "upload.html"
+    with patch.object(Backend, "_update_search_index"):
+        assert be.upload("lurker", "gpu", file)
+        assert be.get_contributors() == ["lurker", "testing"]
+        be.delete_uploaded_file("lurker", "gpu.html")
+    assert be.get_contributors() == ["testing"]
+    assert memory.calls["list"] == 1
+
+
+def test_json_cache_bounded():
+    """Tests that the parsed JSON files are evicted once they take more than JSON_CACHE_BYTES."""
+    memory = storage.MemoryStorage()
+    content = memory.bucket("awesomewikicontent")
+    content.blob("info.json").upload_from_string('{"a": 1}')
+    content.blob("website_info.json").upload_from_string('{"b": 2}')
+    with patch.object(backend, "JSON_CACHE_BYTES", 10):
+        be = Backend(memory, json_ttl=60)
+
+    assert be._read_json("info.json") == {"a": 1}
+    assert be._read_json("website_info.json") == {"b": 2}
+    assert memory.calls["read"] == 2
+    assert be._read_json("website_info.json") == {"b": 2}
+    assert memory.calls["read"] == 2
+    assert be._read_json("info.json") == {"a": 1}
+    assert memory.calls["read"] == 3
+
+
+def test_sharded_change_username():
+    """Tests that changing a username with sharded user records moves the user's blob."""
+    be = Backend(sharded_users=True)
+
+    be.password_bucket = MagicMock()
+    be.password_bucket.blob.return_value.exists.return_value = False
+    user_blob = MagicMock()
+    user_blob.download_as_bytes.return_value = b'{"profile_pic": "default-profile-pic.gif", "files_uploaded": []}'
+    new_user_blob = MagicMock()
+    be.content_bucket = MagicMock()
+    be.content_bucket.get_blob.return_value = user_blob
+    be.content_bucket.blob.return_value = new_user_blob
+
+    assert be.change_username("testing", "testing1") == True
+    be.content_bucket.blob.assert_called_once_with("users/testing1.json")
+    new_user_blob.upload_from_string.assert_called_once()
+    user_blob.delete.assert_called_once()
+
+
+def test_migrate_user_records():
+    """Tests that every user in info.json is copied into its own blob."""
+    be = Backend()
+
+    json_blob = MagicMock()
+    json_blob.download_as_bytes.return_value = json.dumps({
+        "a": {
+            "profile_pic": "default-profile-pic.gif",
+            "files_uploaded": ["x.html"]
+        },
+        "b": {
+            "profile_pic": "default-profile-pic.gif",
+            "files_uploaded": []
+        }
+    }).encode()
+    be.content_bucket = MagicMock()
+    be.content_bucket.get_blob.return_value = json_blob
+
+    assert be.migrate_user_records() == {"migrated": 2, "skipped": 0}
+    be.content_bucket.blob.assert_any_call("users/a.json")
+    be.content_bucket.blob.assert_any_call("users/b.json")
+    json_blob.upload_from_string.assert_not_called()
+
+
+def test_migrate_user_records_keeps_migrated_records():
+    """Tests that migrating again leaves the records that already have their own blob as they are."""
+    memory = storage.MemoryStorage()
+    content = memory.bucket("awesomewikicontent")
+    content.blob("info.json").upload_from_string(
+        json.dumps({
+            "a": {
+                "profile_pic": "",
+                "files_uploaded": ["x.html"]
+            },
+            "b": {
+                "profile_pic": "",
+                "files_uploaded": ["x.html"]
+            }
+        }))
+    content.blob("users/b.json").upload_from_string(
+        '{"profile_pic": "", "files_uploaded": ["x.html", "new.html"]}')
+    be = Backend(memory)
+
+    assert be.migrate_user_records() == {"migrated": 1, "skipped": 1}
+    assert json.loads(content.get_blob(
+        "users/a.json").download_as_bytes())["files_uploaded"] == ["x.html"]
+    assert json.loads(content.get_blob(
+        "users/b.json").download_as_bytes())["files_uploaded"] == [
+            "x.html", "new.html"
+        ]
+
+
+def test_modify_json_retries_on_conflict():
+    """Tests that a write conflicting with another writer is retried against the new content."""
+    be = Backend()
+    be.content_bucket = storage.MemoryStorage().bucket("content")
+    be.content_bucket.blob("website_info.json").upload_from_string(
+        '{"FAQ": []}')
+
+    other = be.content_bucket.blob("website_info.json")
+    load_json = be._load_json
+
+    def load_json_then_conflict(name):
+        loaded = load_json(name)
+        if other.generation is None:
+            other.upload_from_string('{"FAQ": [{"text": "first"}]}')
+        return loaded
+
+    with patch.object(be, '_load_json', side_effect=load_json_then_conflict):
+        be.submit_question("user", "second")
+    assert [question["text"] for question in be.get_faq()
+           ] == ["first", "second"]
+
+
+def test_modify_json_gives_up_after_retries():
+    """Tests that the conflict is raised instead of losing data when the file keeps changing."""
+    be = Backend(json_write_retries=2)
+    be.content_bucket = storage.MemoryStorage().bucket("content")
+    be.content_bucket.blob("website_info.json").upload_from_string(
+        '{"FAQ": []}')
+
+    blob = MagicMock()
+    blob.upload_from_string.side_effect = exceptions.PreconditionFailed("")
+    with patch.object(be, '_load_json', return_value=(blob, {"FAQ": []})):
+        with pytest.raises(exceptions.PreconditionFailed):
+            be.submit_question("user", "question")
+    assert blob.upload_from_string.call_count == 2
+
+
+def test_sign_up_race_lost():
+    """Tests that sign up fails when another request creates the same username first."""
+    be = Backend()
+    blob = MagicMock()
+    blob.exists.return_value = False
+    blob.upload_from_string.side_effect = exceptions.PreconditionFailed("")
+    be.password_bucket = MagicMock()
+    be.password_bucket.blob.return_value = blob
+    be.content_bucket = MagicMock()
+
+    assert be.sign_up("user", "password") == False
+    be.content_bucket.get_blob.assert_not_called()
+
+
+def test_concurrent_writers_stress():
+    """Fires hundreds of concurrent writers from two Backends at info.json and website_info.json and checks no update is lost."""
+    be = Backend(json_write_retries=100)
+    be.content_bucket = storage.MemoryStorage(latency=0.001).bucket("content")
+    other_be = Backend(json_write_retries=100)
+    other_be.content_bucket = be.content_bucket
+    be.content_bucket.blob("website_info.json").upload_from_string(
+        '{"FAQ": []}')
+    be.content_bucket.blob("info.json").upload_from_string(
+        json.dumps({"user": {
+            "profile_pic": "",
+            "files_uploaded": []
+        }}))
+    writers = 200
+    start = threading.Barrier(writers)
+    errors = []
+
+    def write(i):
+        try:
+            start.wait()
+            writer_be = be if i % 4 < 2 else other_be
+            if i % 2:
+                writer_be.submit_question("user", f"question{i}")
+            else:
+                writer_be._modify_user(
+                    "user",
+                    lambda user: user["files_uploaded"].append(f"{i}.html"))
+        except Exception as error:
+            errors.append(error)
+
+    threads = [
+        threading.Thread(target=write, args=(i,)) for i in range(writers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(be.get_faq()) == writers // 2
+    assert sorted(be.get_user_files("user")) == sorted(
+        f"{i}.html" for i in range(0, writers, 2))
+
+
+def test_concurrent_writes_are_coalesced():
+    """Tests that changes to info.json requested at the same time are committed with fewer uploads."""
+    be = Backend()
+    be.content_bucket = storage.MemoryStorage().bucket("content")
+    be.content_bucket.blob("info.json").upload_from_string("{}")
+    writers = 50
+    start = threading.Barrier(writers)
+
+    def sign_up(i):
+        start.wait()
+        be._add_user(f"user{i}", {"profile_pic": "", "files_uploaded": []})
+
+    threads = [
+        threading.Thread(target=sign_up, args=(i,)) for i in range(writers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    info = be.content_bucket.get_blob("info.json").download_as_bytes()
+    assert len(json.loads(info)) == writers
+    assert be.content_bucket.storage.calls["write"] < writers
+
+
+def test_coalesced_write_error_only_fails_its_caller():
+    """Tests that a change raising an exception does not prevent the rest of its group from being committed."""
+    be = Backend()
+    be.content_bucket = storage.MemoryStorage().bucket("content")
+    be.content_bucket.blob("info.json").upload_from_string("{}")
+
+    def add_user(json_dict):
+        json_dict["user"] = {"profile_pic": "", "files_uploaded": []}
+
+    failing = (lambda json_dict: json_dict["missing"], futures.Future())
+    succeeding = (add_user, futures.Future())
+    be._commit_json("info.json", [failing, succeeding])
+
+    assert isinstance(failing[1].exception(), KeyError)
+    assert succeeding[1].result()[0] is None
+    assert be.get_user_files("user") == []
+    assert be.content_bucket.storage.calls["write"] == 2
+
+
+def test_search_page_names():
+    """Tests that the page names are searched and the index follows uploads and deletes."""
+    memory = storage.MemoryStorage()
+    content = memory.bucket("awesomewikicontent")
+    content.blob("info.json").upload_from_string(
+        json.dumps(
+            {"user": {
+                "profile_pic": "",
+                "files_uploaded": ["cpu.html"]
+            }}))
+    for name in ["cpu.html", "gpu.html", "image.png"]:
+        content.blob(name).upload_from_string("<p></p>")
+    be = Backend(memory)
+
+    assert be.search_page_names("PU") == ["cpu.html", "gpu.html"]
+    assert be.search_page_names("image") == []
+    assert be.suggest_page_names("g") == ["gpu.html"]
+
+    file = io.BytesIO(b"<p></p>")
+    file.filename = "upload.html"
+    assert be.upload("user", "psu", file) == True
+    assert be.search_page_names("pu", limit=2) == ["cpu.html", "gpu.html"]
+    assert be.search_page_names("psu") == ["psu.html"]
+
+    be.delete_uploaded_file("user", "cpu.html")
+    assert be.search_page_names("u.") == ["gpu.html", "psu.html"]
+
+
+def test_search_pages():
+    """Tests that the full-text index is built in the background, saved, and updated by uploads and deletes."""
+    memory = storage.MemoryStorage()
+    content = memory.bucket("awesomewikicontent")
+    content.blob("info.json").upload_from_string(
+        json.dumps(
+            {"user": {
+                "profile_pic": "",
+                "files_uploaded": ["cpu.html"]
+            }}))
+    content.blob("cpu.html").upload_from_string(
+        "<h1>CPU</h1><p>The processor runs the <b>instructions</b>.</p>")
+    content.blob("gpu.html").upload_from_string(
+        "<h1>GPU</h1><p>The graphics card draws frames.</p>"
+        "<script>var processor = 1;</script>")
+    be = Backend(memory)
+
+    with patch.object(backend.threading, "Thread") as thread:
+        assert be.search_pages("processor") == []
+    thread.assert_called_once()
+    assert be.build_search_index() == 2
+    assert be.search_pages("processor") == ["cpu.html"]
+    assert be.search_pages("the") == ["cpu.html", "gpu.html"]
+    assert content.get_blob("search-index.seg") is not None
+
+    file = io.BytesIO(b"<p>A processor cooler keeps the processor cool.</p>")
+    file.filename = "upload.html"
+    assert be.upload("user", "cooler", file) == True
+    assert be.search_pages("processor") == ["cooler.html", "cpu.html"]
+    assert be.search_pages("processor", limit=1) == ["cooler.html"]
+
+    be.delete_uploaded_file("user", "cpu.html")
+    assert be.search_pages("processor") == ["cooler.html"]
+
+    other = Backend(memory, search_index_ttl=0)
+    assert other.search_pages("frames") == ["gpu.html"]
+    assert other.search_pages("processor") == ["cooler.html"]
+    assert len(list(content.list_blobs(prefix="search-index/"))) == 2
+
+
+def test_upload_indexes_page_in_chunks():
+    """Tests that an uploaded page is indexed from the chunks read for the upload, not read again whole."""
+    memory = storage.MemoryStorage()
+    memory.bucket("awesomewikicontent").blob("info.json").upload_from_string(
+        '{"user": {"profile_pic": "", "files_uploaded": []}}')
+    be = Backend(memory)
+    file = io.BytesIO(b"<p>The processor cooler</p>")
+    file.filename = "upload.html"
+    read = file.read
+    sizes = []
+
+    def record_read(size=-1):
+        sizes.append(size)
+        return read(size)
+
+    file.read = record_read
+    with patch.object(backend, "HASH_CHUNK_BYTES", 4):
+        assert be.upload("user", "cooler", file)
+
+    assert -1 not in sizes
+    with patch.object(backend.threading, "Thread"):
+        assert be.search_pages("processor") == ["cooler.html"]
+    assert be.search_pages("cool") == []
+
+
+def test_build_search_index_reads_pages_concurrently():
+    """Tests that building the full-text index keeps SEARCH_BUILD_IN_FLIGHT page reads in flight."""
+    memory = storage.MemoryStorage()
+    content = memory.bucket("awesomewikicontent")
+    for name in ["a", "b", "c", "d", "e", "f"]:
+        content.blob(f"{name}.html").upload_from_string(f"<p>{name}pu</p>")
+    be = Backend(memory)
+    barrier = threading.Barrier(3, timeout=5)
+    get_wiki_page = be.get_wiki_page
+
+    def wait_for_batch(name):
+        barrier.wait()
+        return get_wiki_page(name)
+
+    with patch.object(backend, "SEARCH_BUILD_IN_FLIGHT",
+                      3), patch.object(be, "get_wiki_page", wait_for_batch):
+        assert be.build_search_index() == 6
+    assert be.search_pages("epu") == ["e.html"]
+
+
+def test_search_deltas_applied_in_order():
+    """Tests that a delta segment file found after a newer one was applied is replayed in order."""
+    memory = storage.MemoryStorage()
+    content = memory.bucket("awesomewikicontent")
+    content.blob("info.json").upload_from_string(
+        '{"user": {"profile_pic": "", "files_uploaded": []}}')
+    content.blob("cpu.html").upload_from_string("<p>processor</p>")
+    first = Backend(memory, search_index_ttl=0)
+    second = Backend(memory)
+    first.build_search_index()
+    assert first.search_pages("zebra") == []
+
+    file = io.BytesIO(b"<p>zebra</p>")
+    file.filename = "upload.html"
+    assert second.upload("user", "x", file)
+    first.delete_uploaded_file("user", "x.html")
+
+    assert first.search_pages("zebra") == []
+    first._merge_search_deltas()
+    assert Backend(memory).search_pages("zebra") == []
+
+
+def test_failed_search_index_build_is_retried():
+    """Tests that a failed background build of the segment file is started again by the next read."""
+    memory = storage.MemoryStorage()
+    memory.bucket("awesomewikicontent").blob("cpu.html").upload_from_string(
+        "<p>processor</p>")
+    be = Backend(memory, search_index_ttl=0)
+    list_page_names = be._list_page_names
+    failures = [exceptions.ServiceUnavailable("GCS is down")]
+
+    def fail_once():
+        if failures:
+            raise failures.pop()
+        return list_page_names()
+
+    def wait_for_build():
+        for _ in range(500):
+            with be._search_index_lock:
+                if not be._search_index_busy:
+                    return
+            time.sleep(0.01)
+        raise AssertionError("The build did not finish")
+
+    with patch.object(be, "_list_page_names", fail_once):
+        assert be.search_pages("processor") == []
+        wait_for_build()
+        assert memory.bucket("awesomewikicontent").get_blob(
+            "search-index.seg") is None
+        assert be.search_pages("processor") == []
+        wait_for_build()
+    assert be.search_pages("processor") == ["cpu.html"]
+
+
+def test_build_search_index_skips_deleted_pages():
+    """Tests that pages deleted after the bucket was listed are left out of the index instead of failing the build."""
+    memory = storage.MemoryStorage()
+    memory.bucket("awesomewikicontent").blob("cpu.html").upload_from_string(
+        "<p>processor</p>")
+    be = Backend(memory)
+
+    with patch.object(be,
+                      "_list_page_names",
+                      return_value=["cpu.html", "deleted.html"]):
+        assert be.build_search_index() == 1
+    assert be.search_pages("processor") == ["cpu.html"]
+
+
+def test_search_deltas_merged():
+    """Tests that the delta segment files are merged into the segment file and deleted, and that readers follow."""
+    memory = storage.MemoryStorage()
+    content = memory.bucket("awesomewikicontent")
+    content.blob("info.json").upload_from_string(
+        '{"user": {"profile_pic": "", "files_uploaded": []}}')
+    content.blob("cpu.html").upload_from_string("<p>processor</p>")
+    be = Backend(memory)
+    be.build_search_index()
+    reader = Backend(memory, search_index_ttl=0)
+    assert reader.search_pages("processor") == ["cpu.html"]
+
+    with patch.object(backend, "SEARCH_MERGE_DELTAS",
+                      2), patch.object(Backend,
+                                       "_start_search_index_task") as start:
+        for name in ["gpu", "psu"]:
+            file = io.BytesIO(f"<p>{name} processor</p>".encode())
+            file.filename = "upload.html"
+            assert be.upload("user", name, file)
+        be.delete_uploaded_file("user", "gpu.html")
+        assert reader.search_pages("processor") == ["cpu.html", "psu.html"]
+    start.assert_called_with(reader._merge_search_deltas)
+
+    be._merge_search_deltas()
+    assert list(content.list_blobs(prefix="search-index/")) == []
+    assert content.get_blob("search-index.seg").metadata["merged"].count(
+        "search-index/") == 3
+    assert reader.search_pages("processor") == ["cpu.html", "psu.html"]
+    assert Backend(memory).search_pages("processor") == ["cpu.html", "psu.html"]
+
+
+def test_get_page_version():
+    """Tests that the version of a page is read from its metadata without downloading it."""
+    memory = storage.MemoryStorage()
+    content = memory.bucket("awesomewikicontent")
+    blob = content.blob("cpu.html")
+    blob.upload_from_string("<p>CPU</p>")
+    be = Backend(memory)
+
+    assert be.get_page_version("cpu.html") == (blob.generation, blob.md5_hash,
+                                               blob.updated, 10)
+    assert be.get_page_version("missing.html") is None
+    assert memory.calls["read"] == 0
+
+
+def test_get_wiki_page_cache():
+    """Tests that page content is downloaded once per generation and dropped when the page is deleted."""
+    memory = storage.MemoryStorage()
+    content = memory.bucket("awesomewikicontent")
+    content.blob("info.json").upload_from_string(
+        json.dumps(
+            {"user": {
+                "profile_pic": "",
+                "files_uploaded": ["cpu.html"]
+            }}))
+    content.blob("cpu.html").upload_from_string("<p>CPU</p>")
+    be = Backend(memory, page_cache_bytes=1024)
+
+    assert be.get_wiki_page("cpu.html") == "<p>CPU</p>"
+    assert be.get_wiki_page("cpu.html") == "<p>CPU</p>"
+    assert memory.calls["read"] == 1
+    assert (be.page_cache.hits, be.page_cache.misses) == (1, 1)
+
+    content.blob("cpu.html").upload_from_string("<p>New CPU</p>")
+    assert be.get_wiki_page("cpu.html") == "<p>New CPU</p>"
+    assert memory.calls["read"] == 2
+
+    be.delete_uploaded_file("user", "cpu.html")
+    assert len(be.page_cache) == 0
+    assert Backend(memory, page_cache_bytes=0).page_cache is None
+
+
+def test_disk_cache_shared_between_backends(tmp_path):
+    """Tests that a new Backend reads pages and page names from the disk cache filled by another one."""
+    memory = storage.MemoryStorage()
+    content = memory.bucket("awesomewikicontent")
+    content.blob("cpu.html").upload_from_string("<p>CPU</p>")
+    first = Backend(memory,
+                    page_cache_bytes=0,
+                    disk_cache=cache.DiskCache(str(tmp_path), 1024))
+    assert first.get_all_page_names() == ["cpu.html"]
+    assert first.get_wiki_page("cpu.html") == "<p>CPU</p>"
+    calls = dict(memory.calls)
+
+    second = Backend(memory,
+                     page_names_ttl=60,
+                     page_cache_bytes=0,
+                     disk_cache=cache.DiskCache(str(tmp_path), 1024))
+    with patch("threading.Thread"):
+        assert second.get_all_page_names() == ["cpu.html"]
+    assert second.get_wiki_page("cpu.html") == "<p>CPU</p>"
+    assert memory.calls["read"] == calls["read"]
+    assert memory.calls["list"] == calls["list"]
+
+    second.invalidate_page_names()
+    assert first.disk_cache.get("page-names", None) is None
+
+
+def test_stream_wiki_page():
+    """Tests that a page is streamed in ranged reads of its generation."""
+    memory = storage.MemoryStorage()
+    content = memory.bucket("awesomewikicontent")
+    blob = content.blob("cpu.html")
+    blob.upload_from_string("<p>CPU</p>")
+    be = Backend(memory)
+
+    encoding, size, chunks = be.stream_wiki_page("cpu.html", blob.generation, 4)
+
+    assert (encoding, size) == (None, 10)
+    assert list(chunks) == [b"<p>C", b"PU</", b"p>"]
+    _, _, stream = be.stream_wiki_page("cpu.html", blob.generation, 4)
+    next(stream)
+    blob.upload_from_string("<p>GPU</p>")
+    with pytest.raises(exceptions.PreconditionFailed):
+        next(stream)
+
+
+def test_upload_is_chunked():
+    """Tests that uploads are resumable uploads of UPLOAD_CHUNK_BYTES chunks."""
+    memory = storage.MemoryStorage()
+    be = Backend(memory)
+    memory.bucket("awesomewikicontent").blob("info.json").upload_from_string(
+        '{"user": {"profile_pic": "default-profile-pic.gif", "files_uploaded": []}}'
+    )
+    file = io.BytesIO(b"<p>CPU</p>")
+    file.filename = "cpu.html"
+    uploaded = []
+    upload_from_file = storage.StoredBlob.upload_from_file
+
+    def record_chunk_size(blob, *args, **kwargs):
+        uploaded.append(blob.chunk_size)
+        upload_from_file(blob, *args, **kwargs)
+
+    with patch.object(storage.StoredBlob, "upload_from_file",
+                      record_chunk_size), patch.object(Backend,
+                                                       "_update_search_index"):
+        assert be.upload("user", "cpu", file)
+
+    assert uploaded == [backend.UPLOAD_CHUNK_BYTES]
+    assert be.get_wiki_page("cpu.html") == "<p>CPU</p>"
+
+
+def test_pages_with_the_same_content_share_one_object():
+    """Tests that identical pages are stored once and the content is deleted with the last page pointing to it."""
+    memory = storage.MemoryStorage()
+    content = memory.bucket("awesomewikicontent")
+    content.blob("info.json").upload_from_string(
+        '{"user": {"profile_pic": "default-profile-pic.gif", "files_uploaded": []}}'
+    )
+    be = Backend(memory)
+
+    with patch.object(Backend, "_update_search_index"):
+        for name in ["cpu", "processor", "gpu"]:
+            page = b"<p>GPU</p>" if name == "gpu" else b"<p>CPU</p>"
+            file = io.BytesIO(page)
+            file.filename = f"{name}.html"
+            assert be.upload("user", name, file)
+
+        objects = [blob.name for blob in content.list_blobs(prefix="objects/")]
+        assert len(objects) == 2
+        assert be.get_wiki_page("cpu.html") == "<p>CPU</p>"
+        assert be.get_wiki_page("processor.html") == "<p>CPU</p>"
+        assert be.get_wiki_page("gpu.html") == "<p>GPU</p>"
+        assert len(be.page_cache) == 2
+        version = be.get_page_version("cpu.html")
+        assert version[3] == 10
+        _, size, chunks = be.stream_wiki_page("cpu.html", version[0], 4)
+        assert size == 10
+        assert b"".join(chunks) == b"<p>CPU</p>"
+
+        be.delete_uploaded_file("user", "cpu.html")
+        assert be.get_wiki_page("processor.html") == "<p>CPU</p>"
+        be.delete_uploaded_file("user", "processor.html")
+    assert len(list(content.list_blobs(prefix="objects/"))) == 1
+    refs = list(content.list_blobs(prefix="refs/"))
+    assert len(refs) == 1
+    assert json.loads(refs[0].download_as_bytes())["count"] == 1
+    digest = refs[0].name[len("refs/"):-len(".json")]
+    assert content.get_blob("objects/" + digest) is not None
+
+
+def test_released_object_is_kept_when_uploaded_again():
+    """Tests that an object is not deleted if it was uploaded again after the generation recorded for it."""
+    memory = storage.MemoryStorage()
+    content = memory.bucket("awesomewikicontent")
+    be = Backend(memory)
+    be._retain_object("digest", io.BytesIO(b"<p>CPU</p>"), None, 10)
+    content.blob("objects/digest").upload_from_string("<p>CPU</p>")
+
+    be._release_object("digest")
+
+    assert content.get_blob("objects/digest") is not None
+    assert content.get_blob("refs/digest.json") is None
+
+
+def test_pages_are_stored_compressed():
+    """Tests that pages are stored gzip compressed, read decompressed, and streamed compressed only when accepted."""
+    memory = storage.MemoryStorage()
+    content = memory.bucket("awesomewikicontent")
+    content.blob("info.json").upload_from_string(
+        '{"user": {"profile_pic": "default-profile-pic.gif", "files_uploaded": []}}'
+    )
+    page = b"<p>" + b"CPU " * 1000 + b"</p>"
+    for dedup_pages in [True, False]:
+        be = Backend(memory, dedup_pages=dedup_pages)
+        name = f"cpu{dedup_pages}"
+        file = io.BytesIO(page)
+        file.filename = f"{name}.html"
+        with patch.object(Backend, "_update_search_index"):
+            assert be.upload("user", name, file)
+
+        stored = [
+            blob for blob in content.list_blobs()
+            if blob.content_encoding == "gzip" and
+            gzip.decompress(blob.download_as_bytes()) == page
+        ]
+        assert len(stored) == 1
+        assert stored[0].size < len(page) / 10
+        assert be.get_wiki_page(f"{name}.html") == page.decode()
+        generation, _, _, size = be.get_page_version(f"{name}.html")
+        assert size == len(page)
+
+        encoding, size, chunks = be.stream_wiki_page(f"{name}.html", generation,
+                                                     16)
+        assert (encoding, size) == (None, len(page))
+        assert b"".join(chunks) == page
+        encoding, size, chunks = be.stream_wiki_page(f"{name}.html",
+                                                     generation,
+                                                     16,
+                                                     accept_gzip=True)
+        assert (encoding, size) == ("gzip", stored[0].size)
+        assert gzip.decompress(b"".join(chunks)) == page
+        stored[0].delete()
+
+
+def test_failed_object_upload_is_taken_over():
+    """Tests that a page with the same content as a page whose object upload fails uploads the object itself."""
+    memory = storage.MemoryStorage()
+    content = memory.bucket("awesomewikicontent")
+    content.blob("info.json").upload_from_string(
+        '{"a": {"profile_pic": "", "files_uploaded": []}, "b": {"profile_pic": "", "files_uploaded": []}}'
+    )
+    be = Backend(memory)
+    page = b"<p>CPU</p>"
+    upload_file = Backend._upload_file
+    failed = []
+
+    def fail_first_object_upload(self, blob, file, **kwargs):
+        if blob.name.startswith("objects/") and not failed:
+            failed.append(blob.name)
+            # The second page is uploaded while the first object upload is running.
+            other = io.BytesIO(page)
+            other.filename = "pb.html"
+            assert be.upload("b", "pb", other)
+            raise exceptions.ServiceUnavailable("GCS is down")
+        return upload_file(self, blob, file, **kwargs)
+
+    file = io.BytesIO(page)
+    file.filename = "pa.html"
+    with patch.object(Backend, "_upload_file",
+                      fail_first_object_upload), patch.object(
+                          Backend, "_update_search_index"):
+        with pytest.raises(exceptions.ServiceUnavailable):
+            be.upload("a", "pa", file)
+
+    assert be.get_wiki_page("pb.html") == "<p>CPU</p>"
+    assert content.get_blob("pa.html") is None
+    digest = failed[0][len("objects/"):]
+    record = json.loads(
+        content.get_blob(f"refs/{digest}.json").download_as_bytes())
+    assert record["count"] == 1
+    assert record["generation"] == content.get_blob(failed[0]).generation
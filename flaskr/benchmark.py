@@ -0,0 +1,422 @@
+"""End-to-end benchmarks of the wiki routes.
+
+Drives the app built by create_app() through the Flask test client against the in-memory storage, so the results
+measure the app's own overhead plus the simulated storage latency. For every data size and route it reports latency
+percentiles, throughput, the number of storage calls, the response size and the time spent rendering templates per
+request, as JSON that can be compared between runs:
+
+    python -m flaskr.benchmark --sizes 10,1000,100000 --output results.json
+    python -m flaskr.benchmark --sizes 10,1000 --baseline results.json
+
+Comparing a run with the page names embedded in every page against one loading them lazily:
+
+    python -m flaskr.benchmark --sizes 10000 --embed-page-names --output embedded.json
+    python -m flaskr.benchmark --sizes 10000 --baseline embedded.json
+
+Comparing page reads made one at a time, as the routes make them, with 256 reads kept in flight by a thread pool:
+
+    python -m flaskr.benchmark --sizes 1000 --latency 0.02 --concurrent-requests 2000 --in-flight 256
+
+The routes stay synchronous. Flask 2.1 runs an async view on its own event loop through asgiref, one request at a
+time per worker thread, so async routes would not let a worker hold more requests in flight than it has threads.
+"""
+from concurrent import futures
+from flaskr import create_app
+import argparse
+import hashlib
+import io
+import jinja2
+import json
+import logging
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+# Number of page reads kept in flight by the concurrent path of benchmark_concurrent.
+IN_FLIGHT = 256
+
+USERNAME = "benchmark_user"
+PASSWORD = "benchmark_password1#"
+
+
+def hash_password(username, password):
+    """Hashes a password the same way the signup and login routes do."""
+    with_salt = f"{username}superduperteamawesome{password}"
+    return hashlib.blake2b(with_salt.encode()).hexdigest()
+
+
+def seed(be, size):
+    """Fills the buckets of the Backend with size pages and size users.
+
+    Args:
+        be: the Backend of the app, using an empty in-memory storage.
+        size: the number of pages and users to create.
+    """
+    users = {
+        f"user{i}": {
+            "profile_pic": "default-profile-pic.gif",
+            "files_uploaded": [f"page{i}.html"]
+        } for i in range(size)
+    }
+    users[USERNAME] = {
+        "profile_pic": "default-profile-pic.gif",
+        "files_uploaded": []
+    }
+    be.content_bucket.blob("info.json").upload_from_string(json.dumps(users))
+    faq = [{
+        "text": f"question{i}",
+        "user": f"user{i}",
+        "replies": [{
+            "text": "reply",
+            "user": USERNAME
+        }]
+    } for i in range(min(size, 100))]
+    be.content_bucket.blob("website_info.json").upload_from_string(
+        json.dumps({"FAQ": faq}))
+    for name in ["camila", "sarah", "ricardo", "default-profile-pic.gif"]:
+        be.content_bucket.blob(name).upload_from_string(b"image")
+    for i in range(size):
+        be.content_bucket.blob(f"page{i}.html").upload_from_string(
+            f"<h1>Page {i}</h1>" + "<p>Building a PC.</p>" * 50)
+    be.password_bucket.blob(USERNAME).upload_from_string(
+        hash_password(USERNAME, PASSWORD))
+
+
+def route_requests(size):
+    """Returns the benchmarked requests as tuples of a name, whether they need a logged in user, and a function making
+    the request with a test client given the iteration number."""
+    page = f"/pages/page{size // 2}.html"
+
+    def upload(client, i):
+        data = {
+            "File name": f"benchmark{i}",
+            "File": (io.BytesIO(b"<p>uploaded</p>"), "upload.html")
+        }
+        return client.post("/upload",
+                           data=data,
+                           content_type="multipart/form-data")
+
+    return [
+        ("GET /", False, lambda client, i: client.get("/")),
+        ("GET /pages", False, lambda client, i: client.get("/pages")),
+        ("GET /pages/<title>", False, lambda client, i: client.get(page)),
+        ("GET /about", False, lambda client, i: client.get("/about")),
+        ("GET /FAQ", False, lambda client, i: client.get("/FAQ")),
+        ("GET /login", False, lambda client, i: client.get("/login")),
+        ("POST /login", False, lambda client, i: client.post(
+            "/login", data={
+                "Username": USERNAME,
+                "Password": PASSWORD
+            })),
+        ("GET /signup", False, lambda client, i: client.get("/signup")),
+        ("POST /signup", False, lambda client, i: client.post(
+            "/signup", data={
+                "Username": f"new_user{i}",
+                "Password": PASSWORD
+            })),
+        ("POST /search-results", False, lambda client, i: client.post(
+            "/search-results", data={"SearchInput": "page1"})),
+        ("GET /profile", True, lambda client, i: client.get("/profile")),
+        ("GET /upload", True, lambda client, i: client.get("/upload")),
+        ("POST /upload", True, upload),
+    ]
+
+
+def percentile(samples, fraction):
+    """Returns the value below which the given fraction of the sorted samples fall."""
+    index = min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))
+    return samples[index]
+
+
+def time_templates(app):
+    """Makes the app add the time spent rendering every template to a list.
+
+    Returns:
+        A list whose only item is the total number of seconds spent rendering templates.
+    """
+    render_seconds = [0]
+
+    class TimedTemplate(jinja2.Template):
+
+        def render(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return super().render(*args, **kwargs)
+            finally:
+                render_seconds[0] += time.perf_counter() - started
+
+    app.jinja_env.template_class = TimedTemplate
+    return render_seconds
+
+
+def benchmark_size(size,
+                   iterations,
+                   warmup,
+                   latency,
+                   jitter,
+                   embed_page_names=False):
+    """Benchmarks every route against buckets holding size pages and users.
+
+    Args:
+        size: the number of pages and users in the buckets.
+        iterations: the number of measured requests per route.
+        warmup: the number of requests per route made before measuring.
+        latency: seconds each storage call takes.
+        jitter: maximum number of seconds added to or removed from the latency.
+        embed_page_names: True to run with EMBED_PAGE_NAMES on.
+
+    Returns:
+        A dictionary from route name to its measurements.
+    """
+    app = create_app({
+        "TESTING": True,
+        "STORAGE_BACKEND": "memory",
+        "MEMORY_STORAGE_LATENCY": latency,
+        "MEMORY_STORAGE_JITTER": jitter,
+        "EMBED_PAGE_NAMES": embed_page_names,
+    })
+    render_seconds = time_templates(app)
+    be = app.extensions["backend"]
+    seed(be, size)
+    storage = be.storage_client
+    anonymous = app.test_client()
+    logged_in = app.test_client()
+    logged_in.post("/login", data={"Username": USERNAME, "Password": PASSWORD})
+
+    results = {}
+    for name, needs_login, make_request in route_requests(size):
+        client = logged_in if needs_login else anonymous
+        for i in range(warmup):
+            make_request(client, -1 - i)
+        calls_before = sum(storage.calls.values())
+        render_before = render_seconds[0]
+        timings = []
+        response_bytes = 0
+        started = time.perf_counter()
+        for i in range(iterations):
+            request_started = time.perf_counter()
+            response = make_request(client, i)
+            timings.append(time.perf_counter() - request_started)
+            response_bytes += len(response.data)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{name} returned {response.status_code}")
+        elapsed = time.perf_counter() - started
+        calls = sum(storage.calls.values()) - calls_before
+        rendering = render_seconds[0] - render_before
+        timings.sort()
+        results[name] = {
+            "p50_ms": percentile(timings, 0.50) * 1000,
+            "p95_ms": percentile(timings, 0.95) * 1000,
+            "p99_ms": percentile(timings, 0.99) * 1000,
+            "mean_ms": statistics.mean(timings) * 1000,
+            "requests_per_second": iterations / elapsed,
+            "storage_calls_per_request": calls / iterations,
+            "response_bytes": response_bytes // iterations,
+            "render_ms": rendering / iterations * 1000,
+        }
+    return results
+
+
+def benchmark_concurrent(size, requests, in_flight, latency, jitter):
+    """Compares the throughput and peak memory of reading pages one at a time with keeping many reads in flight.
+
+    The page cache is turned off so every read goes to the storage.
+
+    Args:
+        size: the number of pages and users in the buckets.
+        requests: the number of pages read by each path.
+        in_flight: the most reads the concurrent path keeps in flight.
+        latency: seconds each storage call takes.
+        jitter: maximum number of seconds added to or removed from the latency.
+
+    Returns:
+        A dictionary with the reads per second and the peak bytes allocated by the sequential and concurrent paths.
+    """
+    app = create_app({
+        "TESTING": True,
+        "STORAGE_BACKEND": "memory",
+        "MEMORY_STORAGE_LATENCY": latency,
+        "MEMORY_STORAGE_JITTER": jitter,
+        "PAGE_CACHE_BYTES": 0,
+    })
+    be = app.extensions["backend"]
+    seed(be, size)
+    names = [f"page{i % size}.html" for i in range(requests)]
+    executor = futures.ThreadPoolExecutor(max_workers=in_flight)
+
+    def sequential_reads():
+        for name in names:
+            be.get_wiki_page(name)
+
+    def concurrent_reads():
+        for _ in executor.map(be.get_wiki_page, names):
+            pass
+
+    results = {"in_flight": in_flight}
+    tracemalloc.start()
+    try:
+        for name, reads in [("sequential", sequential_reads),
+                            ("concurrent", concurrent_reads)]:
+            tracemalloc.reset_peak()
+            started = time.perf_counter()
+            reads()
+            elapsed = time.perf_counter() - started
+            results[name] = {
+                "requests_per_second": requests / elapsed,
+                "peak_memory_bytes": tracemalloc.get_traced_memory()[1],
+            }
+    finally:
+        tracemalloc.stop()
+        executor.shutdown()
+    return results
+
+
+def run(sizes,
+        iterations=50,
+        warmup=5,
+        latency=0,
+        jitter=0,
+        embed_page_names=False,
+        concurrent_requests=0,
+        in_flight=IN_FLIGHT):
+    """Runs the benchmarks for every data size.
+
+    Args:
+        sizes: the numbers of pages and users to benchmark with.
+        iterations: the number of measured requests per route.
+        warmup: the number of requests per route made before measuring.
+        latency: seconds each storage call takes.
+        jitter: maximum number of seconds added to or removed from the latency.
+        embed_page_names: True to run with EMBED_PAGE_NAMES on.
+        concurrent_requests: the number of page reads made to compare the sequential and concurrent paths, 0 to not
+            compare them.
+        in_flight: the most reads the concurrent path keeps in flight.
+
+    Returns:
+        A dictionary with the benchmark settings and the results for every size.
+    """
+    output = {
+        "python": platform.python_version(),
+        "iterations": iterations,
+        "storage_latency": latency,
+        "storage_jitter": jitter,
+        "embed_page_names": embed_page_names,
+        "results": {
+            str(size): benchmark_size(size, iterations, warmup, latency, jitter,
+                                      embed_page_names) for size in sizes
+        }
+    }
+    if concurrent_requests:
+        output["concurrent_reads"] = {
+            str(size): benchmark_concurrent(size, concurrent_requests,
+                                            in_flight, latency, jitter)
+            for size in sizes
+        }
+    return output
+
+
+def compare(baseline, current, threshold):
+    """Compares the p50 latency of every route with a previous run.
+
+    Args:
+        baseline: the output of a previous run.
+        current: the output of this run.
+        threshold: the ratio above which a route is reported as a regression.
+
+    Returns:
+        A list of lines describing the routes that regressed.
+    """
+    regressions = []
+    for size, routes in current["results"].items():
+        for name, result in routes.items():
+            previous = baseline["results"].get(size, {}).get(name)
+            if previous is None or previous["p50_ms"] == 0:
+                continue
+            ratio = result["p50_ms"] / previous["p50_ms"]
+            if ratio > threshold:
+                regressions.append(
+                    f"{name} with {size} pages: p50 {previous['p50_ms']:.2f}ms -> {result['p50_ms']:.2f}ms ({ratio:.2f}x)"
+                )
+    return regressions
+
+
+def compare_responses(baseline, current):
+    """Compares the response size and template render time of every route with a previous run.
+
+    Args:
+        baseline: the output of a previous run.
+        current: the output of this run.
+
+    Returns:
+        A list of lines describing the change of every route.
+    """
+    lines = []
+    for size, routes in current["results"].items():
+        for name, result in routes.items():
+            previous = baseline["results"].get(size, {}).get(name)
+            if previous is None or "render_ms" not in previous:
+                continue
+            lines.append(
+                f"{name} with {size} pages: {previous['response_bytes']} -> {result['response_bytes']} bytes, render {previous['render_ms']:.2f}ms -> {result['render_ms']:.2f}ms"
+            )
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes",
+                        default="10,1000,100000",
+                        help="comma separated numbers of pages and users")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--latency",
+                        type=float,
+                        default=0,
+                        help="seconds each storage call takes")
+    parser.add_argument("--jitter", type=float, default=0)
+    parser.add_argument("--embed-page-names",
+                        action="store_true",
+                        help="run with EMBED_PAGE_NAMES on")
+    parser.add_argument(
+        "--concurrent-requests",
+        type=int,
+        default=0,
+        help="page reads made to compare the sequential and concurrent paths")
+    parser.add_argument("--in-flight", type=int, default=IN_FLIGHT)
+    parser.add_argument("--output", help="file to write the JSON results to")
+    parser.add_argument("--baseline",
+                        help="JSON results of a previous run to compare with")
+    parser.add_argument("--threshold",
+                        type=float,
+                        default=1.2,
+                        help="p50 ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = run(sizes, args.iterations, args.warmup, args.latency,
+                  args.jitter, args.embed_page_names, args.concurrent_requests,
+                  args.in_flight)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        for line in compare_responses(baseline, results):
+            print(line, file=sys.stderr)
+        regressions = compare(baseline, results, args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+from flaskr import benchmark
+import json
+
+
+def test_run_measures_every_route():
+    """Tests that a short benchmark run reports every route with its storage calls."""
+    results = benchmark.run([10], iterations=2, warmup=1)
+
+    routes = results["results"]["10"]
+    assert len(routes) == len(benchmark.route_requests(10))
+    for result in routes.values():
+        assert result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+        assert result["requests_per_second"] > 0
+    assert routes["GET /about"]["storage_calls_per_request"] == 3
+    assert routes["POST /upload"]["storage_calls_per_request"] > 0
+    json.dumps(results)
+
+
+def test_compare_reports_regressions():
+    """Tests that routes slower than the threshold are reported as regressions."""
+    baseline = {"results": {"10": {"GET /": {"p50_ms": 1.0}}}}
+    current = {"results": {"10": {"GET /": {"p50_ms": 1.5}}}}
+
+    assert len(benchmark.compare(baseline, current, 1.2)) == 1
+    assert benchmark.compare(baseline, current, 2) == []
+
+
+def test_lazy_page_names_shrink_responses():
+    """Tests that turning off EMBED_PAGE_NAMES keeps the page names out of the responses and their rendering."""
+    embedded = benchmark.run([200],
+                             iterations=1,
+                             warmup=0,
+                             embed_page_names=True)
+    lazy = benchmark.run([200], iterations=1, warmup=0)
+
+    before = embedded["results"]["200"]["GET /about"]
+    after = lazy["results"]["200"]["GET /about"]
+    assert before["render_ms"] > 0
+    assert after["response_bytes"] < before["response_bytes"] - 200 * 40
+    assert len(benchmark.compare_responses(embedded, lazy)) == len(
+        benchmark.route_requests(200))
+
+
+def test_benchmark_concurrent():
+    """Tests that the sequential and concurrent paths are both measured."""
+    results = benchmark.benchmark_concurrent(10,
+                                             requests=20,
+                                             in_flight=4,
+                                             latency=0,
+                                             jitter=0)
+
+    assert results["in_flight"] == 4
+    for path in ["sequential", "concurrent"]:
+        assert results[path]["requests_per_second"] > 0
+        assert results[path]["peak_memory_bytes"] > 0
@@ -0,0 +1,235 @@
+import collections
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import urllib.parse
+
+
+class LRUCache:
+    """A cache of versioned values that evicts the least recently used ones once their total size exceeds a budget.
+
+    Each key holds one version of its value, identified by a generation. Looking up a key with another generation is a
+    miss, so values replaced elsewhere are never returned.
+
+    Attributes:
+        max_bytes: the most bytes the cached values may take in total.
+        size: the bytes the cached values take.
+        hits: the number of lookups that found the value.
+        misses: the number of lookups that did not find the value.
+        evictions: the number of values evicted to make room for others.
+    """
+
+    def __init__(self, max_bytes):
+        """Initializes an empty cache holding at most max_bytes."""
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, generation):
+        """Returns the cached value of the key with the given generation, or None if it is not cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != generation:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, generation, value, size):
+        """Caches a version of the value of a key, evicting the least recently used values if needed.
+
+        Args:
+            key: the key of the value.
+            generation: the version of the value.
+            value: the value to cache.
+            size: the number of bytes the value takes. Values larger than max_bytes are not cached.
+        """
+        with self._lock:
+            self._discard(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (generation, value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def discard(self, key):
+        """Removes the value of the key from the cache, if it is cached."""
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+
+class DiskCache:
+    """A cache of versioned values on the local disk, shared by every process using the same directory.
+
+    Values are stored once per content, in files named after their SHA-256 in the objects directory. The index
+    directory holds a small JSON file per key with the generation and the hash of its value. Files are written to the
+    tmp directory and then renamed into place, so readers never see partial files and need no lock. When the values
+    take more than max_bytes, the least recently used ones are deleted under an exclusive lock, and keys whose value
+    was deleted become misses until their index files are deleted too.
+
+    The cache only saves downloads, so a failing disk makes lookups miss and values go uncached instead of raising.
+
+    Attributes:
+        root: the directory of the cache.
+        max_bytes: the most bytes the cached values may take in total.
+        size: the bytes the cached values took when they were last counted.
+        hits: the number of lookups by this process that found the value.
+        misses: the number of lookups by this process that did not find the value.
+        evictions: the number of values this process deleted to make room for others.
+    """
+
+    def __init__(self, root, max_bytes):
+        """Initializes the cache in the given directory, creating it if needed."""
+        self.root = root
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._written = 0
+        for directory in ["objects", "index", "tmp"]:
+            os.makedirs(os.path.join(root, directory), exist_ok=True)
+
+    def _index_path(self, key):
+        return os.path.join(self.root, "index", urllib.parse.quote(key,
+                                                                   safe=""))
+
+    def _object_path(self, digest):
+        return os.path.join(self.root, "objects", digest)
+
+    def _replace(self, path, data):
+        descriptor, temp_path = tempfile.mkstemp(
+            dir=os.path.join(self.root, "tmp"))
+        try:
+            with os.fdopen(descriptor, "wb") as temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+    def get(self, key, generation):
+        """Returns the cached bytes of the key with the given generation, or None if they are not cached."""
+        try:
+            with open(self._index_path(key)) as index_file:
+                entry = json.load(index_file)
+            if entry["generation"] != generation:
+                raise LookupError(key)
+            object_path = self._object_path(entry["digest"])
+            with open(object_path, "rb") as object_file:
+                data = object_file.read()
+            # The modification time of the objects orders them for eviction.
+            os.utime(object_path)
+        except (OSError, ValueError, LookupError, TypeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key, generation, data):
+        """Caches a version of the bytes of a key, evicting the least recently used values if needed.
+
+        Failures are logged, leaving the value uncached.
+
+        Args:
+            key: the key of the value.
+            generation: the version of the value, anything JSON can store.
+            data: the bytes to cache.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        object_path = self._object_path(digest)
+        try:
+            try:
+                os.utime(object_path)
+            except FileNotFoundError:
+                # Never cached, or evicted since, possibly by another process right after it was found.
+                self._replace(object_path, data)
+                self._written += len(data)
+            self._replace(
+                self._index_path(key),
+                json.dumps({
+                    "generation": generation,
+                    "digest": digest
+                }).encode())
+            # Counting the cached bytes lists the whole cache, so it is only done once in a while.
+            if self._written * 10 >= self.max_bytes:
+                self.evict()
+        except OSError:
+            logging.exception("Could not cache %s on disk.", key)
+
+    def discard(self, key):
+        """Removes the key from the cache, if it is cached. Its value is deleted by eviction once unused."""
+        try:
+            os.remove(self._index_path(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Deletes the least recently used values until the cached values take at most max_bytes.
+
+        The index files of the keys whose value is gone are deleted too, so keys that are never looked up again do not
+        pile up.
+        """
+        with open(os.path.join(self.root, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            objects = []
+            for entry in os.scandir(os.path.join(self.root, "objects")):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                objects.append((stat.st_mtime, stat.st_size, entry.path))
+            self.size = sum(size for _, size, _ in objects)
+            objects.sort()
+            for _, size, path in objects:
+                if self.size <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                self.size -= size
+                self.evictions += 1
+            self._remove_dangling_index_files()
+        self._written = 0
+
+    def _remove_dangling_index_files(self):
+        """Deletes the index files naming a value that is not cached anymore. The caller must hold the lock."""
+        for entry in os.scandir(os.path.join(self.root, "index")):
+            try:
+                with open(entry.path) as index_file:
+                    digest = json.load(index_file)["digest"]
+                if os.path.exists(self._object_path(digest)):
+                    continue
+            except FileNotFoundError:
+                continue
+            except (ValueError, LookupError, TypeError):
+                # Unreadable, so it could only ever miss.
+                pass
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
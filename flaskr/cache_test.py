@@ -0,0 +1,111 @@
+from flaskr import cache
+from unittest.mock import patch
+import os
+
+
+def test_lru_cache_hits_and_misses():
+    """Tests that only the cached generation of a value is returned."""
+    lru_cache = cache.LRUCache(100)
+    lru_cache.put("cpu.html", 1, "cpu", 3)
+
+    assert lru_cache.get("cpu.html", 1) == "cpu"
+    assert lru_cache.get("cpu.html", 2) is None
+    assert lru_cache.get("gpu.html", 1) is None
+    assert (lru_cache.hits, lru_cache.misses) == (1, 2)
+
+    lru_cache.put("cpu.html", 2, "new cpu", 7)
+    assert lru_cache.get("cpu.html", 2) == "new cpu"
+    assert lru_cache.size == 7
+    lru_cache.discard("cpu.html")
+    assert lru_cache.get("cpu.html", 2) is None
+    assert lru_cache.size == 0
+
+
+def test_lru_cache_evicts_least_recently_used():
+    """Tests that values are evicted by total size, least recently used first."""
+    lru_cache = cache.LRUCache(10)
+    lru_cache.put("a", 1, "a", 4)
+    lru_cache.put("b", 1, "b", 4)
+    lru_cache.get("a", 1)
+    lru_cache.put("c", 1, "c", 4)
+
+    assert lru_cache.get("b", 1) is None
+    assert lru_cache.get("a", 1) == "a"
+    assert lru_cache.get("c", 1) == "c"
+    assert lru_cache.size == 8
+    assert lru_cache.evictions == 1
+
+    lru_cache.put("huge", 1, "huge", 11)
+    assert lru_cache.get("huge", 1) is None
+    assert len(lru_cache) == 2
+
+
+def test_disk_cache_shared_between_instances(tmp_path):
+    """Tests that values cached by one instance are found by another using the same directory."""
+    writer = cache.DiskCache(str(tmp_path), 1024)
+    reader = cache.DiskCache(str(tmp_path), 1024)
+    writer.put("pages/cpu.html", 1, b"<p>CPU</p>")
+    writer.put("pages/copy.html", 7, b"<p>CPU</p>")
+
+    assert reader.get("pages/cpu.html", 1) == b"<p>CPU</p>"
+    assert reader.get("pages/copy.html", 7) == b"<p>CPU</p>"
+    assert reader.get("pages/cpu.html", 2) is None
+    assert reader.get("pages/gpu.html", 1) is None
+    assert (reader.hits, reader.misses) == (2, 2)
+    assert len(os.listdir(tmp_path / "objects")) == 1
+
+    reader.discard("pages/cpu.html")
+    assert writer.get("pages/cpu.html", 1) is None
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    """Tests that the least recently used values are deleted once the cache is over its budget."""
+    disk_cache = cache.DiskCache(str(tmp_path), 25)
+    disk_cache.put("a", 1, b"a" * 10)
+    disk_cache.put("b", 1, b"b" * 10)
+    for name in os.listdir(tmp_path / "objects"):
+        os.utime(tmp_path / "objects" / name, (0, 0))
+    assert disk_cache.get("b", 1) == b"b" * 10
+    disk_cache.put("c", 1, b"c" * 10)
+
+    assert disk_cache.evictions == 1
+    assert disk_cache.size == 20
+    assert disk_cache.get("a", 1) is None
+    assert disk_cache.get("b", 1) == b"b" * 10
+    assert disk_cache.get("c", 1) == b"c" * 10
+
+
+def test_disk_cache_rewrites_evicted_value(tmp_path):
+    """Tests that caching a value again writes it back if another process evicted it after it was found."""
+    disk_cache = cache.DiskCache(str(tmp_path), 100)
+    disk_cache.put("a", 1, b"cpu")
+    for name in os.listdir(tmp_path / "objects"):
+        os.remove(tmp_path / "objects" / name)
+
+    disk_cache.put("b", 1, b"cpu")
+    assert disk_cache.get("a", 1) == b"cpu"
+    assert disk_cache.get("b", 1) == b"cpu"
+
+
+def test_disk_cache_failures_are_misses(tmp_path):
+    """Tests that a failing disk leaves values uncached and makes lookups miss instead of raising."""
+    disk_cache = cache.DiskCache(str(tmp_path), 100)
+    with patch.object(cache.os, "replace", side_effect=OSError("disk full")):
+        disk_cache.put("a", 1, b"cpu")
+    (tmp_path / "index" / "b").write_text('["not", "an", "entry"]')
+
+    assert disk_cache.get("a", 1) is None
+    assert disk_cache.get("b", 1) is None
+    assert os.listdir(tmp_path / "tmp") == []
+
+
+def test_disk_cache_evict_removes_dangling_index_files(tmp_path):
+    """Tests that eviction deletes the index files of the keys whose value was evicted."""
+    disk_cache = cache.DiskCache(str(tmp_path), 15)
+    disk_cache.put("a", 1, b"a" * 10)
+    for name in os.listdir(tmp_path / "objects"):
+        os.utime(tmp_path / "objects" / name, (0, 0))
+    disk_cache.put("b", 1, b"b" * 10)
+
+    assert sorted(os.listdir(tmp_path / "index")) == ["b"]
+    assert disk_cache.get("b", 1) == b"b" * 10
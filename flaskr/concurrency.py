@@ -0,0 +1,41 @@
+from concurrent import futures
+import contextvars
+import threading
+
+# Number of threads running the calls given to gather.
+FANOUT_WORKERS = 16
+_THREAD_NAME_PREFIX = "fanout"
+
+_executor = futures.ThreadPoolExecutor(max_workers=FANOUT_WORKERS,
+                                       thread_name_prefix=_THREAD_NAME_PREFIX)
+
+
+def gather(*calls):
+    """Runs independent calls at the same time and returns their results, so a route waits for the slowest call instead
+    of the sum of all of them.
+
+    The first call runs on the calling thread and the others on a shared thread pool. Each call runs in a copy of the
+    caller's context, so flask.g, the request and the logged in user are available to it. Calls made from inside a
+    call run one after another, so they never wait for threads of the pool they are holding.
+
+    Args:
+        calls: functions taking no arguments.
+
+    Returns:
+        A list of the results of the calls, in the same order.
+
+    Raises:
+        The exception of the first call that failed, once every call finished.
+    """
+    if len(calls) < 2 or threading.current_thread().name.startswith(
+            _THREAD_NAME_PREFIX):
+        return [call() for call in calls]
+    submitted = [
+        _executor.submit(contextvars.copy_context().run, call)
+        for call in calls[1:]
+    ]
+    try:
+        first = calls[0]()
+    finally:
+        futures.wait(submitted)
+    return [first] + [future.result() for future in submitted]
@@ -0,0 +1,50 @@
+from flaskr import concurrency
+from flask import Flask, g, request
+import pytest
+import threading
+
+
+def test_gather_runs_calls_concurrently():
+    """Tests that the calls run at the same time and their results keep their order."""
+    barrier = threading.Barrier(3, timeout=5)
+
+    def call(result):
+        barrier.wait()
+        return result
+
+    assert concurrency.gather(lambda: call(1), lambda: call(2),
+                              lambda: call(3)) == [1, 2, 3]
+    assert concurrency.gather() == []
+    assert concurrency.gather(lambda: 1) == [1]
+
+
+def test_gather_copies_the_request_context():
+    """Tests that the calls see flask.g and the request of the caller."""
+    app = Flask(__name__)
+    with app.test_request_context("/pages?q=cpu"):
+        g.user = "user"
+        assert concurrency.gather(
+            lambda: g.user, lambda: request.args["q"],
+            lambda: threading.current_thread().name.startswith("fanout")) == [
+                "user", "cpu", True
+            ]
+
+
+def test_gather_raises_errors():
+    """Tests that an error of any call is raised to the caller."""
+
+    def fail():
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        concurrency.gather(lambda: 1, fail)
+
+
+def test_gather_nested():
+    """Tests that calls made from inside a call run on the same thread."""
+    results = concurrency.gather(
+        lambda: 0,
+        lambda: concurrency.gather(lambda: threading.current_thread().name,
+                                   lambda: threading.current_thread().name))
+
+    assert results[1][0] == results[1][1]
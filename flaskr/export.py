@@ -0,0 +1,133 @@
+"""Static snapshot export of the wiki.
+
+Renders every wiki page, /pages, /about and /FAQ as a logged out user into a directory a static file server can serve:
+
+    flask export-static snapshot/
+
+Wiki pages are written to pages/<title> and the other views to <route>.html next to the pages directory, so no page
+title can overwrite them. A static file server maps /pages to pages.html, like nginx's try_files $uri $uri.html. A
+manifest records the generation each wiki page was rendered from, so running the export again only renders the pages
+that changed since, and deletes the files of deleted pages.
+"""
+from concurrent import futures
+import hashlib
+import json
+import os
+import tempfile
+import urllib.parse
+
+# Name of the file recording what the snapshot was rendered from.
+MANIFEST = "manifest.json"
+# Routes rendered into <route>.html on every export.
+STATIC_ROUTES = ["/pages", "/about", "/FAQ"]
+
+
+def _load_manifest(output_dir):
+    """Returns the manifest of the snapshot in output_dir, or an empty one if there is none."""
+    try:
+        with open(os.path.join(output_dir, MANIFEST)) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {"page_names": None, "pages": {}}
+
+
+def _write(path, data):
+    """Writes a file atomically, so a static file server never serves a partial file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(descriptor, "wb") as temp_file:
+        temp_file.write(data)
+    os.replace(temp_path, path)
+
+
+def _page_path(output_dir, title):
+    """Returns the file of a wiki page in the snapshot, raising ValueError if the title would leave the snapshot."""
+    pages_dir = os.path.join(os.path.abspath(output_dir), "pages")
+    path = os.path.abspath(os.path.join(pages_dir, title))
+    if os.path.dirname(path) != pages_dir:
+        raise ValueError(f"Cannot export a page named {title}")
+    return path
+
+
+def _render(app, route):
+    """Renders a route as a logged out user.
+
+    Raises:
+        RuntimeError: if the route does not render successfully.
+    """
+    response = app.test_client().get(route)
+    if response.status_code != 200:
+        raise RuntimeError(f"{route} returned {response.status_code}")
+    return response.data
+
+
+def export_static(app, output_dir, workers=8):
+    """Renders the wiki into output_dir, re-rendering only the wiki pages whose blob generation changed.
+
+    When EMBED_PAGE_NAMES is on, every view lists the page names, so all the pages are rendered again whenever a page
+    is added or deleted.
+
+    Args:
+        app: the wiki app, whose Backend is in app.extensions["backend"].
+        output_dir: the directory of the snapshot, created if needed.
+        workers: the number of views rendered at the same time.
+
+    Returns:
+        A dictionary with the number of views rendered, of wiki pages skipped because they did not change, and of wiki
+        pages removed because they were deleted.
+    """
+    be = app.extensions["backend"]
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = _load_manifest(output_dir)
+    page_names = be.get_all_page_names()
+    names_hash = None
+    if app.config["EMBED_PAGE_NAMES"]:
+        names_hash = hashlib.sha256("\n".join(page_names).encode()).hexdigest()
+    previous = manifest["pages"] if manifest["page_names"] == names_hash else {}
+
+    def export_page(title):
+        version = be.get_page_version(title)
+        if version is None:
+            return title, None, False
+        path = _page_path(output_dir, title)
+        if previous.get(title) == version[0] and os.path.exists(path):
+            return title, version[0], False
+        _write(path, _render(app, f"/pages/{urllib.parse.quote(title)}"))
+        return title, version[0], True
+
+    def export_route(route):
+        _write(os.path.join(output_dir, f"{route.strip('/')}.html"),
+               _render(app, route))
+
+    pages = {}
+    rendered = len(STATIC_ROUTES)
+    skipped = 0
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        route_futures = [
+            executor.submit(export_route, route) for route in STATIC_ROUTES
+        ]
+        for title, generation, was_rendered in executor.map(
+                export_page, page_names):
+            if generation is None:
+                continue
+            pages[title] = generation
+            if was_rendered:
+                rendered += 1
+            else:
+                skipped += 1
+        for future in route_futures:
+            future.result()
+
+    removed = 0
+    for title in manifest["pages"].keys() - pages.keys():
+        try:
+            os.remove(_page_path(output_dir, title))
+            removed += 1
+        except (FileNotFoundError, ValueError):
+            pass
+    _write(os.path.join(output_dir, MANIFEST),
+           json.dumps({
+               "page_names": names_hash,
+               "pages": pages
+           }).encode())
+    return {"rendered": rendered, "skipped": skipped, "removed": removed}
@@ -0,0 +1,81 @@
+from flaskr import create_app, export
+import json
+import os
+import pytest
+
+
+@pytest.fixture
+def app():
+    app = create_app({
+        'TESTING': True,
+        'STORAGE_BACKEND': 'memory',
+        'EMBED_PAGE_NAMES': False
+    })
+    content = app.extensions["backend"].storage_client.bucket(
+        "awesomewikicontent")
+    content.blob("info.json").upload_from_string(
+        '{"user": {"profile_pic": "", "files_uploaded": ["cpu.html", "gpu.html"]}}'
+    )
+    content.blob("website_info.json").upload_from_string('{"FAQ": []}')
+    for name in ["camila", "sarah", "ricardo"]:
+        content.blob(name).upload_from_string(b"image")
+    content.blob("cpu.html").upload_from_string("<p>CPU</p>")
+    content.blob("gpu.html").upload_from_string("<p>GPU</p>")
+    return app
+
+
+def test_export_static(app, tmp_path):
+    """Tests that every view is exported and the manifest records the page generations."""
+    counts = export.export_static(app, str(tmp_path), workers=4)
+
+    assert counts == {"rendered": 5, "skipped": 0, "removed": 0}
+    assert b"<p>CPU</p>" in (tmp_path / "pages" / "cpu.html").read_bytes()
+    assert b"<p>GPU</p>" in (tmp_path / "pages" / "gpu.html").read_bytes()
+    assert b"gpu.html" in (tmp_path / "pages.html").read_bytes()
+    assert (tmp_path / "about.html").exists()
+    assert (tmp_path / "FAQ.html").exists()
+    manifest = json.loads((tmp_path / "manifest.json").read_text())
+    assert sorted(manifest["pages"]) == ["cpu.html", "gpu.html"]
+
+
+def test_export_static_is_incremental(app, tmp_path):
+    """Tests that only changed pages are rendered again and deleted pages are removed."""
+    export.export_static(app, str(tmp_path))
+    be = app.extensions["backend"]
+    content = be.storage_client.bucket("awesomewikicontent")
+    content.blob("cpu.html").upload_from_string("<p>New CPU</p>")
+    be.delete_uploaded_file("user", "gpu.html")
+
+    counts = export.export_static(app, str(tmp_path))
+
+    assert counts == {"rendered": 4, "skipped": 0, "removed": 1}
+    assert b"<p>New CPU</p>" in (tmp_path / "pages" / "cpu.html").read_bytes()
+    assert not (tmp_path / "pages" / "gpu.html").exists()
+    assert export.export_static(app, str(tmp_path)) == {
+        "rendered": 3,
+        "skipped": 1,
+        "removed": 0
+    }
+
+
+def test_export_static_command(app, tmp_path):
+    """Tests the flask export-static command."""
+    result = app.test_cli_runner().invoke(
+        args=["export-static", str(tmp_path), "--workers", "2"])
+
+    assert result.exit_code == 0
+    assert "Rendered 5 views, skipped 0 unchanged pages, removed 0 deleted pages." in result.output
+    assert os.path.exists(tmp_path / "pages" / "cpu.html")
+
+
+def test_export_static_page_titles(app, tmp_path):
+    """Tests that pages named like the listing or with URL characters are exported without clobbering other views."""
+    content = app.extensions["backend"].storage_client.bucket(
+        "awesomewikicontent")
+    content.blob("index.html").upload_from_string("<p>Index</p>")
+    content.blob("c#?.html").upload_from_string("<p>C sharp</p>")
+
+    assert export.export_static(app, str(tmp_path))["rendered"] == 7
+    assert b"<p>Index</p>" in (tmp_path / "pages" / "index.html").read_bytes()
+    assert b"<p>C sharp</p>" in (tmp_path / "pages" / "c#?.html").read_bytes()
+    assert b"cpu.html" in (tmp_path / "pages.html").read_bytes()
@@ -0,0 +1,272 @@
+from flask import g, has_request_context, request
+import bisect
+import contextlib
+import threading
+import time
+
+# Upper bounds in seconds of the storage call latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+                   2.5, 5, 10)
+
+
+def current_route():
+    """Returns the URL rule of the request being handled, or "background" outside of a request."""
+    if has_request_context():
+        if request.url_rule is not None:
+            return request.url_rule.rule
+        return "unmatched"
+    return "background"
+
+
+class StorageMetrics:
+    """Counts, times and measures the bytes of every storage call, tagged by operation and route.
+
+    Calls that raise are recorded too, so conflicts retried by the callers show up in the counts.
+
+    Attributes:
+        calls: a dictionary from (operation, route) to the number of calls, failed or not.
+        errors: a dictionary from (operation, route, error) to the number of calls that raised an exception named
+            error, like PreconditionFailed or NotFound.
+        seconds: a dictionary from (operation, route) to the total seconds spent in calls.
+        bytes: a dictionary from (operation, route) to the number of bytes downloaded or uploaded.
+        histograms: a dictionary from (operation, route) to the number of calls in each latency bucket.
+    """
+
+    def __init__(self):
+        """Initializes the metrics without any call recorded."""
+        self.calls = {}
+        self.errors = {}
+        self.seconds = {}
+        self.bytes = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation, seconds, nbytes=0, error=None):
+        """Records one storage call.
+
+        The call is also added to the totals of the current request, used for the Server-Timing header.
+
+        Args:
+            operation: the storage operation, like get_blob or download.
+            seconds: how long the call took.
+            nbytes: the number of bytes downloaded or uploaded.
+            error: the name of the exception the call raised, None if it succeeded.
+        """
+        key = (operation, current_route())
+        with self._lock:
+            if error is not None:
+                error_key = key + (error,)
+                self.errors[error_key] = self.errors.get(error_key, 0) + 1
+            if key not in self.calls:
+                self.calls[key] = 0
+                self.seconds[key] = 0
+                self.bytes[key] = 0
+                self.histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1)
+            self.calls[key] += 1
+            self.seconds[key] += seconds
+            self.bytes[key] += nbytes
+            self.histograms[key][bisect.bisect_left(LATENCY_BUCKETS,
+                                                    seconds)] += 1
+        if has_request_context():
+            calls, total = g.get("storage_timing", (0, 0))
+            g.storage_timing = (calls + 1, total + seconds)
+
+    @contextlib.contextmanager
+    def timing(self, operation):
+        """Times the storage call made in the with block and records it, also when it raises.
+
+        Args:
+            operation: the storage operation, like get_blob or download.
+
+        Yields:
+            A dictionary in which the block sets "bytes" to the number of bytes downloaded or uploaded.
+        """
+        call = {"bytes": 0}
+        error = None
+        started = time.perf_counter()
+        try:
+            yield call
+        except Exception as exception:
+            error = type(exception).__name__
+            raise
+        finally:
+            self.record(operation,
+                        time.perf_counter() - started, call["bytes"], error)
+
+    def instrument(self, bucket):
+        """Returns the bucket with every call to it and to its blobs recorded in these metrics."""
+        return InstrumentedBucket(bucket, self)
+
+    def render(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            keys = sorted(self.calls)
+            lines = [
+                "# HELP wiki_storage_calls_total Storage calls made by the wiki.",
+                "# TYPE wiki_storage_calls_total counter"
+            ]
+            for operation, route in keys:
+                lines.append(
+                    f'wiki_storage_calls_total{{operation="{operation}",route="{route}"}} {self.calls[(operation, route)]}'
+                )
+            lines += [
+                "# HELP wiki_storage_errors_total Storage calls that raised, by exception.",
+                "# TYPE wiki_storage_errors_total counter"
+            ]
+            for operation, route, error in sorted(self.errors):
+                lines.append(
+                    f'wiki_storage_errors_total{{operation="{operation}",route="{route}",error="{error}"}} {self.errors[(operation, route, error)]}'
+                )
+            lines += [
+                "# HELP wiki_storage_bytes_total Bytes downloaded from or uploaded to storage.",
+                "# TYPE wiki_storage_bytes_total counter"
+            ]
+            for operation, route in keys:
+                lines.append(
+                    f'wiki_storage_bytes_total{{operation="{operation}",route="{route}"}} {self.bytes[(operation, route)]}'
+                )
+            lines += [
+                "# HELP wiki_storage_call_seconds Latency of the storage calls.",
+                "# TYPE wiki_storage_call_seconds histogram"
+            ]
+            for operation, route in keys:
+                labels = f'operation="{operation}",route="{route}"'
+                cumulative = 0
+                histogram = self.histograms[(operation, route)]
+                for bound, count in zip(LATENCY_BUCKETS, histogram):
+                    cumulative += count
+                    lines.append(
+                        f'wiki_storage_call_seconds_bucket{{{labels},le="{bound}"}} {cumulative}'
+                    )
+                lines.append(
+                    f'wiki_storage_call_seconds_bucket{{{labels},le="+Inf"}} {self.calls[(operation, route)]}'
+                )
+                lines.append(
+                    f'wiki_storage_call_seconds_sum{{{labels}}} {self.seconds[(operation, route)]}'
+                )
+                lines.append(
+                    f'wiki_storage_call_seconds_count{{{labels}}} {self.calls[(operation, route)]}'
+                )
+        return "\n".join(lines) + "\n"
+
+
+def render_cache(name, lru_cache):
+    """Returns the counters and size of an LRUCache in the Prometheus text format, named after name."""
+    lines = []
+    for counter, help_text in [("hits", "Lookups that found the value."),
+                               ("misses", "Lookups that missed the value."),
+                               ("evictions", "Values evicted to make room.")]:
+        lines += [
+            f"# HELP {name}_{counter}_total {help_text}",
+            f"# TYPE {name}_{counter}_total counter",
+            f"{name}_{counter}_total {getattr(lru_cache, counter)}"
+        ]
+    lines += [
+        f"# HELP {name}_bytes Bytes held by the cache.",
+        f"# TYPE {name}_bytes gauge", f"{name}_bytes {lru_cache.size}"
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def server_timing():
+    """Returns the Server-Timing header value for the storage calls of the current request."""
+    calls, seconds = g.get("storage_timing", (0, 0))
+    return f'storage;dur={seconds * 1000:.2f};desc="{calls} calls"'
+
+
+class InstrumentedBucket:
+    """A bucket whose calls, and the calls to its blobs, are recorded in StorageMetrics.
+
+    Attributes that are not calls to storage are passed through to the wrapped bucket.
+    """
+
+    def __init__(self, bucket, metrics):
+        """Wraps the bucket."""
+        self._bucket = bucket
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self._bucket, name)
+
+    def blob(self, name):
+        return InstrumentedBlob(self._bucket.blob(name), self._metrics)
+
+    def get_blob(self, name):
+        with self._metrics.timing("get_blob"):
+            blob = self._bucket.get_blob(name)
+        if blob is None:
+            return None
+        return InstrumentedBlob(blob, self._metrics)
+
+    def list_blobs(self, *args, **kwargs):
+        with self._metrics.timing("list_blobs"):
+            blobs = [
+                InstrumentedBlob(blob, self._metrics)
+                for blob in self._bucket.list_blobs(*args, **kwargs)
+            ]
+        return blobs
+
+    def copy_blob(self, blob, destination_bucket, *args, **kwargs):
+        if isinstance(blob, InstrumentedBlob):
+            blob = blob._blob
+        if isinstance(destination_bucket, InstrumentedBucket):
+            destination_bucket = destination_bucket._bucket
+        with self._metrics.timing("copy"):
+            new_blob = self._bucket.copy_blob(blob, destination_bucket, *args,
+                                              **kwargs)
+        return InstrumentedBlob(new_blob, self._metrics)
+
+
+class InstrumentedBlob:
+    """A blob whose calls to storage are recorded in StorageMetrics.
+
+    Other attributes, like name, generation and metadata, are read from and written to the wrapped blob.
+    """
+
+    def __init__(self, blob, metrics):
+        """Wraps the blob."""
+        object.__setattr__(self, "_blob", blob)
+        object.__setattr__(self, "_metrics", metrics)
+
+    def __getattr__(self, name):
+        return getattr(self._blob, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._blob, name, value)
+
+    def _timed(self, operation, method, *args, **kwargs):
+        with self._metrics.timing(operation) as call:
+            result = method(*args, **kwargs)
+            if isinstance(result, bytes):
+                call["bytes"] = len(result)
+        return result
+
+    def exists(self, *args, **kwargs):
+        return self._timed("exists", self._blob.exists, *args, **kwargs)
+
+    def reload(self, *args, **kwargs):
+        return self._timed("reload", self._blob.reload, *args, **kwargs)
+
+    def download_as_bytes(self, *args, **kwargs):
+        return self._timed("download", self._blob.download_as_bytes, *args,
+                           **kwargs)
+
+    def download_as_string(self, *args, **kwargs):
+        return self._timed("download", self._blob.download_as_string, *args,
+                           **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._timed("delete", self._blob.delete, *args, **kwargs)
+
+    def upload_from_string(self, data, *args, **kwargs):
+        with self._metrics.timing("upload") as call:
+            self._blob.upload_from_string(data, *args, **kwargs)
+            if isinstance(data, str):
+                data = data.encode()
+            call["bytes"] = len(data)
+
+    def upload_from_file(self, file_obj, *args, **kwargs):
+        position = file_obj.tell()
+        with self._metrics.timing("upload") as call:
+            self._blob.upload_from_file(file_obj, *args, **kwargs)
+            call["bytes"] = file_obj.tell() - position
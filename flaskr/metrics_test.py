@@ -0,0 +1,90 @@
+from flaskr import metrics, storage
+from flask import Flask, g
+from google.api_core import exceptions
+from unittest.mock import MagicMock
+import io
+import pytest
+
+
+def test_render_prometheus_text():
+    """Tests that recorded calls are rendered as counters and a histogram."""
+    storage_metrics = metrics.StorageMetrics()
+    storage_metrics.record("download", 0.002, 100)
+    storage_metrics.record("download", 0.2, 50)
+
+    text = storage_metrics.render()
+    labels = 'operation="download",route="background"'
+    assert f"wiki_storage_calls_total{{{labels}}} 2\n" in text
+    assert f"wiki_storage_bytes_total{{{labels}}} 150\n" in text
+    assert f'wiki_storage_call_seconds_bucket{{{labels},le="0.001"}} 0\n' in text
+    assert f'wiki_storage_call_seconds_bucket{{{labels},le="0.0025"}} 1\n' in text
+    assert f'wiki_storage_call_seconds_bucket{{{labels},le="0.25"}} 2\n' in text
+    assert f'wiki_storage_call_seconds_bucket{{{labels},le="+Inf"}} 2\n' in text
+    assert f"wiki_storage_call_seconds_count{{{labels}}} 2\n" in text
+
+
+def test_instrumented_bucket_records_by_route():
+    """Tests that calls to an instrumented bucket are recorded with the route of the request."""
+    app = Flask(__name__)
+    app.add_url_rule("/pages/<title>", "page", lambda title: "")
+    storage_metrics = metrics.StorageMetrics()
+    bucket = storage_metrics.instrument(
+        storage.MemoryStorage().bucket("content"))
+    bucket.blob("page.html").upload_from_string("<p></p>")
+
+    with app.test_request_context("/pages/page.html"):
+        blob = bucket.get_blob("page.html")
+        assert blob.download_as_bytes() == b"<p></p>"
+        assert bucket.get_blob("missing.html") is None
+        assert g.storage_timing[0] == 3
+        assert metrics.server_timing().endswith('desc="3 calls"')
+
+    assert storage_metrics.calls == {
+        ("upload", "background"): 1,
+        ("get_blob", "/pages/<title>"): 2,
+        ("download", "/pages/<title>"): 1
+    }
+    assert storage_metrics.bytes[("upload", "background")] == 7
+    assert storage_metrics.bytes[("download", "/pages/<title>")] == 7
+
+
+def test_instrumented_blob_forwards_attributes():
+    """Tests that attributes set on an instrumented blob reach the wrapped blob."""
+    storage_metrics = metrics.StorageMetrics()
+    bucket = storage_metrics.instrument(
+        storage.MemoryStorage().bucket("content"))
+    blob = bucket.blob("users/a.json")
+    blob.metadata = {"files_uploaded": "1"}
+    blob.upload_from_file(io.BytesIO(b"{}"))
+    bucket.copy_blob(blob, bucket, new_name="users/b.json")
+
+    assert bucket.get_blob("users/b.json").metadata == {"files_uploaded": "1"}
+    assert [blob.name for blob in bucket.list_blobs(prefix="users/")
+           ] == ["users/a.json", "users/b.json"]
+    assert storage_metrics.calls[("copy", "background")] == 1
+    assert storage_metrics.bytes[("upload", "background")] == 2
+
+
+def test_failed_calls_are_recorded():
+    """Tests that calls raising an exception are counted, timed and labeled with the exception."""
+    storage_metrics = metrics.StorageMetrics()
+    bucket = storage_metrics.instrument(
+        storage.MemoryStorage().bucket("content"))
+    bucket.blob("info.json").upload_from_string("{}")
+
+    with pytest.raises(exceptions.PreconditionFailed):
+        bucket.blob("info.json").upload_from_string("{}", if_generation_match=0)
+    with pytest.raises(exceptions.NotFound):
+        bucket.blob("missing.html").download_as_bytes()
+
+    assert storage_metrics.calls == {
+        ("upload", "background"): 2,
+        ("download", "background"): 1
+    }
+    assert storage_metrics.errors == {
+        ("upload", "background", "PreconditionFailed"): 1,
+        ("download", "background", "NotFound"): 1
+    }
+    assert storage_metrics.bytes[("upload", "background")] == 2
+    assert 'wiki_storage_errors_total{operation="upload",route="background",error="PreconditionFailed"} 1\n' in storage_metrics.render(
+    )
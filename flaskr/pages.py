@@ -1,8 +1,18 @@
-from flask import render_template, request, redirect, flash, jsonify
-from flaskr import backend
+from flask import render_template, request, redirect, flash, jsonify, g, make_response, session, Response, stream_with_context
+from flaskr import backend, cache, concurrency, export, metrics, storage
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user, UserMixin
+from markupsafe import Markup
+import click
 import hashlib
 import string
+import time
+from werkzeug import exceptions, http
+
+# Number of suggestions returned by /api/suggest when the request does not ask for a number, and the most it returns.
+SUGGEST_LIMIT = 10
+MAX_SUGGEST_LIMIT = 50
+# Stands in for the content of a streamed wiki page when rendering pages.html, which is then split around it.
+STREAM_PLACEHOLDER = "<!-- streamed page content -->"
 
 
 def make_endpoints(app):
@@ -10,11 +20,62 @@ def make_endpoints(app):
     
     This function also initializes a 'backend.Backend()' object and a 'LoginManager()' object. 
     It associates the 'LoginManager()' object with the Flask 'app' object to manage user authentication.
+    The Backend is stored in app.extensions["backend"] so tools like the benchmarks can reach it.
     """
-    be = backend.Backend()
+    storage_metrics = None
+    if app.config["STORAGE_METRICS"]:
+        storage_metrics = metrics.StorageMetrics()
+    disk_cache = None
+    if app.config["DISK_CACHE_DIR"]:
+        disk_cache = cache.DiskCache(app.config["DISK_CACHE_DIR"],
+                                     app.config["DISK_CACHE_BYTES"])
+    be = backend.Backend(storage.from_config(app.config),
+                         sharded_users=app.config["SHARDED_USERS"],
+                         page_cache_bytes=app.config["PAGE_CACHE_BYTES"],
+                         disk_cache=disk_cache,
+                         metrics=storage_metrics,
+                         dedup_pages=app.config["DEDUP_PAGES"],
+                         compress_pages=app.config["COMPRESS_PAGES"])
+    app.extensions["backend"] = be
+    render_cache = None
+    if app.config["RENDER_CACHE_BYTES"]:
+        render_cache = cache.LRUCache(app.config["RENDER_CACHE_BYTES"])
     login_manager = LoginManager()
     login_manager.init_app(app)
 
+    @app.cli.command("migrate-users")
+    def migrate_users():
+        """Copies every user record from info.json into its own blob so SHARDED_USERS can be turned on."""
+        counts = be.migrate_user_records()
+        click.echo(
+            f"Migrated {counts['migrated']} user records, skipped {counts['skipped']} already migrated."
+        )
+
+    @app.cli.command("build-search-index")
+    def build_search_index():
+        """Indexes the text of every wiki page and saves it as the full-text index used by the search."""
+        count = be.build_search_index()
+        if count is None:
+            click.echo("Another process saved the index first.")
+        else:
+            click.echo(f"Indexed {count} pages.")
+
+    @app.cli.command("export-static")
+    @click.argument("output_dir")
+    @click.option("--workers",
+                  default=8,
+                  show_default=True,
+                  help="Number of views rendered at the same time.")
+    def export_static(output_dir, workers):
+        """Renders the wiki pages, /pages, /about and /FAQ into OUTPUT_DIR for a static file server.
+
+        Only the wiki pages that changed since the last export into OUTPUT_DIR are rendered again.
+        """
+        counts = export.export_static(app, output_dir, workers)
+        click.echo(
+            f"Rendered {counts['rendered']} views, skipped {counts['skipped']} unchanged pages, removed {counts['removed']} deleted pages."
+        )
+
     class User(UserMixin):
         """A user using the wiki.
         
@@ -104,6 +165,92 @@ def make_endpoints(app):
         hashed = hashlib.blake2b(with_salt.encode()).hexdigest()
         return hashed
 
+    @app.before_request
+    def start_timer():
+        """Records when handling the request started, for the Server-Timing header."""
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def add_server_timing(response):
+        """Adds a Server-Timing header with the time spent handling the request and in storage calls, if enabled in the config.
+
+        Returns:
+            The response with the header added.
+        """
+        if app.config["SERVER_TIMING"] and "request_started" in g:
+            elapsed = time.perf_counter() - g.request_started
+            response.headers["Server-Timing"] = (
+                f"app;dur={elapsed * 1000:.2f}, {metrics.server_timing()}")
+        return response
+
+    @app.errorhandler(exceptions.RequestEntityTooLarge)
+    def request_too_large(error):
+        """Sends the user back to the form of an upload larger than MAX_CONTENT_LENGTH, with an error message.
+
+        Returns:
+            A redirect to the page the upload was sent to.
+        """
+        flash(
+            f"Files must be at most {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} MB.",
+            category="error")
+        return redirect(request.path)
+
+    def datalist_page_names():
+        """Returns the page names main.html embeds in its datalist, none when EMBED_PAGE_NAMES is off.
+
+        The search bar gets its suggestions from /api/suggest, so the datalist only makes every page grow with the
+        number of pages in the wiki.
+        """
+        if app.config["EMBED_PAGE_NAMES"]:
+            return be.get_all_page_names()
+        return []
+
+    def cached_render(key, generation, render):
+        """Returns a logged out view from the render cache, rendering it and caching the bytes if needed.
+
+        Logged in views show the user in the navigation bar, and views rendered while flash messages are waiting would
+        show them, so both are always rendered.
+
+        Args:
+            key: what is rendered, like the route and its arguments.
+            generation: changes whenever anything shown in the view changes.
+            render: a function rendering the view.
+
+        Returns:
+            The rendered view, as a string or bytes.
+        """
+        if (render_cache is None or current_user.is_authenticated or
+                session.get("_flashes")):
+            return render()
+        body = render_cache.get(key, generation)
+        if body is None:
+            body = render().encode()
+            render_cache.put(key, generation, body, len(body))
+        return body
+
+    @app.context_processor
+    def inject_embed_page_names():
+        """Lets main.html leave out the datalists when EMBED_PAGE_NAMES is off."""
+        return {"embed_page_names": app.config["EMBED_PAGE_NAMES"]}
+
+    @app.route("/metrics")
+    def storage_metrics_page():
+        """Exposes the storage call metrics in the Prometheus text format.
+
+        Returns:
+            The metrics, or a 404 response if they are disabled in the config.
+        """
+        if storage_metrics is None:
+            return Response("Storage metrics are disabled.", status=404)
+        text = storage_metrics.render()
+        if be.page_cache is not None:
+            text += metrics.render_cache("wiki_page_cache", be.page_cache)
+        if be.disk_cache is not None:
+            text += metrics.render_cache("wiki_disk_cache", be.disk_cache)
+        if render_cache is not None:
+            text += metrics.render_cache("wiki_render_cache", render_cache)
+        return Response(text, mimetype="text/plain; version=0.0.4")
+
     @app.route("/", methods=['GET', 'POST'])
     def home():
         """This Flask route function renders the homepage of the website by displaying the 'main.html' template.
@@ -111,9 +258,11 @@ def make_endpoints(app):
         Returns:
             A rendered HTML template 'main.html' which is the homepage of the website.
         """
+        page_names, contributors = concurrency.gather(datalist_page_names,
+                                                      be.get_contributors)
         return render_template("main.html",
-                               pages=be.get_all_page_names(),
-                               contributors=be.get_contributors())
+                               pages=page_names,
+                               contributors=contributors)
 
     @app.route("/signup", methods=['GET', 'POST'])
     def signup():
@@ -137,7 +286,7 @@ def make_endpoints(app):
                     user = User(username)
                     login_user(user)
                     return render_template("main.html",
-                                           pages=be.get_all_page_names(),
+                                           pages=datalist_page_names(),
                                            contributors=be.get_contributors())
                 else:
                     flash(
@@ -147,7 +296,7 @@ def make_endpoints(app):
                 flash(
                     "Your new password does not meet the requirements. Please make sure that it is 8 or more characters long and has at least 1 letter, 1 number, and 1 special symbol.",
                     category="error")
-        return render_template('signup.html', pages=be.get_all_page_names())
+        return render_template('signup.html', pages=datalist_page_names())
 
     @app.route("/login", methods=['GET', 'POST'])
     def login():
@@ -175,7 +324,7 @@ def make_endpoints(app):
             else:
                 flash("Invalid username or password. Please try again.",
                       category="error")
-        return render_template('login.html', pages=be.get_all_page_names())
+        return render_template('login.html', pages=datalist_page_names())
 
     @app.route("/logout")
     def logout():
@@ -185,7 +334,7 @@ def make_endpoints(app):
             The 'logout.html' template
         """
         logout_user()
-        return render_template('logout.html', pages=be.get_all_page_names())
+        return render_template('logout.html', pages=datalist_page_names())
 
     @login_required
     @app.route("/upload", methods=['GET', 'POST'])
@@ -211,7 +360,7 @@ def make_endpoints(app):
                     flash("File name is taken.", category="error")
             else:
                 flash("No file selected.", category="error")
-        return render_template('upload.html', pages=be.get_all_page_names())
+        return render_template('upload.html', pages=datalist_page_names())
 
     @app.route("/pages")
     def pages():
@@ -219,11 +368,47 @@ def make_endpoints(app):
         It displays the wiki pages by calling the 'be.get_all_page_name()' function. Then it passes the list of pages names
         to the HTML template 'pages.html' with 'render_template()'.
 
+        Logged out views are served from the render cache until the page names change.
+
         Returns:
             The rendered HTML template 'pages.html' that displays a list of all available wiki pages.
 
         """
-        return render_template("pages.html", wiki_pages=be.get_all_page_names())
+        # Read the version first, so names refreshed in between are never cached under an older version.
+        names_version = be.page_names_version()
+        page_names = be.get_all_page_names()
+        return cached_render(
+            "pages", names_version,
+            lambda: render_template("pages.html", wiki_pages=page_names))
+
+    def stream_page(page_title, generation):
+        """Returns a streaming response of a version of a wiki page, holding one chunk of it in memory at a time.
+
+        Compressed pages are decompressed chunk by chunk. Their stored bytes cannot be passed through, since the page
+        is only part of the body, and many browsers stop decoding a gzip body after its first member.
+        """
+        names_version = None
+        if app.config["EMBED_PAGE_NAMES"]:
+            names_version = be.page_names_version()
+        shell = cached_render(
+            "page-shell", names_version,
+            lambda: render_template("pages.html",
+                                    page_content=Markup(STREAM_PLACEHOLDER),
+                                    pages=datalist_page_names()))
+        if isinstance(shell, str):
+            shell = shell.encode()
+        prefix, _, suffix = shell.partition(STREAM_PLACEHOLDER.encode())
+        _, size, chunks = be.stream_wiki_page(page_title, generation)
+
+        def generate():
+            yield prefix
+            yield from chunks
+            yield suffix
+
+        response = Response(stream_with_context(generate()),
+                            mimetype="text/html")
+        response.content_length = len(prefix) + size + len(suffix)
+        return response
 
     @app.route("/pages/<page_title>")
     def page_uploads(page_title):
@@ -232,15 +417,58 @@ def make_endpoints(app):
         It retrieves the content of a wiki page with the title that is specified in the URL using be.get_wiki_page(). It then passes the retrived content 
         to the HTML template 'pages.html' via 'render_template()'.
 
+        The ETag is made from the version of the page and the logged in user, since the navigation bar shows the user. If the
+        client already has this version, only the page metadata is retrieved and a 304 response is returned. Otherwise logged
+        out views are served from the render cache while the page, and the embedded page names, are unchanged.
+
+        Pages of STREAM_PAGE_BYTES or more are streamed instead: pages.html is rendered around a placeholder, and the
+        HTML before it, the page content read in chunks, and the HTML after it are sent one after the other.
+
         Returns:
-            The rendered HTML template 'pages.html' with the content of a wiki page        
+            The rendered HTML template 'pages.html' with the content of a wiki page, or an empty 304 response if the client's copy is up to date.
 
         """
-
-        content = be.get_wiki_page(page_title)
-        return render_template("pages.html",
-                               page_content=content,
-                               pages=be.get_all_page_names())
+        version = be.get_page_version(page_title)
+        if version is None:
+            # Let get_wiki_page report the missing page as before.
+            version = (None, None, None, None)
+        generation, md5_hash, updated, size = version
+        viewer = current_user.username if current_user.is_authenticated else ""
+        etag = hashlib.blake2b(f"{generation}:{md5_hash}:{viewer}".encode(),
+                               digest_size=16).hexdigest()
+        if generation is not None and not http.is_resource_modified(
+                request.environ, etag=etag, last_modified=updated):
+            response = Response(status=304)
+        elif generation is None:
+            content = be.get_wiki_page(page_title)
+            response = make_response(
+                render_template("pages.html",
+                                page_content=content,
+                                pages=datalist_page_names()))
+        elif (app.config["STREAM_PAGE_BYTES"] is not None and
+              size >= app.config["STREAM_PAGE_BYTES"]):
+            response = stream_page(page_title, generation)
+        else:
+            names_version = None
+            if app.config["EMBED_PAGE_NAMES"]:
+                names_version = be.page_names_version()
+            response = make_response(
+                cached_render(
+                    ("pages", page_title), (generation, names_version), lambda:
+                    render_template("pages.html",
+                                    page_content=be.get_wiki_page(page_title),
+                                    pages=datalist_page_names())))
+        if generation is not None:
+            response.set_etag(etag)
+            response.last_modified = updated
+        if viewer:
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+        else:
+            response.cache_control.public = True
+            response.cache_control.max_age = app.config["PAGE_CACHE_MAX_AGE"]
+        response.vary.add("Cookie")
+        return response
 
     @app.route("/about")
     def about():
@@ -252,11 +480,13 @@ def make_endpoints(app):
 
         """
         image_names = ["camila", "sarah", "ricardo"]
-        image_data = [be.get_image(image_name) for image_name in image_names]
+        *image_data, page_names = concurrency.gather(
+            *[lambda name=name: be.get_image(name) for name in image_names],
+            datalist_page_names)
         return render_template('about.html',
                                image_datas=image_data,
                                base_url="https://storage.cloud.google.com/",
-                               pages=be.get_all_page_names())
+                               pages=page_names)
 
     @login_required
     @app.route("/profile", methods=['GET', 'POST'])
@@ -267,14 +497,16 @@ def make_endpoints(app):
             The rendered HTML template 'profile.html'.
 
         """
-        files = be.get_user_files(current_user.username)
+        files, page_names = concurrency.gather(
+            lambda: be.get_user_files(current_user.username),
+            datalist_page_names)
         num_files = len(files)
 
         return render_template(
             'profile.html',
             file_num=num_files,
             files=files,
-            pages=be.get_all_page_names(),
+            pages=page_names,
             default=
             "https://storage.cloud.google.com/awesomewikicontent/default-profile-pic.gif"
         )
@@ -423,10 +655,11 @@ def make_endpoints(app):
         Returns:
             The result of calling the render_template() function, which renders the FAQ page template with the list of questions and all available page names.
         '''
-        questions = be.get_faq()
+        questions, page_names = concurrency.gather(be.get_faq,
+                                                   datalist_page_names)
         return render_template("faq.html",
                                questions=questions,
-                               pages=be.get_all_page_names())
+                               pages=page_names)
 
     @app.route("/submit_question", methods=['GET', 'POST'])
     def submit_question():
@@ -469,19 +702,33 @@ def make_endpoints(app):
     def search_results():
         """Displays all matching search results on search page.
 
-        Obtains list of matching results from search and displays the page links. If there are no matching results, passes empty list to HTML file.
+        Looks up the pages whose name contains the search input, followed by the pages whose text best matches it, and displays the page links. If there are no matching results, passes empty list to HTML file.
 
         Returns:
             The rendered HTML template 'search.html'.     
         """
 
         search_input = request.form['SearchInput']
-        matching_results = request.form['MatchingResults']
-        suggested_pages = matching_results.split(',')
-        if suggested_pages[0] == "":
-            suggested_pages = []
+        suggested_pages = be.search_page_names(search_input)
+        for page in be.search_pages(search_input):
+            if page not in suggested_pages:
+                suggested_pages.append(page)
 
         return render_template('search.html',
                                suggestions=suggested_pages,
                                search_value=search_input,
-                               pages=be.get_all_page_names())
+                               pages=datalist_page_names())
+
+    @app.route('/api/suggest')
+    def suggest():
+        """Suggests page names for the text typed in the search bar.
+
+        The text is given in the 'q' query parameter and the number of suggestions in 'limit'.
+
+        Returns:
+            A JSON list of page names, the best suggestion first.
+        """
+        term = request.args.get('q', '')
+        limit = request.args.get('limit', SUGGEST_LIMIT, type=int)
+        limit = max(1, min(limit, MAX_SUGGEST_LIMIT))
+        return jsonify(be.suggest_page_names(term, limit))
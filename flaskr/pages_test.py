@@ -1,11 +1,13 @@
-from flaskr import create_app, backend
-from flask import url_for, Flask
+from flaskr import create_app, backend, pages, storage
+from flask import url_for, Flask, render_template
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user, UserMixin
 from unittest.mock import patch, MagicMock, Mock
 import base64
+import datetime
 import io
 import pytest
 import unittest
+import zlib
 
 test_username = "test_user"
 test_password = "test_password1#"
@@ -259,6 +261,28 @@ def test_successful_upload(client):
                 assert b"File uploaded successfully." in resp.data
 
 
+def test_upload_too_large(app, client):
+    """Tests that an upload larger than MAX_CONTENT_LENGTH is rejected before reaching the Backend."""
+    app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024
+    with patch.object(backend.Backend,
+                      'get_all_page_names', return_value=[]), patch.object(
+                          backend.Backend, 'upload') as mock_upload, patch(
+                              'flask_login.utils._get_user') as mock_get_user:
+        mock_get_user.return_value = MockUser(test_username)
+        resp = client.post(
+            '/upload',
+            data={
+                'File name': 'big',
+                'File': (io.BytesIO(b'x' * 1024 * 1024), 'big.html')
+            },
+            content_type='multipart/form-data',
+            follow_redirects=True)
+
+        assert resp.status_code == 200
+        assert b"Files must be at most 1 MB." in resp.data
+        assert not mock_upload.called
+
+
 def test_unsuccessful_upload(client):
     """Tests the unsuccessful upload path by creating a mock Backend object and mock File, and asserting that correct error flash message is displayed.
 
@@ -407,7 +431,10 @@ def test_page_uploads(client):
         mock_page_names = ['Page1', 'Page2', 'Page3']
         mock_get_all_page_names.return_value = mock_page_names
         with patch.object(backend.Backend,
-                          'get_wiki_page') as mock_get_wiki_page:
+                          'get_wiki_page') as mock_get_wiki_page, patch.object(
+                              backend.Backend,
+                              'get_page_version',
+                              return_value=None):
             mock_content = 'Test wiki page content'
             mock_get_wiki_page.return_value = mock_content
 
@@ -531,7 +558,10 @@ def test_uploaded_page_has_search_bar(client):
         mock_page_names = ['Page1', 'Page2', 'Page3']
         mock_get_all_page_names.return_value = mock_page_names
         with patch.object(backend.Backend,
-                          'get_wiki_page') as mock_get_wiki_page:
+                          'get_wiki_page') as mock_get_wiki_page, patch.object(
+                              backend.Backend,
+                              'get_page_version',
+                              return_value=None):
             mock_get_wiki_page = None
             response = client.get('/pages/cpu.html')
             assert b'Search' in response.data
@@ -846,7 +876,7 @@ def test_autocomplete(client):
                                follow_redirects=True)
 
             assert resp.status_code == 200
-            assert b"<datalist id=\"list-pcparts\">" in resp.data
+            assert b"<datalist" not in resp.data
             assert b'<div id="autocompleteDropdown">' in resp.data
 
 
@@ -858,19 +888,23 @@ def test_search_page(client):
     """
     with patch.object(backend.Backend,
                       'get_all_page_names') as mock_get_all_page_names:
-        mock_page_names = ['Page1', 'Page2', 'Page3']
+        mock_page_names = [
+            'pc-basics.html', 'peripherals.html', 'psu.html', 'ram.html'
+        ]
         mock_get_all_page_names.return_value = mock_page_names
-        resp = client.post(
-            '/search-results',
-            data=dict(
-                SearchInput='p',
-                MatchingResults='"psu.html,peripherals.html,pc-basics.html"'),
-            follow_redirects=True)
+        with patch.object(backend.Backend, 'search_pages') as mock_search_pages:
+            mock_search_pages.return_value = ['psu.html', 'gpu.html']
+            resp = client.post('/search-results',
+                               data=dict(SearchInput='P'),
+                               follow_redirects=True)
+        mock_search_pages.assert_called_once_with('P')
         assert resp.status_code == 200
         assert b"<div id='search-results' style='margin-left: 20px; margin-right: 20px'>" in resp.data
-        assert b"psu.html" in resp.data
-        assert b"peripherals.html" in resp.data
-        assert b"pc-basics.html" in resp.data
+        assert resp.data.count(b'<a href="/psu.html">') == 1
+        assert b'<a href="/peripherals.html">' in resp.data
+        assert b'<a href="/pc-basics.html">' in resp.data
+        assert b'<a href="/gpu.html">' in resp.data
+        assert b'<a href="/ram.html">' not in resp.data
 
 
 def test_successful_upload_profile_picture(client):
@@ -1141,3 +1175,253 @@ def test_faq_page_logged_out(client):
             assert b"<div id='reply-form'>" not in resp.data
             assert b"<div id='question-form'>" not in resp.data
             assert b"test question?" in resp.data
+
+
+def test_local_storage_backend(tmp_path):
+    """Tests that the app can run on the local storage backend selected in its config.
+
+    Args:
+        tmp_path: Temporary directory for the local buckets.
+    """
+    app = create_app({
+        'TESTING': True,
+        'STORAGE_BACKEND': 'local',
+        'LOCAL_STORAGE_ROOT': str(tmp_path),
+    })
+    content = storage.LocalStorage(str(tmp_path)).bucket("awesomewikicontent")
+    content.blob("info.json").upload_from_string("{}")
+    content.blob("page.html").upload_from_string("<div>local page</div>")
+
+    resp = app.test_client().get("/pages/page.html")
+    assert resp.status_code == 200
+    assert b"<div>local page</div>" in resp.data
+
+
+def test_metrics_and_server_timing():
+    """Tests that storage calls are exposed at /metrics and in the Server-Timing header."""
+    app = create_app({
+        'TESTING': True,
+        'STORAGE_BACKEND': 'memory',
+        'SERVER_TIMING': True,
+    })
+    content = app.extensions["backend"].storage_client.bucket(
+        "awesomewikicontent")
+    content.blob("page.html").upload_from_string("<div>page</div>")
+    client = app.test_client()
+
+    resp = client.get("/pages/page.html")
+    assert resp.status_code == 200
+    assert 'storage;dur=' in resp.headers["Server-Timing"]
+    assert resp.headers["Server-Timing"].startswith("app;dur=")
+
+    resp = client.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/plain"
+    assert b'wiki_storage_calls_total{operation="download",route="/pages/<page_title>"} 1' in resp.data
+    assert b'wiki_page_cache_misses_total 1\n' in resp.data
+
+
+def test_suggest(client):
+    """Tests that the suggest endpoint returns the suggested page names as JSON.
+
+    Args:
+        client: A Flask test client instance.
+    """
+    with patch.object(backend.Backend,
+                      'suggest_page_names') as mock_suggest_page_names:
+        mock_suggest_page_names.return_value = ['cpu.html', 'cpu-coolers.html']
+        resp = client.get('/api/suggest?q=cpu&limit=2')
+        assert resp.status_code == 200
+        assert resp.get_json() == ['cpu.html', 'cpu-coolers.html']
+        mock_suggest_page_names.assert_called_once_with('cpu', 2)
+
+        client.get('/api/suggest?limit=1000')
+        mock_suggest_page_names.assert_called_with('', 50)
+
+
+def test_page_names_not_embedded():
+    """Tests that the datalist is left out and the page names are not retrieved when EMBED_PAGE_NAMES is off."""
+    app = create_app({'TESTING': True, 'EMBED_PAGE_NAMES': False})
+    with patch.object(backend.Backend,
+                      'get_all_page_names') as mock_get_all_page_names:
+        with patch.object(backend.Backend, 'get_image') as mock_get_image:
+            mock_get_image.return_value = "image"
+            resp = app.test_client().get('/about')
+        assert resp.status_code == 200
+        assert b'<datalist' not in resp.data
+        assert b'/api/suggest' in resp.data
+        mock_get_all_page_names.assert_not_called()
+
+
+def test_page_names_embedded():
+    """Tests that the page names are embedded in a datalist when EMBED_PAGE_NAMES is on."""
+    app = create_app({'TESTING': True, 'EMBED_PAGE_NAMES': True})
+    with patch.object(backend.Backend,
+                      'get_all_page_names') as mock_get_all_page_names:
+        mock_get_all_page_names.return_value = ['cpu.html']
+        with patch.object(backend.Backend, 'get_image') as mock_get_image:
+            mock_get_image.return_value = "image"
+            resp = app.test_client().get('/about')
+        assert resp.status_code == 200
+        assert b'<datalist id="list-pcparts">' in resp.data
+        assert b'cpu.html' in resp.data
+
+
+def test_page_uploads_conditional_get(client):
+    """Tests that a client with the current version of a page gets a 304 response without the page being downloaded.
+
+    Args:
+        client: A Flask test client instance.
+    """
+    updated = datetime.datetime(2023, 5, 1, tzinfo=datetime.timezone.utc)
+    with patch.object(
+            backend.Backend,
+            'get_all_page_names') as mock_get_all_page_names, patch.object(
+                backend.Backend,
+                'get_page_version') as mock_get_page_version, patch.object(
+                    backend.Backend, 'get_wiki_page') as mock_get_wiki_page:
+        mock_get_all_page_names.return_value = ['cpu.html']
+        mock_get_page_version.return_value = (1, "md5", updated, 11)
+        mock_get_wiki_page.return_value = 'CPU content'
+
+        resp = client.get('/pages/cpu.html')
+        assert resp.status_code == 200
+        assert resp.headers['Cache-Control'] == 'public, max-age=0'
+        assert resp.headers['Last-Modified'] == 'Mon, 01 May 2023 00:00:00 GMT'
+        etag = resp.headers['ETag']
+
+        resp = client.get('/pages/cpu.html', headers={'If-None-Match': etag})
+        assert resp.status_code == 304
+        assert resp.data == b''
+        assert resp.headers['ETag'] == etag
+        resp = client.get(
+            '/pages/cpu.html',
+            headers={'If-Modified-Since': 'Mon, 01 May 2023 00:00:00 GMT'})
+        assert resp.status_code == 304
+        assert mock_get_wiki_page.call_count == 1
+
+        mock_get_page_version.return_value = (2, "md5", updated, 11)
+        resp = client.get('/pages/cpu.html', headers={'If-None-Match': etag})
+        assert resp.status_code == 200
+        assert resp.headers['ETag'] != etag
+
+        mock_get_page_version.return_value = (1, "md5", updated, 11)
+        with patch('flask_login.utils._get_user') as mock_get_user:
+            mock_get_user.return_value = MockUser(test_username)
+            resp = client.get('/pages/cpu.html',
+                              headers={'If-None-Match': etag})
+        assert resp.status_code == 200
+        assert resp.headers['ETag'] != etag
+        assert resp.headers['Cache-Control'] == 'private, no-cache'
+
+
+def test_render_cache():
+    """Tests that logged out views are served from the render cache until the page changes, and logged in views are not."""
+    app = create_app({'TESTING': True, 'STORAGE_BACKEND': 'memory'})
+    be = app.extensions["backend"]
+    content = be.storage_client.bucket("awesomewikicontent")
+    content.blob("info.json").upload_from_string(
+        '{"test_user": {"profile_pic": "", "files_uploaded": ["cpu.html"]}}')
+    content.blob("cpu.html").upload_from_string("<p>CPU</p>")
+    be.get_all_page_names()
+    client = app.test_client()
+
+    with patch('flaskr.pages.render_template',
+               wraps=render_template) as mock_render:
+        assert b"<p>CPU</p>" in client.get('/pages/cpu.html').data
+        assert b"<p>CPU</p>" in client.get('/pages/cpu.html').data
+        assert b"cpu.html" in client.get('/pages').data
+        assert b"cpu.html" in client.get('/pages').data
+        assert mock_render.call_count == 2
+
+        content.blob("cpu.html").upload_from_string("<p>New CPU</p>")
+        assert b"<p>New CPU</p>" in client.get('/pages/cpu.html').data
+        assert mock_render.call_count == 3
+
+        be.delete_uploaded_file(test_username, "cpu.html")
+        assert b"cpu.html" not in client.get('/pages').data
+        assert mock_render.call_count == 4
+
+        with patch('flask_login.utils._get_user') as mock_get_user:
+            mock_get_user.return_value = MockUser(test_username)
+            client.get('/pages')
+            client.get('/pages')
+        assert mock_render.call_count == 6
+
+
+def test_large_pages_are_streamed():
+    """Tests that pages of STREAM_PAGE_BYTES or more are streamed in chunks and render like the other pages."""
+    app = create_app({
+        'TESTING': True,
+        'STORAGE_BACKEND': 'memory',
+        'STREAM_PAGE_BYTES': 1000
+    })
+    be = app.extensions["backend"]
+    content = be.storage_client.bucket("awesomewikicontent")
+    page = "<p>" + "x" * 1000 + "</p>"
+    content.blob("big.html").upload_from_string(page)
+    content.blob("small.html").upload_from_string("<p>small</p>")
+    be.get_all_page_names()
+    client = app.test_client()
+
+    with patch.object(backend.Backend, 'get_wiki_page') as mock_get_wiki_page:
+        resp = client.get('/pages/big.html', buffered=False)
+        chunks = list(resp.response)
+        resp.close()
+    body = b"".join(chunks).decode()
+    assert resp.status_code == 200
+    assert chunks[1] == page.encode()
+    assert resp.content_length == len(body)
+    assert pages.STREAM_PLACEHOLDER not in body
+    assert not mock_get_wiki_page.called
+
+    small = client.get('/pages/small.html').get_data(as_text=True)
+    assert body.replace(page, "<p>small</p>") == small
+
+
+def _browser_body(response):
+    """Returns the body of a response as a browser reading a single gzip member decodes it."""
+    if response.content_encoding != 'gzip':
+        return response.data
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    body = inflater.decompress(response.data)
+    assert inflater.eof and not inflater.unused_data
+    return body
+
+
+def test_compressed_pages_are_streamed_decompressed():
+    """Tests that large compressed pages are streamed whole to browsers accepting gzip, which read one gzip member."""
+    app = create_app({
+        'TESTING': True,
+        'STORAGE_BACKEND': 'memory',
+        'STREAM_PAGE_BYTES': 1000
+    })
+    be = app.extensions["backend"]
+    be.storage_client.bucket("awesomewikicontent").blob(
+        "info.json").upload_from_string(
+            '{"user": {"profile_pic": "", "files_uploaded": []}}')
+    page = b"<p>" + b"CPU " * 1000 + b"</p>"
+    file = io.BytesIO(page)
+    file.filename = "big.html"
+    with patch.object(backend.Backend, '_update_search_index'):
+        assert be.upload("user", "big", file)
+    client = app.test_client()
+
+    # Streamed bodies are read before the next request, which needs the app context back.
+    plain = client.get('/pages/big.html')
+    plain.get_data()
+    accepting = client.get('/pages/big.html',
+                           headers={'Accept-Encoding': 'gzip'})
+    accepting.get_data()
+
+    assert page in plain.data
+    assert b"</html>" in _browser_body(accepting)
+    assert _browser_body(accepting) == plain.data
+    assert accepting.content_length == len(accepting.data)
+    assert accepting.headers['ETag'] == plain.headers['ETag']
+    resp = client.get('/pages/big.html',
+                      headers={
+                          'Accept-Encoding': 'gzip',
+                          'If-None-Match': accepting.headers['ETag']
+                      })
+    assert resp.status_code == 304
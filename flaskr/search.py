@@ -0,0 +1,444 @@
+from html import parser
+import bisect
+import codecs
+import heapq
+import json
+import math
+import re
+import threading
+import zlib
+
+# Length of the substrings of the page names kept in the NameIndex. Shorter search terms scan every name.
+NGRAM_LENGTH = 3
+# Fraction of the trigrams of a search term a page name must share with it to be suggested when nothing matches.
+FUZZY_THRESHOLD = 0.5
+
+# BM25 parameters: how quickly repeating a term stops raising the score, and how much long pages are penalized.
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Version of the segment files written by ContentIndex.dumps.
+SEGMENT_VERSION = 1
+# Tags whose content is not text shown on the page.
+IGNORED_TAGS = {"script", "style", "template"}
+
+_TOKEN = re.compile(r"\w+")
+
+
+def _ngrams(text):
+    """Returns the set of substrings of the text with NGRAM_LENGTH characters."""
+    return {
+        text[i:i + NGRAM_LENGTH] for i in range(len(text) - NGRAM_LENGTH + 1)
+    }
+
+
+class NameIndex:
+    """Finds the page names containing a search term without scanning every name.
+
+    Every substring of three characters (trigram) of the lowercased names is mapped to the names containing it. A
+    search intersects the names of the search term's trigrams, starting with the rarest, and only compares the term
+    with the few names left. Terms shorter than a trigram match so many names that they are compared with all of them.
+
+    The lowercased names are also kept sorted, so the names starting with a prefix are found with a binary search.
+
+    Attributes:
+        source: the list of page names the index was last updated from.
+    """
+
+    def __init__(self, page_names=()):
+        """Indexes the page names."""
+        self.source = None
+        self._names = {}
+        self._postings = {}
+        self._sorted = []
+        self._lock = threading.Lock()
+        self.update(page_names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def update(self, page_names):
+        """Makes the index hold exactly the given page names, indexing only those added since the last update.
+
+        Args:
+            page_names: the list of all the page names.
+        """
+        names = set(page_names)
+        with self._lock:
+            for name in self._names.keys() - names:
+                self._remove(name)
+            added = names - self._names.keys()
+            for name in added:
+                self._add(name)
+            if added:
+                # The sorted names followed by a few new ones are sorted in about linear time.
+                self._sorted += [(self._names[name], name) for name in added]
+                self._sorted.sort()
+            self.source = page_names
+
+    def _add(self, name):
+        lowered = name.lower()
+        self._names[name] = lowered
+        for ngram in _ngrams(lowered):
+            self._postings.setdefault(ngram, set()).add(name)
+
+    def _remove(self, name):
+        lowered = self._names.pop(name)
+        del self._sorted[bisect.bisect_left(self._sorted, (lowered, name))]
+        for ngram in _ngrams(lowered):
+            names = self._postings[ngram]
+            names.discard(name)
+            if not names:
+                del self._postings[ngram]
+
+    def search(self, term, limit=None):
+        """Finds the page names containing the term, ignoring case.
+
+        Args:
+            term: the text to look for. An empty term matches every page.
+            limit: the maximum number of names to return, None for all of them.
+
+        Returns:
+            A sorted list of the matching page names.
+        """
+        term = term.lower()
+        with self._lock:
+            if len(term) < NGRAM_LENGTH:
+                matches = [
+                    name for name, lowered in self._names.items()
+                    if term in lowered
+                ]
+            else:
+                postings = sorted(
+                    (self._postings.get(ngram, ()) for ngram in _ngrams(term)),
+                    key=len)
+                candidates = set(postings[0])
+                for names in postings[1:]:
+                    if not candidates:
+                        break
+                    candidates &= names
+                if len(term) > NGRAM_LENGTH:
+                    matches = [
+                        name for name in candidates if term in self._names[name]
+                    ]
+                else:
+                    matches = list(candidates)
+        if limit is not None:
+            return heapq.nsmallest(limit, matches)
+        matches.sort()
+        return matches
+
+    def suggest(self, term, limit=10):
+        """Suggests page names for a partially typed search term.
+
+        The names starting with the term come first, then the names containing it. If no name contains the term, the
+        names sharing the most trigrams with it are suggested instead, so typos still find pages.
+
+        Args:
+            term: the text typed so far.
+            limit: the maximum number of names to return.
+
+        Returns:
+            A list of page names, the best suggestion first.
+        """
+        term = term.lower()
+        if not term:
+            return []
+        with self._lock:
+            start = bisect.bisect_left(self._sorted, (term,))
+            suggestions = []
+            for lowered, name in self._sorted[start:start + limit]:
+                if not lowered.startswith(term):
+                    break
+                suggestions.append(name)
+        if len(suggestions) < limit:
+            for name in self.search(term, limit + len(suggestions)):
+                if name not in suggestions:
+                    suggestions.append(name)
+                    if len(suggestions) == limit:
+                        break
+        if not suggestions:
+            suggestions = self._fuzzy(term, limit)
+        return suggestions
+
+    def _fuzzy(self, term, limit):
+        """Finds the page names sharing at least FUZZY_THRESHOLD of the trigrams of the lowercased term.
+
+        Returns:
+            A list of page names, the most similar first.
+        """
+        ngrams = _ngrams(term)
+        if not ngrams:
+            return []
+        shared = {}
+        with self._lock:
+            for ngram in ngrams:
+                for name in self._postings.get(ngram, ()):
+                    shared[name] = shared.get(name, 0) + 1
+        similar = [(count / len(ngrams), name)
+                   for name, count in shared.items()
+                   if count / len(ngrams) >= FUZZY_THRESHOLD]
+        best = heapq.nsmallest(limit,
+                               similar,
+                               key=lambda item:
+                               (-item[0], len(item[1]), item[1]))
+        return [name for _, name in best]
+
+
+class _TextExtractor(parser.HTMLParser):
+    """Collects the text of an HTML document, leaving out the tags and the content of IGNORED_TAGS."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.text = []
+        self._ignored = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in IGNORED_TAGS:
+            self._ignored += 1
+
+    def handle_endtag(self, tag):
+        if tag in IGNORED_TAGS and self._ignored:
+            self._ignored -= 1
+
+    def handle_data(self, data):
+        if not self._ignored:
+            self.handle_text(data)
+
+    def handle_text(self, text):
+        self.text.append(text)
+
+
+class WordCounter(_TextExtractor):
+    """Counts the words of an HTML document fed in chunks of bytes, without keeping the document or its text.
+
+    The bytes are decoded as UTF-8 as they come, replacing invalid sequences. A word cut between two chunks is held
+    back until the next piece of text, and tags separate words, so the words are the same as those of strip_tags.
+
+    Attributes:
+        counts: how many times each lowercase word appears in the text.
+        length: the number of words in the text.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.counts = {}
+        self.length = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._partial = ""
+
+    def feed_bytes(self, chunk):
+        """Counts the words of the next chunk of the document."""
+        self.feed(self._decoder.decode(chunk))
+
+    def close(self):
+        """Counts the words left at the end of the document."""
+        self.feed(self._decoder.decode(b"", final=True))
+        super().close()
+        self._flush()
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        super().handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        self._flush()
+        super().handle_endtag(tag)
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_text(self, text):
+        text = self._partial + text
+        self._partial = ""
+        words = tokenize(text)
+        if words and _TOKEN.match(text[-1]):
+            self._partial = words.pop()
+        self._count(words)
+
+    def _flush(self):
+        if self._partial:
+            self._count([self._partial])
+            self._partial = ""
+
+    def _count(self, words):
+        for word in words:
+            self.counts[word] = self.counts.get(word, 0) + 1
+        self.length += len(words)
+
+
+def strip_tags(html):
+    """Returns the text of an HTML document without its tags."""
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return " ".join(extractor.text)
+
+
+def tokenize(text):
+    """Splits text into lowercase words."""
+    return _TOKEN.findall(text.lower())
+
+
+class ContentIndex:
+    """An inverted index over the text of the wiki pages, ranking the pages matching a search with BM25.
+
+    Each word is mapped to the pages containing it and how many times it appears in each of them, so a search only
+    looks at the pages containing one of its words. The words of each page are kept too, so a page is removed without
+    scanning the vocabulary. The index is saved as a compact segment file with dumps.
+
+    A small index of the pages changed since a segment file was saved is a delta: merging it into the index of the
+    segment file replaces the pages it holds and removes the pages it removed.
+
+    Attributes:
+        removed: the names of the pages remove was called with, which merging the index as a delta removes.
+    """
+
+    def __init__(self):
+        """Initializes an index without any page."""
+        self.removed = set()
+        self._lengths = {}
+        self._postings = {}
+        self._words = {}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def __contains__(self, name):
+        return name in self._lengths
+
+    def add(self, name, html):
+        """Indexes the text of a page, replacing the previous version of the page.
+
+        Args:
+            name: the name of the page.
+            html: the HTML content of the page.
+        """
+        words = WordCounter()
+        words.feed(html)
+        words.close()
+        self.add_words(name, words)
+
+    def add_words(self, name, words):
+        """Indexes the words of a page counted by a WordCounter, replacing the previous version of the page.
+
+        Args:
+            name: the name of the page.
+            words: the closed WordCounter of the content of the page.
+        """
+        self._discard(name)
+        for word, count in words.counts.items():
+            self._postings.setdefault(word, {})[name] = count
+        self._words[name] = list(words.counts)
+        self._lengths[name] = words.length
+        self._total_length += words.length
+
+    def remove(self, name):
+        """Removes a page from the index, if it is in it, and records it in removed."""
+        self._discard(name)
+        self.removed.add(name)
+
+    def _discard(self, name):
+        length = self._lengths.pop(name, None)
+        if length is None:
+            return
+        self._total_length -= length
+        for word in self._words.pop(name):
+            del self._postings[word][name]
+            if not self._postings[word]:
+                del self._postings[word]
+
+    def merge(self, delta):
+        """Applies a delta to the index: the pages it removed are removed, and the pages it holds replace ours.
+
+        Args:
+            delta: the ContentIndex of the pages changed since this index was saved.
+        """
+        for name in delta.removed | delta._lengths.keys():
+            self._discard(name)
+        for word, pages in delta._postings.items():
+            self._postings.setdefault(word, {}).update(pages)
+        for name, length in delta._lengths.items():
+            self._words[name] = list(delta._words[name])
+            self._lengths[name] = length
+            self._total_length += length
+
+    def search(self, query, limit=10):
+        """Ranks the pages containing the words of the query with BM25.
+
+        Args:
+            query: the text to search for.
+            limit: the maximum number of pages to return.
+
+        Returns:
+            A list of the names of the best matching pages, the best first.
+        """
+        if not self._lengths:
+            return []
+        average_length = self._total_length / len(self._lengths) or 1
+        scores = {}
+        for word in set(tokenize(query)):
+            pages = self._postings.get(word)
+            if not pages:
+                continue
+            idf = math.log(1 + (len(self._lengths) - len(pages) + 0.5) /
+                           (len(pages) + 0.5))
+            for name, count in pages.items():
+                length_norm = 1 - BM25_B + BM25_B * self._lengths[
+                    name] / average_length
+                scores[name] = scores.get(name, 0) + idf * count * (
+                    BM25_K1 + 1) / (count + BM25_K1 * length_norm)
+        best = heapq.nsmallest(limit,
+                               scores.items(),
+                               key=lambda item: (-item[1], item[0]))
+        return [name for name, _ in best]
+
+    def dumps(self):
+        """Returns the index as a segment file: compressed JSON numbering the pages, so each posting is two numbers.
+
+        The words of each page are not saved, since loads finds them in the postings.
+        """
+        names = sorted(self._lengths)
+        ids = {name: i for i, name in enumerate(names)}
+        postings = {}
+        for word, pages in self._postings.items():
+            flat = []
+            for name, count in pages.items():
+                flat += [ids[name], count]
+            postings[word] = flat
+        segment = {
+            "version": SEGMENT_VERSION,
+            "names": names,
+            "lengths": [self._lengths[name] for name in names],
+            "postings": postings,
+            "removed": sorted(self.removed)
+        }
+        return zlib.compress(
+            json.dumps(segment, separators=(",", ":")).encode())
+
+    @classmethod
+    def loads(cls, data):
+        """Reads an index from a segment file written by dumps.
+
+        Raises:
+            ValueError: if the segment file was written by another version.
+        """
+        segment = json.loads(zlib.decompress(data))
+        if segment["version"] != SEGMENT_VERSION:
+            raise ValueError(
+                f"Unsupported search segment version {segment['version']}")
+        index = cls()
+        names = segment["names"]
+        index._lengths = dict(zip(names, segment["lengths"]))
+        index._total_length = sum(segment["lengths"])
+        index.removed = set(segment.get("removed", ()))
+        for name in names:
+            index._words[name] = []
+        for word, flat in segment["postings"].items():
+            pages = {}
+            for i in range(0, len(flat), 2):
+                name = names[flat[i]]
+                pages[name] = flat[i + 1]
+                index._words[name].append(word)
+            index._postings[word] = pages
+        return index
@@ -0,0 +1,129 @@
+from flaskr import search
+
+
+def test_name_index_search():
+    """Tests that the names containing the term are found, ignoring case."""
+    index = search.NameIndex(
+        ["cpu.html", "CPU-coolers.html", "gpu.html", "psu.html", "ram.html"])
+
+    assert index.search("cpu") == ["CPU-coolers.html", "cpu.html"]
+    assert index.search("PU.") == ["cpu.html", "gpu.html"]
+    assert index.search("u") == [
+        "CPU-coolers.html", "cpu.html", "gpu.html", "psu.html"
+    ]
+    assert index.search("coolers.html") == ["CPU-coolers.html"]
+    assert index.search("cpu.htm", limit=1) == ["cpu.html"]
+    assert index.search("") == [
+        "CPU-coolers.html", "cpu.html", "gpu.html", "psu.html", "ram.html"
+    ]
+    assert index.search("ssd") == []
+    assert index.search("cpx.html") == []
+
+
+def test_name_index_only_matches_substrings():
+    """Tests that names holding every trigram of the term, but not the term itself, are not matched."""
+    index = search.NameIndex(["abcxbcd.html", "abcd.html"])
+
+    assert index.search("abcd") == ["abcd.html"]
+
+
+def test_name_index_update():
+    """Tests that updating the index adds and removes names."""
+    index = search.NameIndex(["cpu.html", "gpu.html"])
+    page_names = ["gpu.html", "psu.html"]
+    index.update(page_names)
+
+    assert index.source is page_names
+    assert len(index) == 2
+    assert index.search("u.") == ["gpu.html", "psu.html"]
+    assert index.search("cpu") == []
+
+
+def test_strip_tags():
+    """Tests that the tags, scripts and styles are left out of the text."""
+    text = search.strip_tags(
+        "<style>p {}</style><p>Fast &amp; <b>quiet</b></p><script>x()</script>")
+
+    assert search.tokenize(text) == ["fast", "quiet"]
+
+
+def test_word_counter_chunks():
+    """Tests that words and characters cut between chunks are counted once, like the words of strip_tags."""
+    html = "<p>Fast <b>CPU</b>s: caf\u00e9 &amp; caf\u00e9</p><script>x</script>".encode(
+    )
+    words = search.WordCounter()
+    for i in range(0, len(html), 3):
+        words.feed_bytes(html[i:i + 3])
+    words.close()
+
+    assert words.counts == {"fast": 1, "cpu": 1, "s": 1, "caf\u00e9": 2}
+    assert words.length == 5
+    assert sorted(words.counts) == sorted(
+        set(search.tokenize(search.strip_tags(html.decode()))))
+
+
+def test_content_index_ranking():
+    """Tests that pages are ranked by how often and how rare the query words appear in them."""
+    index = search.ContentIndex()
+    index.add("cpu.html", "<p>The processor and the cooler.</p>")
+    index.add("cooler.html", "<p>The cooler cools the cooler processor.</p>")
+    index.add("case.html", "<p>The case holds the parts.</p>")
+
+    assert index.search("cooler") == ["cooler.html", "cpu.html"]
+    assert index.search("cooler processor", limit=1) == ["cooler.html"]
+    assert index.search("the") == ["case.html", "cpu.html", "cooler.html"]
+    assert index.search("fan") == []
+
+
+def test_content_index_update_and_segment():
+    """Tests that pages can be replaced and removed, and that the index survives a segment file round trip."""
+    index = search.ContentIndex()
+    index.add("cpu.html", "<p>processor</p>")
+    index.add("gpu.html", "<p>graphics</p>")
+    index.add("cpu.html", "<p>central processing unit</p>")
+    index.remove("gpu.html")
+    index.remove("missing.html")
+
+    loaded = search.ContentIndex.loads(index.dumps())
+    assert len(loaded) == 1
+    assert "cpu.html" in loaded
+    assert loaded.search("processing") == ["cpu.html"]
+    assert loaded.search("processor graphics") == []
+
+
+def test_name_index_suggest():
+    """Tests that prefix matches are suggested first, then other matches, then similar names."""
+    index = search.NameIndex([
+        "cpu.html", "CPU-coolers.html", "gpu.html", "processor.html",
+        "case.html"
+    ])
+
+    assert index.suggest("cpu") == ["CPU-coolers.html", "cpu.html"]
+    assert index.suggest("pu") == ["CPU-coolers.html", "cpu.html", "gpu.html"]
+    assert index.suggest("c", limit=2) == ["case.html", "CPU-coolers.html"]
+    assert index.suggest("procesor") == ["processor.html"]
+    assert index.suggest("keyboard") == []
+    assert index.suggest("") == []
+
+    index.update(["gpu.html", "processor.html"])
+    assert index.suggest("cpu") == []
+    assert index.suggest("g") == ["gpu.html"]
+
+
+def test_content_index_merge_delta():
+    """Tests that merging a delta replaces and removes pages, also after a segment file round trip."""
+    index = search.ContentIndex()
+    index.add("cpu.html", "<p>processor</p>")
+    index.add("gpu.html", "<p>graphics processor</p>")
+    delta = search.ContentIndex()
+    delta.remove("gpu.html")
+    delta.add("cpu.html", "<p>central unit</p>")
+    delta.add("psu.html", "<p>power unit</p>")
+
+    index.merge(search.ContentIndex.loads(delta.dumps()))
+    assert len(index) == 2
+    assert index.removed == set()
+    assert index.search("processor") == []
+    assert index.search("unit") == ["cpu.html", "psu.html"]
+    index.remove("psu.html")
+    assert index.search("unit power") == ["cpu.html"]
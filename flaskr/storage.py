@@ -0,0 +1,520 @@
+from google.api_core import exceptions
+from google.cloud import storage
+import base64
+import collections
+import datetime
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import random
+import threading
+import time
+import urllib.parse
+
+
+class Storage:
+    """Where the Backend buckets come from.
+
+    Backend only uses the subset of the google-cloud-storage bucket and blob API that StoredBlob and Bucket
+    implement, so any Storage can stand in for GCS.
+    """
+
+    def bucket(self, name):
+        """Returns the bucket with the given name.
+
+        Args:
+            name: the name of the bucket.
+        """
+        raise NotImplementedError
+
+
+class GCSStorage(Storage):
+    """Buckets stored on Google Cloud Storage.
+
+    Attributes:
+        client: the google-cloud-storage client.
+    """
+
+    def __init__(self):
+        """Initializes the connection with GCS."""
+        self.client = storage.Client()
+
+    def bucket(self, name):
+        return self.client.bucket(name)
+
+
+class StoredBlob:
+    """A blob of a Bucket that is not stored on GCS, behaving like google.cloud.storage.Blob.
+
+    Attributes:
+        bucket: the bucket the blob belongs to.
+        name: the name of the blob.
+        generation: the generation of the blob when its metadata was last read, None if unknown.
+        metadata: the custom metadata of the blob.
+        content_type: the content type of the blob.
+        size: the size in bytes of the blob.
+        md5_hash: the base64 encoded MD5 of the blob content.
+        updated: the datetime of the last upload of the blob.
+        content_encoding: the Content-Encoding of the blob content, like gzip, None if it is not encoded. Unlike GCS,
+            encoded blobs are always downloaded as stored, as if raw_download was True.
+        chunk_size: the size of the requests of resumable uploads on GCS. Stored blobs are written at once.
+    """
+
+    def __init__(self, bucket, name, properties=None):
+        """Initializes the blob with the properties read from its bucket, if it exists."""
+        self.bucket = bucket
+        self.name = name
+        self.chunk_size = None
+        self.generation = None
+        self.metadata = None
+        self.content_type = None
+        self.size = None
+        self.md5_hash = None
+        self.updated = None
+        self.content_encoding = None
+        if properties is not None:
+            self._set_properties(properties)
+
+    def _set_properties(self, properties):
+        self.generation = properties["generation"]
+        self.metadata = properties["metadata"]
+        self.content_type = properties["content_type"]
+        self.size = properties["size"]
+        self.md5_hash = properties["md5_hash"]
+        self.updated = datetime.datetime.fromtimestamp(properties["updated"],
+                                                       datetime.timezone.utc)
+        self.content_encoding = properties.get("content_encoding")
+
+    def exists(self):
+        return self.bucket._stat(self.name) is not None
+
+    def reload(self):
+        properties = self.bucket._stat(self.name)
+        if properties is None:
+            raise exceptions.NotFound(self.name)
+        self._set_properties(properties)
+
+    def download_as_bytes(self,
+                          start=None,
+                          end=None,
+                          raw_download=False,
+                          if_generation_match=None):
+        if if_generation_match is not None:
+            self.bucket._check_generation(self.name,
+                                          self.bucket._stat(self.name),
+                                          if_generation_match)
+        return self.bucket._read(self.name, start, end)
+
+    def download_as_string(self):
+        return self.download_as_bytes()
+
+    def download_as_text(self):
+        return self.download_as_bytes().decode()
+
+    def upload_from_string(self,
+                           data,
+                           content_type="text/plain",
+                           if_generation_match=None):
+        if isinstance(data, str):
+            data = data.encode()
+        properties = self.bucket._write(self.name, data, content_type,
+                                        self.metadata, if_generation_match,
+                                        self.content_encoding)
+        self._set_properties(properties)
+
+    def upload_from_file(self,
+                         file_obj,
+                         content_type=None,
+                         if_generation_match=None):
+        self.upload_from_string(file_obj.read(),
+                                content_type=content_type or
+                                getattr(file_obj, "content_type", None),
+                                if_generation_match=if_generation_match)
+
+    def delete(self, if_generation_match=None):
+        self.bucket._remove(self.name, if_generation_match)
+
+
+class Bucket:
+    """A bucket that is not stored on GCS, behaving like google.cloud.storage.Bucket.
+
+    Subclasses store the blobs by implementing _stat, _read, _write, _remove and _list.
+
+    Attributes:
+        name: the name of the bucket.
+    """
+
+    def __init__(self, name):
+        """Initializes the bucket with the given name."""
+        self.name = name
+
+    def blob(self, name):
+        return StoredBlob(self, name)
+
+    def get_blob(self, name):
+        properties = self._stat(name)
+        if properties is None:
+            return None
+        return StoredBlob(self, name, properties)
+
+    def list_blobs(self, prefix=None):
+        for name, properties in self._list(prefix or ""):
+            yield StoredBlob(self, name, properties)
+
+    def copy_blob(self,
+                  blob,
+                  destination_bucket,
+                  new_name=None,
+                  if_generation_match=None):
+        properties = self._stat(blob.name)
+        if properties is None:
+            raise exceptions.NotFound(blob.name)
+        new_blob = destination_bucket.blob(new_name or blob.name)
+        new_blob.metadata = properties["metadata"]
+        new_blob.content_encoding = properties.get("content_encoding")
+        new_blob.upload_from_string(self._read(blob.name),
+                                    content_type=properties["content_type"],
+                                    if_generation_match=if_generation_match)
+        return new_blob
+
+    def _properties(self,
+                    data,
+                    content_type,
+                    metadata,
+                    current,
+                    content_encoding=None):
+        """Returns the properties of a new version of a blob.
+
+        Args:
+            data: the content of the new version.
+            content_type: the content type of the new version.
+            metadata: the custom metadata of the new version.
+            current: the properties of the version being replaced, None if the blob does not exist.
+            content_encoding: the Content-Encoding of the new version, None if it is not encoded.
+        """
+        # Like GCS, generations are timestamps in microseconds, but they must
+        # keep increasing even if two uploads happen within one microsecond.
+        generation = time.time_ns() // 1000
+        if current is not None and generation <= current["generation"]:
+            generation = current["generation"] + 1
+        return {
+            "generation": generation,
+            "metadata": metadata,
+            "content_type": content_type,
+            "content_encoding": content_encoding,
+            "size": len(data),
+            "md5_hash": base64.b64encode(hashlib.md5(data).digest()).decode(),
+            "updated": time.time()
+        }
+
+    @staticmethod
+    def _check_generation(name, current, if_generation_match):
+        """Raises the error GCS would for a failed generation precondition.
+
+        Args:
+            name: the name of the blob.
+            current: the properties of the blob, None if it does not exist.
+            if_generation_match: the expected generation, 0 if the blob must not exist, None for no precondition.
+        """
+        if if_generation_match is None:
+            return
+        generation = current["generation"] if current is not None else 0
+        if generation != if_generation_match:
+            raise exceptions.PreconditionFailed(
+                f"{name} has generation {generation}, not {if_generation_match}"
+            )
+
+    def _stat(self, name):
+        """Returns the properties of a blob, None if it does not exist."""
+        raise NotImplementedError
+
+    def _read(self, name, start=None, end=None):
+        """Returns the content of a blob, raising NotFound if it does not exist.
+
+        Like GCS, start and end are the first and last byte to read, both included. None reads from the beginning or to
+        the end.
+        """
+        raise NotImplementedError
+
+    def _write(self,
+               name,
+               data,
+               content_type,
+               metadata,
+               if_generation_match,
+               content_encoding=None):
+        """Stores a new version of a blob and returns its properties."""
+        raise NotImplementedError
+
+    def _remove(self, name, if_generation_match):
+        """Deletes a blob, raising NotFound if it does not exist."""
+        raise NotImplementedError
+
+    def _list(self, prefix):
+        """Returns a list of the name and properties of the blobs starting with prefix, sorted by name."""
+        raise NotImplementedError
+
+
+class LocalStorage(Storage):
+    """Buckets stored as directories on the local disk, for edge replicas, development and benchmarks.
+
+    Attributes:
+        root: the directory holding one directory per bucket.
+        use_mmap: True to read blobs through memory maps.
+    """
+
+    def __init__(self, root, use_mmap=False):
+        """Initializes the storage in the given directory."""
+        self.root = root
+        self.use_mmap = use_mmap
+
+    def bucket(self, name):
+        return LocalBucket(name, os.path.join(self.root, name), self.use_mmap)
+
+
+class LocalBucket(Bucket):
+    """A bucket stored in a directory of the local disk.
+
+    Every blob is a file in the objects directory and its properties are a JSON file in the properties directory.
+    Blob names are percent-encoded into flat file names. Writers take an exclusive lock on the bucket and readers a
+    shared one, so several processes can use the same directory.
+
+    Attributes:
+        path: the directory of the bucket.
+        use_mmap: True to read blobs through memory maps.
+    """
+
+    def __init__(self, name, path, use_mmap=False):
+        """Initializes the bucket, creating its directories if needed."""
+        super().__init__(name)
+        self.path = path
+        self.use_mmap = use_mmap
+        os.makedirs(os.path.join(path, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(path, "properties"), exist_ok=True)
+        os.makedirs(os.path.join(path, "tmp"), exist_ok=True)
+
+    def _lock(self, operation):
+        lock_file = open(os.path.join(self.path, ".lock"), "a")
+        fcntl.flock(lock_file, operation)
+        return lock_file
+
+    def _file_name(self, name):
+        return urllib.parse.quote(name, safe="")
+
+    def _object_path(self, name):
+        return os.path.join(self.path, "objects", self._file_name(name))
+
+    def _properties_path(self, name):
+        return os.path.join(self.path, "properties", self._file_name(name))
+
+    def _load_properties(self, name):
+        try:
+            with open(self._properties_path(name)) as properties_file:
+                return json.load(properties_file)
+        except FileNotFoundError:
+            return None
+
+    def _replace(self, path, data):
+        temp_path = os.path.join(self.path, "tmp", os.path.basename(path))
+        with open(temp_path, "wb") as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+
+    def _stat(self, name):
+        with self._lock(fcntl.LOCK_SH):
+            return self._load_properties(name)
+
+    def _read(self, name, start=None, end=None):
+        start = start or 0
+        length = -1 if end is None else end + 1 - start
+        with self._lock(fcntl.LOCK_SH):
+            try:
+                with open(self._object_path(name), "rb") as object_file:
+                    if not self.use_mmap or os.fstat(
+                            object_file.fileno()).st_size == 0:
+                        object_file.seek(start)
+                        return object_file.read(length)
+                    with mmap.mmap(object_file.fileno(),
+                                   0,
+                                   access=mmap.ACCESS_READ) as mapped:
+                        if length < 0:
+                            return mapped[start:]
+                        return mapped[start:start + length]
+            except FileNotFoundError:
+                raise exceptions.NotFound(name)
+
+    def _write(self,
+               name,
+               data,
+               content_type,
+               metadata,
+               if_generation_match,
+               content_encoding=None):
+        with self._lock(fcntl.LOCK_EX):
+            current = self._load_properties(name)
+            self._check_generation(name, current, if_generation_match)
+            properties = self._properties(data, content_type, metadata, current,
+                                          content_encoding)
+            self._replace(self._object_path(name), data)
+            self._replace(self._properties_path(name),
+                          json.dumps(properties).encode())
+            return properties
+
+    def _remove(self, name, if_generation_match):
+        with self._lock(fcntl.LOCK_EX):
+            current = self._load_properties(name)
+            if current is None:
+                raise exceptions.NotFound(name)
+            self._check_generation(name, current, if_generation_match)
+            os.remove(self._properties_path(name))
+            os.remove(self._object_path(name))
+
+    def _list(self, prefix):
+        with self._lock(fcntl.LOCK_SH):
+            file_names = os.listdir(os.path.join(self.path, "properties"))
+            names = (
+                urllib.parse.unquote(file_name) for file_name in file_names)
+            return [(name, self._load_properties(name))
+                    for name in sorted(names)
+                    if name.startswith(prefix)]
+
+
+class MemoryStorage(Storage):
+    """Buckets kept in memory, with injectable latency and failures, for tests and benchmarks.
+
+    Every call that would be a round trip to GCS (get_blob, exists, download, upload, delete, list_blobs) sleeps for
+    latency seconds plus or minus a random jitter, and fails with ServiceUnavailable with probability error_rate.
+
+    Attributes:
+        latency: seconds each call takes.
+        jitter: maximum number of seconds added to or removed from the latency of each call.
+        error_rate: probability of each call failing.
+        calls: a Counter of the calls made, by operation: stat, read, write, remove and list.
+        random: the random number generator used for the jitter and failures.
+    """
+
+    def __init__(self, latency=0, jitter=0, error_rate=0, seed=None):
+        """Initializes the storage without any bucket."""
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = collections.Counter()
+        self.random = random.Random(seed)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, name):
+        with self._lock:
+            if name not in self._buckets:
+                self._buckets[name] = MemoryBucket(name, self)
+            return self._buckets[name]
+
+    def call(self, operation):
+        """Simulates a round trip to GCS for the given operation.
+
+        Args:
+            operation: the name the call is counted under.
+
+        Raises:
+            google.api_core.exceptions.ServiceUnavailable: the call was chosen to fail.
+        """
+        with self._lock:
+            self.calls[operation] += 1
+            delay = self.latency + self.random.uniform(-self.jitter,
+                                                       self.jitter)
+            fail = self.random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            raise exceptions.ServiceUnavailable(
+                f"Injected failure of {operation}")
+
+
+class MemoryBucket(Bucket):
+    """A bucket of a MemoryStorage.
+
+    Attributes:
+        storage: the MemoryStorage the bucket belongs to.
+    """
+
+    def __init__(self, name, storage):
+        """Initializes an empty bucket."""
+        super().__init__(name)
+        self.storage = storage
+        self._blobs = {}
+        self._lock = threading.Lock()
+
+    def _stat(self, name):
+        self.storage.call("stat")
+        with self._lock:
+            if name not in self._blobs:
+                return None
+            return self._blobs[name][1]
+
+    def _read(self, name, start=None, end=None):
+        self.storage.call("read")
+        with self._lock:
+            if name not in self._blobs:
+                raise exceptions.NotFound(name)
+            data = self._blobs[name][0]
+        if start is None and end is None:
+            return data
+        return data[start or 0:None if end is None else end + 1]
+
+    def _write(self,
+               name,
+               data,
+               content_type,
+               metadata,
+               if_generation_match,
+               content_encoding=None):
+        self.storage.call("write")
+        with self._lock:
+            current = self._blobs.get(name, (None, None))[1]
+            self._check_generation(name, current, if_generation_match)
+            properties = self._properties(data, content_type, metadata, current,
+                                          content_encoding)
+            self._blobs[name] = (data, properties)
+            return properties
+
+    def _remove(self, name, if_generation_match):
+        self.storage.call("remove")
+        with self._lock:
+            if name not in self._blobs:
+                raise exceptions.NotFound(name)
+            self._check_generation(name, self._blobs[name][1],
+                                   if_generation_match)
+            del self._blobs[name]
+
+    def _list(self, prefix):
+        self.storage.call("list")
+        with self._lock:
+            return [(name, self._blobs[name][1])
+                    for name in sorted(self._blobs)
+                    if name.startswith(prefix)]
+
+
+def from_config(config):
+    """Creates the Storage selected by the app config.
+
+    Args:
+        config: the Flask app config. STORAGE_BACKEND is "gcs", "local" or "memory". For "local" LOCAL_STORAGE_ROOT is
+            the directory holding the buckets and LOCAL_STORAGE_MMAP turns on memory-mapped reads. For "memory" the
+            buckets start empty, with MEMORY_STORAGE_LATENCY, MEMORY_STORAGE_JITTER and MEMORY_STORAGE_ERROR_RATE
+            injected into every call.
+
+    Returns:
+        The Storage for the Backend.
+    """
+    if config["STORAGE_BACKEND"] == "local":
+        return LocalStorage(config["LOCAL_STORAGE_ROOT"],
+                            config["LOCAL_STORAGE_MMAP"])
+    if config["STORAGE_BACKEND"] == "memory":
+        return MemoryStorage(config["MEMORY_STORAGE_LATENCY"],
+                             config["MEMORY_STORAGE_JITTER"],
+                             config["MEMORY_STORAGE_ERROR_RATE"])
+    if config["STORAGE_BACKEND"] == "gcs":
+        return GCSStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND {config['STORAGE_BACKEND']!r}")
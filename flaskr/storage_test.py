@@ -0,0 +1,183 @@
+from flaskr import storage
+from flaskr.backend import Backend
+from google.api_core import exceptions
+from unittest.mock import patch
+import io
+import pytest
+
+
+@pytest.fixture
+def bucket(tmp_path):
+    return storage.LocalStorage(str(tmp_path)).bucket("content")
+
+
+def test_local_upload_and_download(bucket):
+    """Tests that an uploaded blob can be retrieved with its properties."""
+    blob = bucket.blob("page.html")
+    blob.metadata = {"key": "value"}
+    blob.upload_from_string("<div>testing</div>", content_type="text/html")
+
+    stored = bucket.get_blob("page.html")
+    assert stored.download_as_bytes() == b"<div>testing</div>"
+    assert stored.generation == blob.generation
+    assert stored.metadata == {"key": "value"}
+    assert stored.content_type == "text/html"
+    assert stored.size == 18
+    assert bucket.get_blob("missing.html") is None
+    assert not bucket.blob("missing.html").exists()
+
+
+def test_local_generation_preconditions(bucket):
+    """Tests that generation preconditions are enforced like GCS does."""
+    blob = bucket.blob("info.json")
+    blob.upload_from_string("{}", if_generation_match=0)
+    with pytest.raises(exceptions.PreconditionFailed):
+        bucket.blob("info.json").upload_from_string("{}", if_generation_match=0)
+
+    first_generation = blob.generation
+    blob.upload_from_string('{"a": 1}', if_generation_match=first_generation)
+    assert blob.generation > first_generation
+    with pytest.raises(exceptions.PreconditionFailed):
+        blob.upload_from_string("{}", if_generation_match=first_generation)
+    assert bucket.get_blob("info.json").download_as_bytes() == b'{"a": 1}'
+
+
+def test_local_list_copy_and_delete(bucket):
+    """Tests listing blobs by prefix, copying and deleting them."""
+    bucket.blob("users/a.json").upload_from_string("{}")
+    bucket.blob("users/b.json").upload_from_string("{}")
+    bucket.blob("page.html").upload_from_file(io.BytesIO(b"<p></p>"))
+
+    assert [blob.name for blob in bucket.list_blobs()
+           ] == ["page.html", "users/a.json", "users/b.json"]
+    assert [blob.name for blob in bucket.list_blobs(prefix="users/")
+           ] == ["users/a.json", "users/b.json"]
+
+    bucket.copy_blob(bucket.get_blob("page.html"), bucket, new_name="copy.html")
+    assert bucket.get_blob("copy.html").download_as_bytes() == b"<p></p>"
+
+    bucket.get_blob("page.html").delete()
+    assert bucket.get_blob("page.html") is None
+    with pytest.raises(exceptions.NotFound):
+        bucket.blob("page.html").delete()
+
+
+def test_local_mmap_reads(tmp_path):
+    """Tests that memory-mapped reads return the same content."""
+    bucket = storage.LocalStorage(str(tmp_path), use_mmap=True).bucket("c")
+    bucket.blob("page.html").upload_from_string("<div>testing</div>")
+    bucket.blob("empty.html").upload_from_string("")
+
+    assert bucket.get_blob(
+        "page.html").download_as_bytes() == b"<div>testing</div>"
+    assert bucket.get_blob("empty.html").download_as_bytes() == b""
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_local_ranged_reads(tmp_path, use_mmap):
+    """Tests that ranged reads return the bytes from start to end, both included."""
+    bucket = storage.LocalStorage(str(tmp_path), use_mmap=use_mmap).bucket("c")
+    bucket.blob("page.html").upload_from_string("0123456789")
+    blob = bucket.get_blob("page.html")
+
+    assert blob.download_as_bytes(start=2, end=4) == b"234"
+    assert blob.download_as_bytes(start=8) == b"89"
+    assert blob.download_as_bytes(end=1) == b"01"
+    assert blob.download_as_bytes(
+        start=0, if_generation_match=blob.generation) == b"0123456789"
+    with pytest.raises(exceptions.PreconditionFailed):
+        blob.download_as_bytes(if_generation_match=blob.generation + 1)
+
+
+def test_backend_on_local_storage(tmp_path):
+    """Tests the Backend end to end without GCS."""
+    local = storage.LocalStorage(str(tmp_path))
+    local.bucket("awesomewikicontent").blob("info.json").upload_from_string(
+        "{}")
+    be = Backend(local)
+
+    assert be.sign_up("user", "password") == True
+    assert be.sign_up("user", "password") == False
+    assert be.sign_in("user", "password") == True
+    file = io.BytesIO(b"<div>testing</div>")
+    file.filename = "test.html"
+    assert be.upload("user", "testing", file) == True
+    assert be.get_all_page_names() == ["testing.html"]
+    assert be.get_wiki_page("testing.html") == "<div>testing</div>"
+    assert be.get_user_files("user") == ["testing.html"]
+    assert be.get_contributors() == ["user"]
+    assert be.change_username("user", "user1") == True
+    assert be.sign_in("user1", "password") == True
+    assert be.get_user_files("user1") == ["testing.html"]
+
+
+def test_from_config(tmp_path):
+    """Tests that the storage is selected by the app config."""
+    local = storage.from_config({
+        "STORAGE_BACKEND": "local",
+        "LOCAL_STORAGE_ROOT": str(tmp_path),
+        "LOCAL_STORAGE_MMAP": True
+    })
+    assert isinstance(local, storage.LocalStorage)
+    assert local.use_mmap
+
+    with pytest.raises(ValueError):
+        storage.from_config({"STORAGE_BACKEND": "ftp"})
+
+
+def test_memory_storage_behaves_like_local():
+    """Tests uploads, preconditions and listing of the in-memory buckets."""
+    bucket = storage.MemoryStorage().bucket("content")
+    bucket.blob("users/a.json").upload_from_string("{}", if_generation_match=0)
+    bucket.blob("page.html").upload_from_string("<p></p>")
+    with pytest.raises(exceptions.PreconditionFailed):
+        bucket.blob("page.html").upload_from_string("", if_generation_match=0)
+
+    assert bucket.get_blob("page.html").download_as_bytes() == b"<p></p>"
+    assert [blob.name for blob in bucket.list_blobs()
+           ] == ["page.html", "users/a.json"]
+    assert [blob.name for blob in bucket.list_blobs(prefix="users/")
+           ] == ["users/a.json"]
+    assert storage.MemoryStorage().bucket("content").get_blob(
+        "page.html") is None
+
+
+def test_memory_storage_counts_calls():
+    """Tests that every simulated round trip is counted by operation."""
+    memory = storage.MemoryStorage()
+    bucket = memory.bucket("content")
+    bucket.blob("page.html").upload_from_string("<p></p>")
+    bucket.get_blob("page.html").download_as_bytes()
+    list(bucket.list_blobs())
+
+    assert memory.calls == {"write": 1, "stat": 1, "read": 1, "list": 1}
+
+
+def test_memory_storage_latency():
+    """Tests that the latency and jitter are added to every call."""
+    memory = storage.MemoryStorage(latency=0.01, jitter=0.005, seed=1)
+    bucket = memory.bucket("content")
+
+    with patch('time.sleep') as mock_sleep:
+        bucket.get_blob("page.html")
+        bucket.get_blob("page.html")
+    delays = [call.args[0] for call in mock_sleep.call_args_list]
+    assert len(delays) == 2
+    assert all(0.005 <= delay <= 0.015 for delay in delays)
+    assert delays[0] != delays[1]
+
+
+def test_memory_storage_error_injection():
+    """Tests that calls fail with the configured probability."""
+    failing = storage.MemoryStorage(error_rate=1).bucket("content")
+    with pytest.raises(exceptions.ServiceUnavailable):
+        failing.get_blob("page.html")
+
+    flaky = storage.MemoryStorage(error_rate=0.5, seed=1).bucket("content")
+    failures = 0
+    for _ in range(200):
+        try:
+            flaky.get_blob("page.html")
+        except exceptions.ServiceUnavailable:
+            failures += 1
+    assert 50 < failures < 150